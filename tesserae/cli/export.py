@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Export the results of a Tesserae search.
+
+Writes every match of a finished search to a CSV, TSV or JSON Lines file,
+streaming from the database so that large result sets fit in memory.
+"""
+
+import argparse
+import getpass
+import sys
+
+from tesserae.db import TessMongoConnection
+from tesserae.utils.export import EXPORT_FORMATS, export_results
+from tesserae.utils.retrieve import SORT_KEYS
+
+
+def parse_args(args=None):
+    p = argparse.ArgumentParser(
+        prog='tesserae_export',
+        description='Export the results of a Tesserae search.')
+
+    db = p.add_argument_group(
+        title='database',
+        description='database connection details')
+    output = p.add_argument_group(
+        title='output',
+        description='what to write and where')
+
+    p.add_argument('results_id',
+                   type=str,
+                   help='results id of the search to export')
+
+    db.add_argument('--user',
+                    type=str,
+                    default=None,
+                    help='user to access the database as')
+    db.add_argument('--password',
+                    action='store_true',
+                    help='pass to be prompted for a database password')
+    db.add_argument('--host',
+                    type=str,
+                    default='127.0.0.1',
+                    help='the host name or IP address of the MongoDB database')
+    db.add_argument('--port',
+                    type=int,
+                    default=27017,
+                    help='the port that the database listens on')
+    db.add_argument('--database',
+                    type=str,
+                    default='tesserae',
+                    help='the name of the database to access')
+
+    output.add_argument('--format', choices=EXPORT_FORMATS, default='csv',
+                        help='file format to write')
+    output.add_argument('--output', type=str, default=None,
+                        help='file to write to (default: standard output)')
+    output.add_argument('--sort-by', choices=SORT_KEYS, default=None,
+                        help='order results by this field')
+    output.add_argument('--sort-order', choices=['descending', 'ascending'],
+                        default='descending', help='direction of the sort')
+    output.add_argument('--batch-size', type=int, default=1000,
+                        help='number of matches to read at a time')
+
+    return p.parse_args(args)
+
+
+def main():
+    """Export the results of a search."""
+    args = parse_args()
+    if args.password:
+        password = getpass.getpass(prompt='Tesserae MongoDB Password: ')
+    else:
+        password = None
+
+    connection = TessMongoConnection(
+        args.host, args.port, args.user, password, db=args.database)
+
+    if args.output is None:
+        out = sys.stdout
+    else:
+        out = open(args.output, 'w', newline='', encoding='utf-8')
+    try:
+        count = export_results(
+            connection, args.results_id, out, file_format=args.format,
+            sort_by=args.sort_by, sort_order=args.sort_order,
+            batch_size=args.batch_size)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f'Exported {count} results.', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
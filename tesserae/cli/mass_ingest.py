@@ -61,7 +61,7 @@ import sys
 from tqdm import tqdm
 
 from tesserae.db import TessMongoConnection, Text
-from tesserae.utils.ingest import ingest_text
+from tesserae.utils.ingest import ingest_text, ingest_texts
 
 
 def parse_args(args=None):
@@ -93,6 +93,13 @@ def parse_args(args=None):
         default=default_level,
         help=f'logging level (default: {default_level})')
 
+    p.add_argument(
+        '--processes',
+        type=int,
+        default=None,
+        help=('number of processes to featurize texts with; if not given, '
+            'texts are ingested one at a time in this process'))
+
     return p.parse_args(args)
 
 
@@ -127,6 +134,21 @@ def main():
     with open(args.ingest) as ifh:
         texts = [Text.json_decode(t) for t in json.load(ifh)]
 
+    if args.processes is not None:
+        ingested = ingest_texts(conn, texts, processes=args.processes)
+        try:
+            for text, error in tqdm(ingested, total=len(texts)):
+                if error is None:
+                    logger.info(f'Ingested: {text.author}\t{text.title}')
+                else:
+                    logger.error(
+                        f'Failed to ingest: {text.author}\t{text.title}\n'
+                        f'{error}')
+        except KeyboardInterrupt:
+            logger.info('KeyboardInterrupt')
+            sys.exit(1)
+        return
+
     for text in tqdm(texts):
         logger.info(f'Starting ingest: {text.author}\t{text.title}')
         try:
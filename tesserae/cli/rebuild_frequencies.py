@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Rebuild the feature frequency collections of a Tesserae database.
+
+Databases ingested before per-text and corpus frequencies were recorded must
+be rebuilt once before they can be searched with corpus stoplists.
+"""
+
+import argparse
+import getpass
+
+from tesserae.db import TessMongoConnection
+from tesserae.utils.frequencies import rebuild_frequencies
+
+
+def parse_args(args=None):
+    p = argparse.ArgumentParser(
+        prog='tesserae_rebuild_frequencies',
+        description='Rebuild the feature frequency collections.')
+
+    db = p.add_argument_group(
+        title='database',
+        description='database connection details')
+
+    db.add_argument('--user',
+                    type=str,
+                    default=None,
+                    help='user to access the database as')
+    db.add_argument('--password',
+                    action='store_true',
+                    help='pass to be prompted for a database password')
+    db.add_argument('--host',
+                    type=str,
+                    default='127.0.0.1',
+                    help='the host name or IP address of the MongoDB database')
+    db.add_argument('--port',
+                    type=int,
+                    default=27017,
+                    help='the port that the database listens on')
+    db.add_argument('--database',
+                    type=str,
+                    default='tesserae',
+                    help='the name of the database to access')
+
+    return p.parse_args(args)
+
+
+def main():
+    """Rebuild the frequency collections from the Feature documents."""
+    args = parse_args()
+    if args.password:
+        password = getpass.getpass(prompt='Tesserae MongoDB Password: ')
+    else:
+        password = None
+
+    connection = TessMongoConnection(
+        args.host, args.port, args.user, password, db=args.database)
+    rebuild_frequencies(connection)
+
+
+if __name__ == '__main__':
+    main()
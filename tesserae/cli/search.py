@@ -7,12 +7,15 @@ computed components are inserted into the database.
 
 import argparse
 import getpass
+import logging
 import time
 import uuid
 
 from tesserae.db import TessMongoConnection
 from tesserae.db.entities import Search
-from tesserae.matchers.sparse_encoding import SparseMatrixSearch
+from tesserae.matchers.sparse_encoding import DEFAULT_MIN_SCORE, \
+        SparseMatrixSearch
+from tesserae.matchers.text_options import TextOptions
 from tesserae.utils.ingest import ingest_text
 
 
@@ -74,10 +77,17 @@ def parse_args(args=None):
                       help='maximum allowable ditance between match tokens')
     text.add_argument('--distance-metric', choices=['span', 'frequency'],
                       default='span', help='')
-    text.add_argument('--min-score', type=int, default=6,
+    text.add_argument('--min-score', type=int, default=DEFAULT_MIN_SCORE,
                       help='size of the stoplist')
-    text.add_argument('--parallel', action='store_true',
-                      help='enable parallel processing during search')
+    text.add_argument('--parallel', type=int, nargs='?', const=True,
+                      default=False,
+                      help=('enable parallel processing during search, '
+                            'optionally with the given number of processes'))
+    text.add_argument('--top-k', type=int, default=None,
+                      help='only keep this many of the best scoring matches')
+    text.add_argument('--memory-budget', type=int, default=None,
+                      help=('approximate number of bytes to use while '
+                            'matching each block of source units'))
 
     return p.parse_args(args)
 
@@ -89,6 +99,8 @@ def main():
     All computed components are inserted into the database.
     """
     args = parse_args()
+    # show the matcher's reports on stoplist creation and source blocks
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     if args.password:
         password = getpass(prompt='Tesserae MongoDB Password: ')
     else:
@@ -102,10 +114,12 @@ def main():
 
     engine = SparseMatrixSearch(connection)
     start = time.time()
-    search = Search(results_id=uuid.uuid4().hex)
+    search = Search(results_id=uuid.uuid4().hex, status=Search.RUN)
     connection.insert(search)
-    texts, params, matches = engine.match(search,
-                  [source, target], args.unit, args.feature,
+    matches = engine.match(search.id,
+                  TextOptions(source, args.unit),
+                  TextOptions(target, args.unit),
+                  args.feature,
                   stopwords=args.n_stopwords,
                   stopword_basis=args.stopword_basis,
                   score_basis=args.score_basis,
@@ -113,13 +127,13 @@ def main():
                   max_distance=args.max_distance,
                   distance_metric=args.distance_metric,
                   min_score=args.min_score,
-                  parallel=args.parallel)
+                  parallel=args.parallel,
+                  memory_budget=args.memory_budget,
+                  top_k=args.top_k)
     end = time.time() - start
-    search.texts = texts
-    search.parameters = params
-    search.matches = matches
     print(f'Search found {len(matches)} matches in {end}s.')
-    connection.insert(matches)
+    connection.insert_nocheck(matches)
+    search.status = Search.DONE
     connection.update(search)
     matches.sort(key=lambda x: x.score, reverse=True)
     print('The Top 10 Matches')
@@ -127,9 +141,8 @@ def main():
     print()
     print("Result\tScore\tSource Locus\tTarget Locus\tShared")
     for i, m in enumerate(matches[:10]):
-        units = connection.find('units', _id=[m.source_unit, m.target_unit])
         shared = m.matched_features
-        print(f'{i}.\t{m.score}\t{units[0].tags[0]}\t{units[1].tags[0]}\t{[t for t in shared]}')
+        print(f'{i}.\t{m.score}\t{m.source_tag}\t{m.target_tag}\t{[t for t in shared]}')
 
 
 if __name__ == '__main__':
@@ -23,10 +23,20 @@ class Search(Entity):
         The parameters of the match. The exact contents are fluid to allow for
         extensions to Tesserae, but this should contain all of the information
         necessary to recreate the matches.
+    parameters_hash : str, optional
+        Canonical hash of ``parameters``, for finding searches with the same
+        parameters; see ``tesserae.utils.search.hash_parameters``
     status : str, optional
         Status message for determining what phase the search is in
     msg : str, optional
         Further information associated with the status
+    progress : dict, optional
+        How far a running search has got: the number of blocks of source
+        units done ('blocks_done') out of 'blocks_total', and the number of
+        matches found so far ('matches')
+    cancel : bool, optional
+        Whether the search should be stopped; the search checks this between
+        blocks of source units
     """
 
     collection = 'searches'
@@ -35,19 +45,26 @@ class Search(Entity):
     RUN = 'Running'
     DONE = 'Done'
     FAILED = 'Failed'
+    CANCELLED = 'Cancelled'
 
     def __init__(
         self, id=None, results_id=None, parameters=None,
-            status=None, msg=None, matches=None):
+            parameters_hash=None, status=None, msg=None, progress=None,
+            cancel=None, matches=None):
         super().__init__(id=id)
         self.results_id: typing.Optional[str] = results_id \
             if results_id is not None else ''
         self.parameters: typing.Mapping[typing.Any, typing.Any] = parameters \
             if parameters is not None else {}
+        self.parameters_hash: typing.Optional[str] = parameters_hash \
+            if parameters_hash is not None else ''
         self.status: typing.Optional[str] = status \
             if status is not None else Search.FAILED
         self.msg: typing.Optional[str] = msg \
             if msg is not None else ''
+        self.progress: typing.Mapping[str, int] = progress \
+            if progress is not None else {}
+        self.cancel: bool = cancel if cancel is not None else False
 
     def unique_values(self):
         uniques = {
@@ -25,7 +25,10 @@ use the `pymongo`_ library.
 """
 
 from collections import Iterable, Mapping
+from concurrent.futures import ThreadPoolExecutor
 import datetime
+import itertools
+import logging
 try:
     # Python 3.x
     from urllib.parse import quote_plus
@@ -40,6 +43,9 @@ import tesserae.db.entities
 from tesserae.db.entities import Entity
 
 
+logger = logging.getLogger(__name__)
+
+
 def _extract_embedded_docs(doc):
     """Recursive function to build dot notation for MongoDB $set operation
     """
@@ -204,6 +210,57 @@ class TessMongoConnection():
 
         return result
 
+    def insert_stream(self, entities, batch_size=5000):
+        """Insert entities from an iterable in fixed-size batches without
+        checking whether similar entities already exist in the database.
+
+        Each batch is written with an unordered ``insert_many`` on a
+        background thread while the next batch is drawn from ``entities``, so
+        at most two batches are held in memory at once.  Unlike
+        ``insert_nocheck``, the inserted entities are not given their ids.
+
+        Parameters
+        ----------
+        entities : iterable of tesserae.db.entities.Entity
+            The entities to insert into the database; they must all belong to
+            the same collection.
+        batch_size : int
+            The number of entities to send to the database at a time.
+
+        Returns
+        -------
+        int
+            The number of entities inserted.
+
+        """
+        entities = iter(entities)
+        inserted = 0
+        pending = None
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            while True:
+                try:
+                    batch = list(itertools.islice(entities, batch_size))
+                except BaseException:
+                    # the error of the source is raised; an error of the
+                    # batch still being written would be lost without this
+                    if pending is not None and \
+                            pending.exception() is not None:
+                        logger.error(
+                            'insert_stream: writing a batch failed before '
+                            'its source raised', exc_info=pending.exception())
+                    raise
+                if not batch:
+                    break
+                collection = self.connection[batch[0].__class__.collection]
+                docs = [e.json_encode(exclude=['_id']) for e in batch]
+                if pending is not None:
+                    inserted += len(pending.result().inserted_ids)
+                pending = writer.submit(
+                    collection.insert_many, docs, ordered=False)
+            if pending is not None:
+                inserted += len(pending.result().inserted_ids)
+        return inserted
+
     def insert(self, entity):
         """Insert one or more entities into the database.
 
@@ -452,12 +509,24 @@ class TessMongoConnection():
 
     def create_indices(self):
         """Creates indices for entities for faster lookup later"""
-        # index Match entities by Search.id for faster search results retrieval
+        # index Match entities by Search.id for faster search results
+        # retrieval; score and _id let sorted pages of results come straight
+        # from the index, read forwards or backwards by sort direction
         self.connection[tesserae.db.entities.Match.collection].create_index(
-            'search_id')
+            [
+                ('search_id', pymongo.ASCENDING),
+                ('score', pymongo.DESCENDING),
+                ('_id', pymongo.DESCENDING)
+            ])
         # index Unit entities by Text.id for faster bigram by texts retrieval
         self.connection[tesserae.db.entities.Unit.collection].create_index(
             'text')
+        # index Search entities by parameters hash for search cache lookups
+        self.connection[tesserae.db.entities.Search.collection].create_index(
+            'parameters_hash')
+        # imported here because tesserae.utils depends on this module
+        from tesserae.utils.frequencies import create_frequency_indices
+        create_frequency_indices(self)
 
     def drop_indices(self):
         """Drops all indices
@@ -4,16 +4,36 @@ Classes
 -------
 
 """
-from collections import Counter
-import itertools
+from collections import OrderedDict
+import heapq
+import logging
+import multiprocessing
+import os
+import time
 
 import numpy as np
 from scipy.sparse import csr_matrix
 
-from tesserae.db.entities import Entity, Feature, Match, Unit
+from tesserae.db.entities import Feature, Match
+from tesserae.matchers.text_statistics import get_text_statistics
+from tesserae.matchers.unit_cache import get_text_units
+from tesserae.utils.compact_results import MatchColumns
+from tesserae.utils.frequencies import get_corpus_frequency_counts, \
+        get_text_frequency_tables, get_top_features, \
+        store_text_frequency_table
 from tesserae.utils.retrieve import TagHelper
 
 
+logger = logging.getLogger(__name__)
+
+# memoized results of get_text_frequencies, least recently used first
+_text_frequencies = OrderedDict()
+_TEXT_FREQUENCIES_CACHE_SIZE = 64
+
+# the min_score used when none is given; None instead keeps every match
+DEFAULT_MIN_SCORE = 6
+
+
 class SparseMatrixSearch(object):
     matcher_type = 'original'
 
@@ -69,53 +89,33 @@ class SparseMatrixSearch(object):
         stoplist : list of ObjectId
             The `n` most frequent tokens in the basis texts.
         """
-        pipeline = [
-            {'$match': {'feature': feature, 'language': language}},
-        ]
+        return get_top_features(
+            self.connection, n, feature, language,
+            texts=None if basis == 'corpus' else basis)
 
-        if basis == 'corpus':
-            pipeline.append(
-                {'$project': {
-                    '_id': False,
-                    'index': True,
-                    'token': True,
-                    'frequency': {
-                        '$reduce': {
-                            'input': {'$objectToArray': '$frequencies'},
-                            'initialValue': 0,
-                            'in': {'$sum': ['$$value', '$$this.v']}
-                        }
-                    }
-                }})
-        else:
-            basis = [t.id if isinstance(t, Entity) else t for t in basis]
-            pipeline.extend([
-                {'$project': {
-                    '_id': False,
-                    'index': True,
-                    'token': True,
-                    'frequency': {
-                        '$sum': [
-                            '$frequencies.' + str(t_id) for t_id in basis]}
-                }}
-            ])
-
-        pipeline.extend([
-            {'$sort': {'frequency': -1}},
-            {'$limit': n},
-            {'$project': {'token': True, 'index': True, 'frequency': True}}
-        ])
+    def match(self, search_id, source, target, feature, **kwargs):
+        """Find matches between one or more texts.
 
-        stoplist = self.connection.aggregate(
-            Feature.collection, pipeline, encode=False)
-        stoplist = list(stoplist)
-        return np.array([s['index'] for s in stoplist], dtype=np.uint32)
+        See ``gen_matches`` for the parameters.
 
-    def match(self, search_id, source, target, feature, stopwords=10,
-              stopword_basis='corpus', score_basis='word',
-              frequency_basis='texts', max_distance=10,
-              distance_metric='frequency', min_score=6, parallel=True):
-        """Find matches between one or more texts.
+        Returns
+        -------
+        list of tesserae.db.entities.Match
+        """
+        return list(self.gen_matches(search_id, source, target, feature,
+                                     **kwargs))
+
+    def gen_matches(self, search_id, source, target, feature, stopwords=10,
+                    stopword_basis='corpus', score_basis='word',
+                    frequency_basis='texts', max_distance=10,
+                    distance_metric='frequency',
+                    min_score=DEFAULT_MIN_SCORE, parallel=False,
+                    memory_budget=None, top_k=None, progress=None):
+        """Generate matches between one or more texts.
+
+        Matches are created as their blocks of source units are scored, so
+        they can be written out (see
+        ``TessMongoConnection.insert_stream``) while matching continues.
 
         Texts will contain lines or phrases with matching tokens, with varying
         degrees of strength to the match. If one text is provided, each unit in
@@ -152,27 +152,153 @@ class SparseMatrixSearch(object):
             The methods used to compute distance.
             - 'frequency': the distance between the two least frequent words
             - 'span': the greatest distance between any two matching words
+        min_score : float or None
+            The minimum score a match must have; None keeps every match.
+        parallel : bool or int
+            Whether to match blocks of source units in a pool of worker
+            processes; True uses every available core, and an int gives the
+            number of processes to use.  Matching is serial by default, since
+            callers such as search workers may already run side by side.
+        memory_budget : int, optional
+            Approximate number of bytes that matching one block of source
+            units may use; block sizes are chosen from an estimate of each
+            unit's hits so that blocks stay within it.  With parallel
+            matching, every process may use this much.  If None, blocks of
+            500 source units are used.
+        top_k : int, optional
+            If given, only the ``top_k`` best scoring matches are returned;
+            among equal scores, matches of earlier source units win, then
+            those of earlier target units, however the source is split into
+            blocks.
+        progress : callable, optional
+            Called as ``progress(blocks_done, blocks_total, matches)`` once
+            before the first block of source units and again after each
+            block, where ``matches`` counts the matches found so far (before
+            ``top_k`` is applied).  An exception raised by it stops matching
+            and propagates to the caller, so it can be used to cancel a
+            search.
+
+        Yields
+        ------
+        tesserae.db.entities.Match
 
         Raises
         ------
         ValueError
             Raised when a parameter was poorly specified
         """
-        start = time.time()
+        stoplist, features, target_units, source_units, \
+            source_frequencies, target_frequencies = \
+            self._prepare_scoring(
+                source, target, feature, stopwords, stopword_basis,
+                frequency_basis)
+        tag_helper = TagHelper(self.connection, [source.text, target.text])
+        yield from _score(
+            search_id, target_units, source_units, features,
+            stoplist, distance_metric, max_distance,
+            source_frequencies, target_frequencies,
+            tag_helper, parallel=parallel, memory_budget=memory_budget,
+            min_score=min_score, top_k=top_k, progress=progress)
+
+    def match_columns(self, source, target, feature, stopwords=10,
+                      stopword_basis='corpus', score_basis='word',
+                      frequency_basis='texts', max_distance=10,
+                      distance_metric='frequency',
+                      min_score=DEFAULT_MIN_SCORE, parallel=False,
+                      memory_budget=None, top_k=None, progress=None):
+        """Find matches between two texts in compact columnar form.
+
+        No Match entities are built; the result can be saved with
+        ``tesserae.utils.compact_results.store_match_columns``.  The
+        parameters are those of ``gen_matches`` except for ``search_id``.
+
+        Returns
+        -------
+        tesserae.utils.compact_results.MatchColumns
+            The matches, in the order ``gen_matches`` would generate them
+        """
+        stoplist, features, target_units, source_units, \
+            source_frequencies, target_frequencies = \
+            self._prepare_scoring(
+                source, target, feature, stopwords, stopword_basis,
+                frequency_basis)
+        scored_blocks = _get_scored_blocks(
+            target_units, source_units, len(features), stoplist,
+            distance_metric, max_distance,
+            source_frequencies, target_frequencies,
+            parallel=parallel, memory_budget=memory_budget,
+            min_score=min_score, top_k=top_k, progress=progress)
+        return _get_match_columns(
+            source, target, feature, scored_blocks, top_k=top_k)
+
+    def estimate(self, source, target, feature, stopwords=10,
+                 stopword_basis='corpus', memory_budget=None, **kwargs):
+        """Predict how much work a search will be, without running it
+
+        The prediction comes from cached per-text counts (see
+        ``tesserae.matchers.text_statistics``) rather than from the units
+        themselves, so it is cheap enough to make before queueing a search.
+
+        Parameters
+        ----------
+        source, target, feature, stopwords, stopword_basis, memory_budget
+            See ``gen_matches``
+        **kwargs
+            The other parameters of ``gen_matches``, which are ignored, so
+            that the same parameters can be passed to both
+
+        Returns
+        -------
+        SearchEstimate
+        """
+        stoplist = self._resolve_stoplist(
+            source, target, feature, stopwords, stopword_basis)
+        return estimate_hits2positions(
+            get_text_statistics(
+                self.connection, target.text, target.unit_type, feature),
+            get_text_statistics(
+                self.connection, source.text, source.unit_type, feature),
+            stoplist, memory_budget=memory_budget)
+
+    def _resolve_stoplist(self, source, target, feature, stopwords,
+                          stopword_basis):
+        """Get the feature indices to leave out of a search
+
+        Returns
+        -------
+        stoplist : 1d np.array of ints
+        """
+        stop_feature = 'form' if feature == 'form' else 'lemmata'
         if isinstance(stopwords, int):
             stopword_basis = stopword_basis if stopword_basis != 'texts' \
-                    else texts
-            stoplist = self.create_stoplist(
+                    else [source.text, target.text]
+            return self.create_stoplist(
                 stopwords,
-                'form' if feature == 'form' else 'lemmata',
+                stop_feature,
                 source.text.language,
                 basis=stopword_basis)
-        else:
-            stoplist = get_stoplist(stopwords)
-        print('Stoplist creation: {}s'.format(time.time() - start))
+        return self.get_stoplist(
+            stopwords, stop_feature, source.text.language)
 
-        frequency_basis = frequency_basis if frequency_basis != 'texts' \
-                          else texts
+    def _prepare_scoring(self, source, target, feature, stopwords,
+                         stopword_basis, frequency_basis):
+        """Gather what scoring needs from the database
+
+        Returns
+        -------
+        stoplist : 1d np.array of ints
+        features : list of tesserae.db.entities.Feature
+            features sorted by index
+        target_units, source_units : tesserae.matchers.unit_cache.TextUnits
+        source_frequencies, target_frequencies : 1d np.array of floats
+            the frequency of each form, by form index (see
+            ``_get_position_frequencies``)
+        """
+        start = time.time()
+        texts = [source.text, target.text]
+        stoplist = self._resolve_stoplist(
+            source, target, feature, stopwords, stopword_basis)
+        logger.info('Stoplist creation: %ss', time.time() - start)
 
         features = sorted(
                 self.connection.find(
@@ -185,71 +311,24 @@ class SparseMatrixSearch(object):
                 f'"{source.text.language}" '
                 f'was not found in the database.')
 
-        target_units = _get_units(self.connection, target, feature)
-        source_units = _get_units(self.connection, source, feature)
-
-        tag_helper = TagHelper(self.connection, texts)
+        target_units = get_text_units(
+            self.connection, target.text, target.unit_type, feature)
+        source_units = get_text_units(
+            self.connection, source.text, source.unit_type, feature)
 
         if frequency_basis != 'texts':
-            source_frequencies_getter, target_frequencies_getter = \
-                _get_corpus_frequency_getters(
+            source_frequencies, target_frequencies = \
+                _get_corpus_form_frequencies(
                     self.connection, feature, texts, target_units, source_units
                 )
         else:
-            match_ents = _score_by_text_frequencies(search_id,
-                    self.connection, feature,
-                    texts, target_units, source_units, features, stoplist,
-                    distance_metric, max_distance, tag_helper)
-
-        stopword_tokens = [s.token
-                for s in self.connection.find(
-                    Feature.collection, index=[int(i) for i in stoplist],
-                    language=texts[0].language, feature=feature)]
-        parameters = {
-            'unit_types': [unit_type for _ in range(len(texts))],
-            'method': {
-                'name': self.matcher_type,
-                'feature': feature,
-                'stopwords': stopword_tokens,
-                'freq_basis': frequency_basis if frequency_basis == 'corpus' else [t.id for t in frequency_basis],
-                'max_distance': max_distance,
-                'distance_basis': distance_metric
-            }
-        }
-
-        return match_ents
-
-
-def _get_units(connection, textoptions, feature):
-    return [
-        u for u in connection.aggregate(
-            Unit.collection,
-            [
-                {'$match': {'text': textoptions.text.id, 'unit_type':
-                            textoptions.unit_type}},
-                {'$project': {
-                    '_id': True,
-                    'text': True,
-                    'index': True,
-                    'snippet': True,
-                    'tags': True,
-                    'forms': {
-                        # flatten list of lists of ints into list of ints
-                        # https://docs.mongodb.com/manual/reference/operator/aggregation/reduce/
-                        '$reduce': {
-                            'input': '$tokens.features.form',
-                            'initialValue': [],
-                            'in': {
-                                '$concatArrays': ['$$value', '$$this']
-                            }
-                        }
-                    },
-                    'features': '$tokens.features.'+feature,
-                }}
-            ],
-            encode=False
-        )
-    ]
+            source_frequencies, target_frequencies = \
+                _get_text_form_frequencies(
+                    self.connection, feature, texts, target_units,
+                    source_units)
+        return (
+            stoplist, features, target_units, source_units,
+            source_frequencies, target_frequencies)
 
 
 def get_text_frequencies(connection, feature, text_id):
@@ -277,75 +356,54 @@ def get_text_frequencies(connection, feature, text_id):
         value is the average proportion of words in the text sharing at
         least one same feature type with the key word
     """
-    tindex2mtindex = {}
-    findex2mfindex = {}
-    word_counts = Counter()
-    word_feature_pairs = set()
-    text_token_count = 0
-    unit_proj = {
-        '_id': False,
-        'tokens.features.form': True
-    }
-    if feature != 'form':
-        unit_proj['tokens.features.'+feature] = True
-    db_cursor = connection.connection[Unit.collection].find(
-        {'text': text_id, 'unit_type': 'line'},
-        unit_proj
-    )
-    for unit in db_cursor:
-        text_token_count += len(unit['tokens'])
-        for token in unit['tokens']:
-            cur_features = token['features']
-            # use the form index as an identifier for this token's word
-            # type
-            cur_tindex = cur_features['form'][0]
-            if cur_tindex not in tindex2mtindex:
-                tindex2mtindex[cur_tindex] = len(tindex2mtindex)
-            mtindex = tindex2mtindex[cur_tindex]
-            # we want to count word types by matrix indices for faster
-            # lookup when we get to the stage of counting up word type
-            # occurrences
-            word_counts[mtindex] += 1
-            for cur_findex in cur_features[feature]:
-                if cur_findex not in findex2mfindex:
-                    findex2mfindex[cur_findex] = len(findex2mfindex)
-                mfindex = findex2mfindex[cur_findex]
-                # record when a word type is associated with a feature type
-                word_feature_pairs.add((mtindex, mfindex))
-    csr_rows = []
-    csr_cols = []
-    for mtindex, mfindex in word_feature_pairs:
-        csr_rows.append(mtindex)
-        csr_cols.append(mfindex)
-    word_feature_matrix = csr_matrix(
-        (
-            np.ones(len(csr_rows), dtype=np.bool),
-            (np.array(csr_rows), np.array(csr_cols))
-        ),
-        shape=(len(tindex2mtindex), len(findex2mfindex))
-    )
-    # if matching_words_matrix[i, j] == True, then the word represented by
-    # position i shared at least one feature type with the word represented
-    # by position j
-    matching_words_matrix = word_feature_matrix.dot(
-        word_feature_matrix.transpose())
-
-    mtindex2tindex = {
-        mtindex: tindex for tindex, mtindex in tindex2mtindex.items()}
-    freqs = {}
-    coo = matching_words_matrix.tocoo()
-    for i, j in zip(coo.row, coo.col):
-        # since only matching tokens remain, the column indices indicate
-        # which tokens match the token represented by row i; we need to
-        # count up how many times each word appeared
-        cur_token = mtindex2tindex[i]
-        if cur_token not in freqs:
-            freqs[cur_token] = word_counts[j]
-        else:
-            freqs[cur_token] += word_counts[j]
-    for tok_ind in freqs:
-        freqs[tok_ind] = freqs[tok_ind] / text_token_count
-    return freqs
+    return _get_text_frequencies(connection, feature, [text_id])[text_id]
+
+
+def _get_text_frequencies(connection, feature, text_ids, line_units=None):
+    """Get the text frequencies of several texts at once
+
+    Tables not already in memory are loaded with a single query.
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    feature : str
+        Feature category to be used in calculating frequencies
+    text_ids : list of bson.objectid.ObjectId
+    line_units : dict[bson.objectid.ObjectId, TextUnits], optional
+        Line units for ``feature`` that have already been loaded, for use if
+        a table has to be computed
+
+    Returns
+    -------
+    dict [bson.objectid.ObjectId, dict [int, float]]
+        the result of ``get_text_frequencies`` for each text
+    """
+    db_name = connection.connection.name
+    result = {}
+    for text_id in text_ids:
+        key = (db_name, text_id, feature)
+        if key in _text_frequencies:
+            _text_frequencies.move_to_end(key)
+            result[text_id] = _text_frequencies[key]
+    missing = list(dict.fromkeys(t for t in text_ids if t not in result))
+    if not missing:
+        return result
+    tables = get_text_frequency_tables(connection, missing, feature)
+    for text_id in missing:
+        freqs = tables.get(text_id)
+        if freqs is None:
+            # texts ingested before tables were stored at ingest time
+            text_units = (line_units or {}).get(text_id)
+            if text_units is None:
+                text_units = get_text_units(
+                    connection, text_id, 'line', feature)
+            freqs = store_text_frequency_table(connection, text_units)
+        result[text_id] = freqs
+        _text_frequencies[(db_name, text_id, feature)] = freqs
+        if len(_text_frequencies) > _TEXT_FREQUENCIES_CACHE_SIZE:
+            _text_frequencies.popitem(last=False)
+    return result
 
 
 def get_corpus_frequencies(connection, feature, language):
@@ -378,78 +436,40 @@ def get_corpus_frequencies(connection, feature, language):
     -------
     np.array
     """
-    pipeline = [
-        # Get all database documents of the specified feature and language
-        # (from the "features" collection, as we later find out).
-        {'$match': {'feature': feature, 'language': language}},
-        # Transform each document.
-        {'$project': {
-            # Don't keep their database identifiers,
-            '_id': False,
-            # but keep their indices.
-            'index': True,
-            # Also show their frequency,
-            'frequency': {
-                # which is calculated by summing over all the count values
-                # found in the sub-document obtained by checking the
-                # "frequencies" key in the original document.
-                '$reduce': {
-                    'input': {'$objectToArray': '$frequencies'},
-                    'initialValue': 0,
-                    'in': {'$sum': ['$$value', '$$this.v']}
-                }
-            }
-        }},
-        # Finally, sort those transformed documents by their index.
-        {'$sort': {'index': 1}}
-    ]
-
-    freqs = connection.aggregate(
-            Feature.collection, pipeline, encode=False)
-    freqs = list(freqs)
-    freqs = np.array([freq['frequency'] for freq in freqs])
+    freqs = get_corpus_frequency_counts(connection, feature, language)
     return freqs / sum(freqs)
 
 
-def _get_corpus_frequency_getters(
+def _get_corpus_form_frequencies(
         connection, feature, texts, target_units,
         source_units):
     if texts[0].language != texts[1].language:
-        source_frequencies_getter = _averaged_freq_getter(
+        source_frequencies = _averaged_form_frequencies(
             get_corpus_frequencies(connection, feature, texts[0].language),
-            source_units)
-        target_frequencies_getter = _averaged_freq_getter(
+            [source_units])
+        target_frequencies = _averaged_form_frequencies(
             get_corpus_frequencies(connection, feature, texts[1].language),
-            target_units)
+            [target_units])
     else:
-        source_frequencies_getter = _averaged_freq_getter(
+        source_frequencies = _averaged_form_frequencies(
             get_corpus_frequencies(connection, feature, texts[0].language),
-            itertools.chain.from_iterable([source_units, target_units]))
-        target_frequencies_getter = source_frequencies_getter
-    return source_frequencies_getter, target_frequencies_getter
+            [source_units, target_units])
+        target_frequencies = source_frequencies
+    return source_frequencies, target_frequencies
 
 
-def _get_text_frequency_getters(connection, feature, texts):
-    source_frequencies_getter = _lookup_wrapper(get_text_frequencies(
-            connection, feature, texts[0].id))
-    target_frequencies_getter = _lookup_wrapper(get_text_frequencies(
-            connection, feature, texts[1].id))
-    return source_frequencies_getter, target_frequencies_getter
-
-
-def _get_trivial_distance(positions):
-    """Calculates the distance between two positions
-
-    Parameters
-    ----------
-    positions : 1d np.array of ints
-        token positions in the unit where matches were found
-    """
-    diff = np.abs(positions[0] - positions[1])
-    if diff:
-        return diff + 1
-    else:
-        return 0
+def _get_text_form_frequencies(connection, feature, texts, target_units,
+                               source_units):
+    line_units = {
+        units.text_id: units for units in [source_units, target_units]
+        if units.unit_type == 'line'}
+    freqs = _get_text_frequencies(
+        connection, feature, [t.id for t in texts], line_units=line_units)
+    source_frequencies = _dense_form_frequencies(
+        freqs[texts[0].id], [source_units])
+    target_frequencies = _dense_form_frequencies(
+        freqs[texts[1].id], [target_units])
+    return source_frequencies, target_frequencies
 
 
 def _get_distance_by_least_frequency(get_freq, positions, forms):
@@ -471,20 +491,13 @@ def _get_distance_by_least_frequency(get_freq, positions, forms):
     forms : 1d np.array of ints
         the token forms of the unit
     """
-    if len(set(forms[positions])) < 2:
+    if len(positions) < 2:
         return 0
-    if len(positions) == 2:
-        return _get_trivial_distance(positions)
-    sorted_positions = np.array(sorted(positions))
-    freqs = [get_freq(f) for f in forms[sorted_positions]]
-    freq_sort = np.argsort(freqs)
-    idx = sorted_positions[freq_sort]
-    if idx.shape[0] >= 2:
-        not_first_pos = idx[idx != idx[0]]
-        if not_first_pos.shape[0] > 0:
-            end = not_first_pos[0]
-            return np.abs(end - idx[0]) + 1
-    return 0
+    positions = np.asarray(positions)
+    hit_forms = forms[positions]
+    freqs = np.array([get_freq(f) for f in hit_forms], dtype=np.float64)
+    return _get_distances_by_least_frequency(
+        np.array([0, len(positions)]), positions, hit_forms, freqs)[0]
 
 
 def _get_distance_by_span(matched_positions, forms):
@@ -497,169 +510,93 @@ def _get_distance_by_span(matched_positions, forms):
     forms : 1d np.array of ints
         the token forms of the unit
     """
-    if len(set(forms[matched_positions])) < 2:
+    if len(matched_positions) < 2:
         return 0
-    if len(matched_positions) == 2:
-        return _get_trivial_distance(matched_positions)
-    start_pos = np.min(matched_positions)
-    end_pos = np.max(matched_positions)
-    if start_pos != end_pos:
-        return np.abs(end_pos - start_pos) + 1
-    return 0
-
-
-def _lookup_wrapper(d):
-    """Useful for making dictionaries act like functions"""
-    def _inner(key):
-        return d[key]
-    return _inner
-
-
-def _averaged_freq_getter(d, units_iter):
-    cache = {}
-    for unit in units_iter:
-        for form, feats in zip(unit['forms'], unit['features']):
-            if form in cache:
-                continue
-            cache[form] = np.mean([d[f] for f in feats])
+    matched_positions = np.asarray(matched_positions)
+    return _get_distances_by_span(
+        np.array([0, len(matched_positions)]), matched_positions,
+        forms[matched_positions])[0]
 
-    def _inner(key):
-        return cache[key]
-    return _inner
 
+def _get_forms_size(text_units_iter):
+    """One more than the largest form index at a position with features"""
+    size = 0
+    for text_units in text_units_iter:
+        forms = text_units.forms[np.diff(text_units.indptr) > 0]
+        if len(forms):
+            size = max(size, int(forms.max()) + 1)
+    return size
 
-def _extract_features_and_positions(units, stoplist_set):
-    """Grab feature and token information from units
 
-    All features for every token within each of the units will be accounted for
-    exactly once.
+def _dense_form_frequencies(d, text_units_iter):
+    """Turn a dictionary of form frequencies into an array
 
     Parameters
     ----------
-    units
-        ``units`` should be either ``source_units`` or ``target_units`` from
-        ``_gen_matches(...)``
-    stoplist_set : set of int
-        feature indices which should not be recorded
+    d : dict [int, float]
+        frequency by form index, as from ``get_text_frequencies``
+    text_units_iter : iterable of TextUnits
+        the array covers the forms found in these units
 
     Returns
     -------
-    feature_inds : 1d np.array of int
-    pos_inds : 1d np.array of int
-        ``feature_inds[i]`` should be equal to a feature index present at the
-        position equal to ``pos_inds[i]``
-    break_inds : 1d np.array of int
-        for the slice ``break_inds[i]:break_inds[i+1]``, those are the position
-        indices that belong to ``units[i]``
-
-    Example
-    -------
-    >>> unit_0 = {... 'forms': [1], 'features': [[10, 20]]}
-    >>> unit_1 = {... 'forms': [5, 17], 'features': [[7], [21, 30]]}
-    >>> units = [unit_0, unit_1]
-    >>> feature_inds, pos_inds, break_inds = \
-    >>> ... _extract_features_and_positions(units, {7})
-    >>> feaure_inds == np.array([10, 20, 21, 30])
-    >>> pos_inds == np.array([0, 0, 2, 2])
-    >>> break_inds == np.array([0, 1, 3])
-
-    """
-    feature_inds = []
-    pos_inds = []
-    break_inds = [0]
-    for unit in units:
-        end_break_inds = break_inds[-1]
-        cur_features = unit['features']
-        for i, features in enumerate(cur_features):
-            valid_features = [
-                f for f in features
-                if f not in stoplist_set and f >= 0]
-            if -1 in valid_features:
-                print(unit)
-            feature_inds.extend(valid_features)
-            pos_inds.extend([end_break_inds + i] * len(valid_features))
-        break_inds.append(end_break_inds + len(cur_features))
-    return np.array(feature_inds), np.array(pos_inds), np.array(break_inds)
-
-
-def _construct_feature_unit_matrix(units, stoplist_set, features_size):
-    """Build a matrix where rows correspond to features and columns to
-    positions within units
-
-    Parameters
-    ----------
-    units
-        ``units`` should be either ``source_units`` or ``target_units`` from
-        ``_gen_matches(...)``
-    stoplist_set : set of int
-        feature indices which should not be recorded
-    features_size : int
-        the total number of feature types for the class of features contained
-        in ``units``
-
-    Returns
-    -------
-    M : csr_matrix
-        the result matrix; if ``M[i, j] == True``, the feature with index i
-        appears at position j.
-    break_inds : list of int
-        see ``_extract_features_and_positions()`` for details
-
+    1d np.array of floats
+        position f holds the frequency of form f, or NaN if ``d`` has none
     """
-    feature_inds, pos_inds, break_inds = _extract_features_and_positions(
-            units, stoplist_set)
-    for sw in stoplist_set:
-        if np.any(feature_inds == sw):
-            raise Exception('Stopword in Feature x Unit Matrix!')
-    return (
-        csr_matrix(
-            (np.ones(len(pos_inds), dtype=np.bool), (feature_inds, pos_inds)),
-            shape=(features_size, break_inds[-1])),
-        break_inds
-    )
+    freqs = np.full(_get_forms_size(text_units_iter), np.nan)
+    forms = np.fromiter(d.keys(), dtype=np.int64, count=len(d))
+    values = np.fromiter(d.values(), dtype=np.float64, count=len(d))
+    keep = (forms >= 0) & (forms < len(freqs))
+    freqs[forms[keep]] = values[keep]
+    return freqs
 
 
-def _construct_unit_feature_matrix(units, stoplist_set, features_size):
-    """Build a matrix where rows correspond to positions within units and
-    columns to features
+def _averaged_form_frequencies(d, text_units_iter):
+    """Find the mean frequency of each form's features
 
     Parameters
     ----------
-    units
-        ``units`` should be either ``source_units`` or ``target_units`` from
-        ``_gen_matches(...)``
-    stoplist_set : set of int
-        feature indices which should not be recorded
-    features_size : int
-        the total number of feature types for the class of features contained
-        in ``units``
+    d : 1d np.array of floats
+        ``d[f]`` is the frequency of the feature with index f
+    text_units_iter : list of TextUnits
+        the forms found in these units are the ones that get a frequency; a
+        form's features are taken from its first position with any
 
     Returns
     -------
-    M : csr_matrix
-        the result matrix; if ``M[i, j] == True``, the position i has feature j
-        appear
-    break_inds : list of int
-        see ``_extract_features_and_positions()`` for details
-
+    1d np.array of floats
+        position f holds the mean frequency of form f's features, or NaN if
+        form f is not found
     """
-    feature_inds, pos_inds, break_inds = _extract_features_and_positions(
-            units, stoplist_set)
-    for sw in stoplist_set:
-        if np.any(feature_inds == sw):
-            raise Exception('Stopword in Unit x Feature Matrix!')
-    return (
-        csr_matrix(
-            (np.ones(len(pos_inds), dtype=np.bool), (pos_inds, feature_inds)),
-            shape=(break_inds[-1], features_size)),
-        break_inds
-    )
+    freqs = np.full(_get_forms_size(text_units_iter), np.nan)
+    for text_units in text_units_iter:
+        counts = np.diff(text_units.indptr)
+        has_features = np.flatnonzero(counts > 0)
+        forms, first = np.unique(
+            text_units.forms[has_features], return_index=True)
+        unseen = np.isnan(freqs[forms])
+        forms = forms[unseen]
+        positions = has_features[first[unseen]]
+        starts = text_units.indptr[positions]
+        counts = counts[positions]
+        # add up one feature of every form at a time, in order, so that the
+        # sums come out exactly as np.mean would have them
+        sums = np.zeros(len(forms))
+        for k in range(int(counts.max()) if len(counts) else 0):
+            more = counts > k
+            sums[more] += d[text_units.indices[starts[more] + k]]
+        freqs[forms] = sums / counts
+    return freqs
 
 
 def _bin_hits_to_unit_indices(rows, cols, target_breaks, source_breaks,
                               su_start):
     """Extract which units matched from the ``match_matrix``
 
+    Hits are grouped by (target unit, source unit) by sorting on the unit
+    indices, so no Python objects are created per hit.  Only unit pairs with
+    at least two hits are kept.
+
     Parameters
     ----------
     rows : 1d np.array of ints
@@ -683,14 +620,19 @@ def _bin_hits_to_unit_indices(rows, cols, target_breaks, source_breaks,
 
     Returns
     -------
-    hits2positions : dict [(int, int), 2d np.array of ints]
-        the key is a tuple, where the first value refers to the index of a
-        target unit and the second value refers to the index of a source unit;
-        the associated 2d array tells which positions within the target and
-        source units had a match; in particular, each row represent matched
-        positions, where the value in the first column tells the target
-        position and the the value in the second column tells the source
-        position; there will always be at least two rows in the 2d array
+    target_inds : 1d np.array of ints
+        ``target_inds[g]`` is the index of the target unit of hit group g
+    source_inds : 1d np.array of ints
+        ``source_inds[g]`` is the index of the source unit of hit group g,
+        already incremented by ``su_start``
+    offsets : 1d np.array of ints
+        the rows ``offsets[g]:offsets[g+1]`` of ``positions`` belong to hit
+        group g; ``len(offsets)`` is one more than the number of hit groups
+    positions : 2d np.array of ints
+        each row represents matched positions, where the value in the first
+        column tells the target position and the the value in the second
+        column tells the source position; every hit group has at least two
+        rows
 
     Example
     -------
@@ -701,222 +643,1035 @@ def _bin_hits_to_unit_indices(rows, cols, target_breaks, source_breaks,
     >>> ... [False, False, True]
     >>> ... ])
     >>> coo = match_matrix.tocoo()
-    >>> hits2positions = _bin_hits_to_unit_indices(
-    >>> ... coo.rows, coo.cols, target_breaks, target_breaks)
-    >>> hits2positions[(0, 0)] == np.array([[0, 0], [1, 2]])
+    >>> target_inds, source_inds, offsets, positions = \
+    >>> ... _bin_hits_to_unit_indices(
+    >>> ...     coo.row, coo.col, target_breaks, source_breaks, 0)
+    >>> target_inds == np.array([0])
+    >>> source_inds == np.array([0])
+    >>> offsets == np.array([0, 2])
+    >>> positions == np.array([[0, 0], [1, 2]])
 
     """
+    target_breaks = np.asarray(target_breaks)
+    source_breaks = np.asarray(source_breaks)
     # keep track of mapping between matrix row index and target unit index
     # in ``target_units``
-    row2t_unit_ind = np.array([
-        u_ind
-        for u_ind in range(len(target_breaks) - 1)
-        for _ in range(target_breaks[u_ind+1] - target_breaks[u_ind])])
+    row2t_unit_ind = np.repeat(
+        np.arange(len(target_breaks) - 1), np.diff(target_breaks))
     # keep track of mapping between matrix column index and source unit index
     # in ``source_units``
-    col2s_unit_ind = np.array([
-        u_ind
-        for u_ind in range(len(source_breaks) - 1)
-        for _ in range(source_breaks[u_ind+1] - source_breaks[u_ind])])
-    tmp = {}
-    hits2positions = {}
+    col2s_unit_ind = np.repeat(
+        np.arange(len(source_breaks) - 1), np.diff(source_breaks))
     t_inds = row2t_unit_ind[rows]
     s_inds = col2s_unit_ind[cols]
-    t_poses = rows - target_breaks[t_inds]
-    s_poses = cols - source_breaks[s_inds]
+    # lexsort is stable, so hits within a unit pair keep their matrix order
+    order = np.lexsort((s_inds, t_inds))
+    t_inds = t_inds[order]
+    s_inds = s_inds[order]
+    rows = rows[order]
+    cols = cols[order]
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = (t_inds[1:] != t_inds[:-1]) | (s_inds[1:] != s_inds[:-1])
+    starts = np.flatnonzero(new_group)
+    sizes = np.diff(np.append(starts, len(order)))
+    multiple = sizes >= 2
+    keep = np.repeat(multiple, sizes)
+    starts = starts[multiple]
+    offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(sizes[multiple])
+    t_inds = t_inds[keep]
+    s_inds = s_inds[keep]
+    positions = np.column_stack((
+        rows[keep] - target_breaks[t_inds],
+        cols[keep] - source_breaks[s_inds]))
     # although s_inds needs to index the source_breaks by the ordering of this
     # batch of source_units, s_inds needs to account for source_unit indices as
     # referenced from outside of this batch
-    s_inds += su_start
-    for t_ind, s_ind, t_pos, s_pos in zip(t_inds, s_inds, t_poses, s_poses):
-        key = (t_ind, s_ind)
-        if key not in tmp:
-            tmp[key] = (t_pos, s_pos)
-        elif key not in hits2positions:
-            hits2positions[key] = [tmp[key], (t_pos, s_pos)]
-        else:
-            hits2positions[key].append((t_pos, s_pos))
-    hits2positions = {k: np.array(v) for k, v in hits2positions.items()}
-    return hits2positions
+    return (
+        t_inds[offsets[:-1]],
+        s_inds[offsets[:-1]] + su_start,
+        offsets,
+        positions
+    )
+
+
+def _get_source_blocks(source_size, stepsize=500):
+    """Split the source units into blocks to be matched one at a time
+
+    Returns
+    -------
+    list of (int, int)
+        the start (inclusive) and end (exclusive) source unit index of each
+        block
+    """
+    return [
+        (su_start, min(su_start + stepsize, source_size))
+        for su_start in range(0, source_size, stepsize)]
+
+
+# rough number of bytes held per position hit while a block is matched and
+# scored: the product and its COO copy, the grouping arrays from
+# _bin_hits_to_unit_indices and the per-hit arrays of _score_block
+_BYTES_PER_HIT = 100
+
+
+def _estimate_unit_hits(target_feature_matrix, source_feature_matrix,
+                        source_breaks):
+    """Estimate how many position hits each source unit will produce
+
+    The estimate counts every (target position, source position, feature)
+    triple, so it is an upper bound on the number of nonzero entries each
+    source unit contributes to ``target_feature_matrix.dot(...)``.
+
+    Returns
+    -------
+    1d np.array of ints
+        the estimated hits of each source unit
+    """
+    # how many target positions have each feature
+    target_counts = np.bincount(
+        target_feature_matrix.indices,
+        minlength=target_feature_matrix.shape[1]).astype(np.int64)
+    position_hits = source_feature_matrix.dot(target_counts)
+    cumulative = np.zeros(len(position_hits) + 1, dtype=np.int64)
+    cumulative[1:] = np.cumsum(position_hits)
+    return cumulative[source_breaks[1:]] - cumulative[source_breaks[:-1]]
+
+
+def _get_budgeted_source_blocks(target_feature_matrix, source_feature_matrix,
+                                source_breaks, memory_budget):
+    """Split the source units into blocks that fit in a memory budget
+
+    Parameters
+    ----------
+    target_feature_matrix, source_feature_matrix : csr_matrix
+        positions x features matrices of the target and source texts
+    source_breaks : 1d np.array of ints
+        the rows ``source_breaks[s]:source_breaks[s+1]`` of
+        ``source_feature_matrix`` belong to source unit s
+    memory_budget : int
+        approximate number of bytes that matching one block may use; a
+        source unit that exceeds the budget on its own gets its own block
+
+    Returns
+    -------
+    list of (int, int)
+        the start (inclusive) and end (exclusive) source unit index of each
+        block
+    """
+    unit_hits = _estimate_unit_hits(
+        target_feature_matrix, source_feature_matrix, source_breaks)
+    cumulative = np.zeros(len(unit_hits) + 1, dtype=np.int64)
+    cumulative[1:] = np.cumsum(unit_hits)
+    max_hits = max(memory_budget // _BYTES_PER_HIT, 1)
+    blocks = []
+    su_start = 0
+    while su_start < len(unit_hits):
+        su_end = int(np.searchsorted(
+            cumulative, cumulative[su_start] + max_hits, side='right')) - 1
+        su_end = max(su_end, su_start + 1)
+        blocks.append((su_start, su_end))
+        su_start = su_end
+    return blocks
+
+
+def _get_block_hit_groups(target_feature_matrix, target_breaks,
+                          source_feature_matrix, source_breaks, su_start,
+                          su_end):
+    """Find the hit groups between the target and a block of source units
+
+    Parameters
+    ----------
+    target_feature_matrix, target_breaks, source_feature_matrix, source_breaks
+        see ``gen_hits2positions()``
+    su_start, su_end : int
+        the block consists of the source units ``su_start:su_end``
+
+    Returns
+    -------
+    target_inds, source_inds, offsets, positions
+        see ``_bin_hits_to_unit_indices()``
+    """
+    block_start = source_breaks[su_start]
+    block_breaks = source_breaks[su_start:su_end+1] - block_start
+    # features x positions matrix for this block of source units
+    feature_source_matrix = source_feature_matrix[
+        block_start:source_breaks[su_end]].transpose().tocsr()
+    # for every position of each target unit, this matrix multiplication
+    # picks up which source unit positions shared at least one common
+    # feature
+    match_matrix = target_feature_matrix.dot(feature_source_matrix)
+    # this data structure keeps track of which target unit position matched
+    # with which source unit position
+    coo = match_matrix.tocoo()
+    return _bin_hits_to_unit_indices(
+            coo.row, coo.col, target_breaks, block_breaks, su_start)
 
 
 def gen_hits2positions(
-        target_units, source_units, stoplist_set, features_size):
+        target_feature_matrix, target_breaks, source_feature_matrix,
+        source_breaks, memory_budget=None):
     """Generate matching units based on unit information
 
     Parameters
     ----------
-    source_units : list of dict
-        each dictionary represents unit information from the source text
-    target_units : list of dict
-        each dictionary represents unit information from the target text
-    stoplist_set : set of int
-        feature indices on which matches should not be permitted
-    features_size : int
-        the total number of feature types for the class of features contained
-        in ``units``
-
-    Notes
-    -----
-    The dictionaries in the input lists must contain the following string keys
-    and corresponding values:
-    '_id' : bson.objectid.ObjectId
-        ObjectId of the Unit entity in the database
-    'index' : int
-        index of the Unit entity in the database
-    'tags' : list of str
-        tag information for this unit
-    'forms' : list of int
-        the ``...['forms'][y]`` is the integer associated with the form
-        Feature of the word token at position y
-    'features' : list of list of int
-        each position of this list corresponds to the same position in the
-        'forms' list; thus, ...['features'][a] is a list of the Feature indices
-        derived from ...['forms'][a].
+    target_feature_matrix : csr_matrix
+        positions x features matrix of the target text, without stopwords;
+        see ``TextUnits.feature_matrix()``
+    target_breaks : 1d np.array of ints
+        the rows ``target_breaks[t]:target_breaks[t+1]`` of
+        ``target_feature_matrix`` belong to target unit t
+    source_feature_matrix : csr_matrix
+        positions x features matrix of the source text, without stopwords
+    source_breaks : 1d np.array of ints
+        the rows ``source_breaks[s]:source_breaks[s+1]`` of
+        ``source_feature_matrix`` belong to source unit s
+    memory_budget : int, optional
+        see ``_get_budgeted_source_blocks()``; if None, blocks have a fixed
+        number of source units
 
     Yields
     ------
-    dict [(int, int), 2d np.array of ints]
-        see ``_bin_hits_to_unit_indices()`` for details on what this dictionary
-        contains
+    target_inds, source_inds, offsets, positions
+        the hit groups of one block of source units where at least 2
+        positions matched; see ``_bin_hits_to_unit_indices()`` for details
+        on what these arrays contain.  Blocks without any such hit group are
+        skipped.
+
+    """
+    if memory_budget is None:
+        blocks = _get_source_blocks(len(source_breaks) - 1)
+    else:
+        blocks = _get_budgeted_source_blocks(
+            target_feature_matrix, source_feature_matrix, source_breaks,
+            memory_budget)
+    for su_start, su_end in blocks:
+        hit_groups = _get_block_hit_groups(
+            target_feature_matrix, target_breaks, source_feature_matrix,
+            source_breaks, su_start, su_end)
+        if len(hit_groups[2]) > 1:
+            yield hit_groups
+
+
+# rough time that gen_hits2positions takes per position hit and per block of
+# source units, measured on Zipf-distributed features
+_SECONDS_PER_HIT = 2.5e-7
+_SECONDS_PER_BLOCK = 1e-3
+
+
+class SearchEstimate:
+    """Predicted work and resource use of ``gen_hits2positions``
+
+    Attributes
+    ----------
+    target_units, source_units : int
+        The number of units in the target and source texts
+    position_hits : int
+        The number of (target position, source position, feature) triples
+        that share a feature outside the stoplist; this is an upper bound on
+        the position hits ``gen_hits2positions`` finds
+    blocks : int
+        The number of blocks of source units the search will be split into
+    seconds : float
+        Approximate running time
+    memory : int
+        Approximate peak number of bytes used while matching a block
+    """
+
+    def __init__(self, target_units, source_units, position_hits, blocks,
+                 seconds, memory):
+        self.target_units = target_units
+        self.source_units = source_units
+        self.position_hits = position_hits
+        self.blocks = blocks
+        self.seconds = seconds
+        self.memory = memory
+
+    def json_encode(self):
+        """The estimate as a dictionary, e.g. for an API response"""
+        return {
+            'target_units': self.target_units,
+            'source_units': self.source_units,
+            'position_hits': self.position_hits,
+            'blocks': self.blocks,
+            'seconds': self.seconds,
+            'memory': self.memory
+        }
+
+    def __repr__(self):
+        return (
+            f'SearchEstimate(position_hits={self.position_hits}, '
+            f'blocks={self.blocks}, seconds={self.seconds}, '
+            f'memory={self.memory})'
+        )
+
+
+def estimate_hits2positions(target_statistics, source_statistics, stoplist,
+                            memory_budget=None):
+    """Predict the work and resource use of ``gen_hits2positions``
+
+    Position hits are counted exactly from the per-feature position counts of
+    both texts; how they split into blocks assumes they are spread evenly
+    over the source units.
+
+    Parameters
+    ----------
+    target_statistics, source_statistics : \
+            tesserae.matchers.text_statistics.TextStatistics
+        Counts for the target and source texts
+    stoplist : 1d np.array of ints
+        Feature indices left out of the search
+    memory_budget : int, optional
+        See ``gen_hits2positions``
 
+    Returns
+    -------
+    SearchEstimate
+    """
+    features_size = 1 + max(
+        [int(stats.feature_indices[-1])
+         for stats in (target_statistics, source_statistics)
+         if len(stats.feature_indices)],
+        default=0)
+    position_hits = int(np.dot(
+        target_statistics.dense_counts(features_size, stoplist),
+        source_statistics.dense_counts(features_size, stoplist)))
+    source_size = source_statistics.units_size
+    hit_bytes = position_hits * _BYTES_PER_HIT
+    if memory_budget is None:
+        blocks = len(_get_source_blocks(source_size))
+        memory = hit_bytes * min(source_size, 500) // max(source_size, 1)
+    else:
+        blocks = min(max(-(-hit_bytes // memory_budget), 1), source_size)
+        memory = min(hit_bytes, memory_budget)
+    return SearchEstimate(
+        target_statistics.units_size, source_size, position_hits, blocks,
+        position_hits * _SECONDS_PER_HIT + blocks * _SECONDS_PER_BLOCK,
+        memory)
+
+
+def _get_position_frequencies(form_frequencies, text_units):
+    """Look up the frequency of the form at every position of a text
+
+    Positions without any features can never match, so they are given NaN
+    instead of being looked up.
+
+    Parameters
+    ----------
+    form_frequencies : 1d np.array of floats
+        ``form_frequencies[f]`` is the frequency of form f
+    text_units : TextUnits
+
+    Returns
+    -------
+    1d np.array of floats
+    """
+    freqs = np.full(text_units.positions_size, np.nan)
+    has_features = np.diff(text_units.indptr) > 0
+    freqs[has_features] = form_frequencies[text_units.forms[has_features]]
+    return freqs
+
+
+def _get_group_ids(offsets):
+    """Label every hit with the index of the hit group it belongs to"""
+    return np.repeat(
+        np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+
+
+def _has_distinct_forms(offsets, forms):
+    """Determine which hit groups matched at least two different forms"""
+    starts = offsets[:-1]
+    return np.minimum.reduceat(forms, starts) != \
+        np.maximum.reduceat(forms, starts)
+
+
+def _get_distances_by_span(offsets, positions, forms):
+    """Batched version of ``_get_distance_by_span()``
+
+    Parameters
+    ----------
+    offsets : 1d np.array of ints
+        ``positions[offsets[g]:offsets[g+1]]`` are the matched positions of
+        hit group g
+    positions : 1d np.array of ints
+        matched positions within their units
+    forms : 1d np.array of ints
+        ``forms[i]`` is the form index of the token at ``positions[i]``
+
+    Returns
+    -------
+    1d np.array of ints
+        the distance for each hit group; 0 if fewer than two different forms
+        matched
     """
-    target_feature_matrix, target_breaks = _construct_unit_feature_matrix(
-            target_units, stoplist_set, features_size)
-    stepsize = 500
-    for su_start in range(0, len(source_units), stepsize):
-        feature_source_matrix, source_breaks = _construct_feature_unit_matrix(
-            source_units[su_start:su_start+stepsize],
-            stoplist_set,
-            features_size)
-        # for every position of each target unit, this matrix multiplication
-        # picks up which source unit positions shared at least one common
-        # feature
-        match_matrix = target_feature_matrix.dot(feature_source_matrix)
-        # this data structure keeps track of which target unit position matched
-        # with which source unit position
-        coo = match_matrix.tocoo()
-        yield _bin_hits_to_unit_indices(
-                coo.row, coo.col, target_breaks, source_breaks, su_start)
-
-
-def _gen_matches(target_units, source_units, stoplist_set, features_size):
-    """Generate match information where at least 2 positions matched
+    starts = offsets[:-1]
+    spans = np.maximum.reduceat(positions, starts) - \
+        np.minimum.reduceat(positions, starts) + 1
+    return np.where(_has_distinct_forms(offsets, forms), spans, 0)
+
+
+def _get_distances_by_least_frequency(offsets, positions, forms, freqs):
+    """Batched version of ``_get_distance_by_least_frequency()``
+
+    Within each hit group, positions are ordered by frequency with ties
+    broken by position, as v3 does; the distance is then measured from the
+    first position in that ordering to the first different position after
+    it.
 
     Parameters
     ----------
-    source_units : list of dict
-        each dictionary represents unit information from the source text
-    target_units : list of dict
-        each dictionary represents unit information from the target text
-    stoplist_set : set of int
-        feature indices on which matches should not be permitted
-    features_size : int
-        the total number of feature types for the class of features contained
-        in ``units``
-
-    Notes
-    -----
-    The dictionaries in the input lists must contain the following string keys
-    and corresponding values:
-    '_id' : bson.objectid.ObjectId
-        ObjectId of the Unit entity in the database
-    'index' : int
-        index of the Unit entity in the database
-    'tags' : list of str
-        tag information for this unit
-    'forms' : list of int
-        the ``...['forms'][y]`` is the integer associated with the form
-        Feature of the word token at position y
-    'features' : list of list of int
-        each position of this list corresponds to the same position in the
-        'forms' list; thus, ...['features'][a] is a list of the Feature indices
-        derived from ...['forms'][a].
+    offsets : 1d np.array of ints
+        ``positions[offsets[g]:offsets[g+1]]`` are the matched positions of
+        hit group g
+    positions : 1d np.array of ints
+        matched positions within their units
+    forms : 1d np.array of ints
+        ``forms[i]`` is the form index of the token at ``positions[i]``
+    freqs : 1d np.array of floats
+        ``freqs[i]`` is the frequency of ``forms[i]``
+
+    Returns
+    -------
+    1d np.array of ints
+        the distance for each hit group; 0 if fewer than two different forms
+        matched
+    """
+    starts = offsets[:-1]
+    group_ids = _get_group_ids(offsets)
+    order = np.lexsort((positions, freqs, group_ids))
+    sorted_positions = positions[order]
+    first_positions = sorted_positions[starts]
+    different = sorted_positions != np.repeat(
+        first_positions, np.diff(offsets))
+    candidates = np.where(
+        different, np.arange(len(positions)), len(positions))
+    end_inds = np.minimum.reduceat(candidates, starts)
+    found = (end_inds < len(positions)) & _has_distinct_forms(offsets, forms)
+    end_positions = sorted_positions[np.where(found, end_inds, starts)]
+    return np.where(
+        found, np.abs(end_positions - first_positions) + 1, 0)
+
+
+def _sum_inverse_frequencies(offsets, positions, freqs):
+    """Sum the inverse frequencies of each hit group's distinct positions"""
+    group_ids = _get_group_ids(offsets)
+    order = np.lexsort((positions, group_ids))
+    sorted_groups = group_ids[order]
+    sorted_positions = positions[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (sorted_groups[1:] != sorted_groups[:-1]) | \
+        (sorted_positions[1:] != sorted_positions[:-1])
+    return np.bincount(
+        sorted_groups[first], weights=1 / freqs[order][first],
+        minlength=len(offsets) - 1)
+
+
+# both units of a match need two matched words, which are at least 2 apart
+# by either distance metric
+_MIN_DISTANCE = 4
+
+
+def _select_hit_groups(offsets, selected):
+    """Restrict a block's hits to some of its hit groups
+
+    Parameters
+    ----------
+    offsets : 1d np.array of ints
+        the hits ``offsets[g]:offsets[g+1]`` belong to hit group g
+    selected : 1d np.array of bools
+        whether each hit group should be kept
+
+    Returns
+    -------
+    selected_offsets : 1d np.array of ints
+        offsets of the selected hit groups into the selected hits
+    selected_hits : 1d np.array of bools
+        whether each hit belongs to a selected hit group
+    """
+    counts = np.diff(offsets)
+    selected_offsets = np.zeros(np.count_nonzero(selected) + 1, dtype=np.int64)
+    selected_offsets[1:] = np.cumsum(counts[selected])
+    return selected_offsets, np.repeat(selected, counts)
+
+
+def _score_block(
+        offsets, t_positions, s_positions, t_forms, s_forms, t_freqs,
+        s_freqs, distance_metric, max_distance, min_score=None):
+    """Score a block of hit groups at once
+
+    When ``min_score`` is given, hit groups that could not reach it even at
+    the smallest possible distance are dropped before any distance is
+    computed.
+
+    Parameters
+    ----------
+    offsets : 1d np.array of ints
+        the hits ``offsets[g]:offsets[g+1]`` belong to hit group g
+    t_positions, s_positions : 1d np.array of ints
+        matched target and source positions within their units
+    t_forms, s_forms : 1d np.array of ints
+        form indices of the tokens at ``t_positions`` and ``s_positions``
+    t_freqs, s_freqs : 1d np.array of floats
+        frequencies of ``t_forms`` and ``s_forms``
+    distance_metric : {'frequency', 'span'}
+        The methods used to compute distance.
+    max_distance : float
+        The maximum inter-word distance to use in a match.
+    min_score : float, optional
+        The minimum score a match must have.
+
+    Returns
+    -------
+    keep : 1d np.array of bools
+        whether each hit group is a match
+    scores : 1d np.array of floats
+        the score of each hit group; only meaningful where ``keep`` is True
+    """
+    inverse_sums = \
+        _sum_inverse_frequencies(offsets, t_positions, t_freqs) + \
+        _sum_inverse_frequencies(offsets, s_positions, s_freqs)
+    keep = np.zeros(len(inverse_sums), dtype=bool)
+    scores = np.full(len(inverse_sums), -np.inf)
+    if min_score is None:
+        candidates = np.ones(len(inverse_sums), dtype=bool)
+    else:
+        candidates = np.log(inverse_sums / _MIN_DISTANCE) >= min_score
+        if not np.any(candidates):
+            return keep, scores
+        offsets, candidate_hits = _select_hit_groups(offsets, candidates)
+        t_positions = t_positions[candidate_hits]
+        s_positions = s_positions[candidate_hits]
+        t_forms = t_forms[candidate_hits]
+        s_forms = s_forms[candidate_hits]
+        t_freqs = t_freqs[candidate_hits]
+        s_freqs = s_freqs[candidate_hits]
+    if distance_metric == 'span':
+        # adjacent matched words have a distance of 2, etc.
+        target_distances = _get_distances_by_span(
+            offsets, t_positions, t_forms)
+        source_distances = _get_distances_by_span(
+            offsets, s_positions, s_forms)
+    else:
+        target_distances = _get_distances_by_least_frequency(
+            offsets, t_positions, t_forms, t_freqs)
+        source_distances = _get_distances_by_least_frequency(
+            offsets, s_positions, s_forms, s_freqs)
+    distances = target_distances + source_distances
+    # a distance of 0 means less than two matching tokens in one of the units
+    matched = (target_distances > 0) & (source_distances > 0) & \
+        (distances <= max_distance)
+    candidate_scores = np.full(len(distances), -np.inf)
+    candidate_scores[matched] = np.log(
+        inverse_sums[candidates][matched] / distances[matched])
+    if min_score is not None:
+        matched &= candidate_scores >= min_score
+    keep[candidates] = matched
+    scores[candidates] = candidate_scores
+    return keep, scores
+
+
+def _get_matched_features(offsets, t_rows, s_rows, target_feature_matrix,
+                          source_feature_matrix):
+    """Find the features shared by each hit group
+
+    Parameters
+    ----------
+    offsets : 1d np.array of ints
+        the hits ``offsets[g]:offsets[g+1]`` belong to hit group g
+    t_rows, s_rows : 1d np.array of ints
+        the rows of the target and source feature matrices that matched
+    target_feature_matrix, source_feature_matrix : csr_matrix
+        positions x features matrices of the target and source texts
+
+    Returns
+    -------
+    indptr, indices : 1d np.array of ints
+        the feature indices shared by hit group g are
+        ``indices[indptr[g]:indptr[g+1]]``
+    """
+    # shared[h, f] is True when feature f is found at both positions of hit h
+    shared = target_feature_matrix[t_rows].multiply(
+        source_feature_matrix[s_rows]).tocsr()
+    hits_size = len(t_rows)
+    grouping = csr_matrix(
+        (
+            np.ones(hits_size, dtype=bool),
+            (_get_group_ids(offsets), np.arange(hits_size))
+        ),
+        shape=(len(offsets) - 1, hits_size))
+    grouped = grouping.dot(shared).tocsr()
+    grouped.eliminate_zeros()
+    grouped.sort_indices()
+    return grouped.indptr, grouped.indices
+
+
+class _MatchingData:
+    """The arrays of one text needed to find and score matches
+
+    Attributes
+    ----------
+    feature_matrix : csr_matrix
+        positions x features matrix without stopwords
+    break_inds : 1d np.array of ints
+        the positions ``break_inds[i]:break_inds[i+1]`` belong to unit i
+    forms : 1d np.array of ints
+        the form index at each position
+    freqs : 1d np.array of floats
+        the frequency of the form at each position
+    """
+
+    def __init__(self, feature_matrix, break_inds, forms, freqs):
+        self.feature_matrix = feature_matrix
+        self.break_inds = break_inds
+        self.forms = forms
+        self.freqs = freqs
+
+    def share(self):
+        """Copy the arrays into shared memory for worker processes
+
+        Returns
+        -------
+        dict
+            pass to ``from_shared()`` in the worker process
+        """
+        shared = {'shape': self.feature_matrix.shape}
+        for name, typecode, arr in [
+                ('indptr', 'q', self.feature_matrix.indptr),
+                ('indices', 'q', self.feature_matrix.indices),
+                ('break_inds', 'q', self.break_inds),
+                ('forms', 'q', self.forms),
+                ('freqs', 'd', self.freqs)]:
+            raw = multiprocessing.RawArray(typecode, len(arr))
+            np.frombuffer(raw, dtype=_SHARED_DTYPES[typecode])[:] = arr
+            shared[name] = raw
+        return shared
+
+    @classmethod
+    def from_shared(cls, shared):
+        """Wrap arrays created by ``share()`` without copying them"""
+        arrays = {
+            name: np.frombuffer(shared[name], dtype=_SHARED_DTYPES[typecode])
+            for name, typecode in [
+                ('indptr', 'q'), ('indices', 'q'), ('break_inds', 'q'),
+                ('forms', 'q'), ('freqs', 'd')]}
+        feature_matrix = csr_matrix(
+            (
+                np.ones(len(arrays['indices']), dtype=bool),
+                arrays['indices'],
+                arrays['indptr']
+            ),
+            shape=shared['shape'])
+        return cls(
+            feature_matrix, arrays['break_inds'], arrays['forms'],
+            arrays['freqs'])
+
+
+_SHARED_DTYPES = {'q': np.int64, 'd': np.float64}
+
+
+def _score_source_block(target, source, su_start, su_end, distance_metric,
+                        max_distance, min_score=None, top_k=None):
+    """Find and score the matches of one block of source units
+
+    Parameters
+    ----------
+    target, source : _MatchingData
+        the arrays of the target and source texts
+    su_start, su_end : int
+        the block consists of the source units ``su_start:su_end``
+    distance_metric : {'frequency', 'span'}
+        The methods used to compute distance.
+    max_distance : float
+        The maximum inter-word distance to use in a match.
+    min_score : float, optional
+        Matches scoring below this are dropped.
+    top_k : int, optional
+        If given, only the ``top_k`` best scoring matches of the block are
+        kept; ties are broken as in ``_rank_groups()``.
+
+    Returns
+    -------
+    None or tuple
+        None if the block had no matches; otherwise the arrays
+        ``target_inds``, ``source_inds``, ``offsets`` and ``positions``
+        (as in ``_bin_hits_to_unit_indices()``) restricted to the matches,
+        followed by the ``scores`` of the matches and the ``indptr`` and
+        ``indices`` arrays from ``_get_matched_features()``
+    """
+    target_inds, source_inds, offsets, positions = _get_block_hit_groups(
+        target.feature_matrix, target.break_inds, source.feature_matrix,
+        source.break_inds, su_start, su_end)
+    if len(offsets) <= 1:
+        return None
+    t_positions = positions[:, 0]
+    s_positions = positions[:, 1]
+    counts = np.diff(offsets)
+    t_rows = np.repeat(target.break_inds[target_inds], counts) + t_positions
+    s_rows = np.repeat(source.break_inds[source_inds], counts) + s_positions
+    keep, scores = _score_block(
+        offsets, t_positions, s_positions, target.forms[t_rows],
+        source.forms[s_rows], target.freqs[t_rows], source.freqs[s_rows],
+        distance_metric, max_distance, min_score=min_score)
+    if top_k is not None and np.count_nonzero(keep) > top_k:
+        kept_groups = np.flatnonzero(keep)
+        best = _rank_groups(
+            scores[kept_groups], source_inds[kept_groups],
+            target_inds[kept_groups])[:top_k]
+        keep = np.zeros_like(keep)
+        keep[kept_groups[best]] = True
+    if not np.any(keep):
+        return None
+    kept_offsets, kept_hits = _select_hit_groups(offsets, keep)
+    features_indptr, features_indices = _get_matched_features(
+        kept_offsets, t_rows[kept_hits], s_rows[kept_hits],
+        target.feature_matrix, source.feature_matrix)
+    return (
+        target_inds[keep], source_inds[keep], kept_offsets,
+        positions[kept_hits], scores[keep], features_indptr,
+        features_indices)
+
+
+def _rank_groups(scores, source_inds, target_inds):
+    """Order matches from best to worst
+
+    Higher scores come first; among equal scores, matches of earlier source
+    units and then of earlier target units do.  Unlike the order matches are
+    found in, this does not depend on how the source is split into blocks.
+
+    Returns
+    -------
+    1d np.array of ints
+        indices into the given arrays, best match first
+    """
+    return np.lexsort((target_inds, source_inds, -scores))
+
+
+# arrays that pool workers inherit from ``_init_block_worker``
+_worker_data = {}
+
+
+def _init_block_worker(target_shared, source_shared, score_options):
+    _worker_data['target'] = _MatchingData.from_shared(target_shared)
+    _worker_data['source'] = _MatchingData.from_shared(source_shared)
+    _worker_data['score_options'] = score_options
+
+
+def _score_source_block_in_worker(block):
+    su_start, su_end = block
+    return _score_source_block(
+        _worker_data['target'], _worker_data['source'], su_start, su_end,
+        **_worker_data['score_options'])
+
+
+def _get_processes(parallel, blocks_size):
+    """Decide how many worker processes to match with
+
+    Parameters
+    ----------
+    parallel : bool or int
+        False for serial matching, True to use every available core, or the
+        number of processes to use
+    blocks_size : int
+        the number of source blocks to match
+
+    Returns
+    -------
+    int
+        the number of processes; 1 means matching is done serially
+    """
+    if parallel is True:
+        processes = os.cpu_count() or 1
+    elif parallel is False or parallel is None:
+        processes = 1
+    else:
+        processes = int(parallel)
+    # daemonic processes (like a multiprocessing.Pool worker) are not allowed
+    # to have children of their own
+    if multiprocessing.current_process().daemon:
+        processes = 1
+    return max(1, min(processes, blocks_size))
+
+
+def _ignore_progress(blocks_done, blocks_total, matches):
+    pass
+
+
+def _gen_scored_blocks(target, source, distance_metric, max_distance,
+                       parallel, memory_budget=None, min_score=None,
+                       top_k=None, progress=None):
+    """Generate the scored matches of each source block in block order
+
+    Parameters
+    ----------
+    target, source : _MatchingData
+        the arrays of the target and source texts
+    distance_metric : {'frequency', 'span'}
+        The methods used to compute distance.
+    max_distance : float
+        The maximum inter-word distance to use in a match.
+    parallel : bool or int
+        see ``_get_processes()``
+    memory_budget : int, optional
+        see ``_get_budgeted_source_blocks()``; if None, blocks have a fixed
+        number of source units
+    min_score : float, optional
+        Matches scoring below this are dropped.
+    top_k : int, optional
+        Only the ``top_k`` best scoring matches of each block are kept.
+    progress : callable, optional
+        see ``SparseMatrixSearch.gen_matches()``
 
     Yields
     ------
-    target_index : int
-        index into ``target_units``
-    source_index : int
-        index into ``source_units``
-    positions : 2d np.array
-        the first column contains target positions; the second column has
-        corresponding source positions
+    tuple
+        see ``_score_source_block()``; blocks without matches are skipped
+    """
+    if memory_budget is None:
+        blocks = _get_source_blocks(len(source.break_inds) - 1)
+    else:
+        blocks = _get_budgeted_source_blocks(
+            target.feature_matrix, source.feature_matrix, source.break_inds,
+            memory_budget)
+    if blocks:
+        block_sizes = [su_end - su_start for su_start, su_end in blocks]
+        logger.info(
+            'Source blocks: %d (%d-%d units each)',
+            len(blocks), min(block_sizes), max(block_sizes))
+    score_options = {
+        'distance_metric': distance_metric,
+        'max_distance': max_distance,
+        'min_score': min_score,
+        'top_k': top_k
+    }
+    if progress is None:
+        progress = _ignore_progress
+    progress(0, len(blocks), 0)
+    matches = 0
+    processes = _get_processes(parallel, len(blocks))
+    if processes == 1:
+        results = (
+            _score_source_block(
+                target, source, su_start, su_end, **score_options)
+            for su_start, su_end in blocks)
+        for blocks_done, result in enumerate(results, start=1):
+            if result is not None:
+                matches += len(result[0])
+            progress(blocks_done, len(blocks), matches)
+            if result is not None:
+                yield result
+        return
+    # leaving the with block (e.g., when progress raises) terminates the pool
+    with multiprocessing.Pool(
+            processes,
+            initializer=_init_block_worker,
+            initargs=(
+                target.share(), source.share(), score_options)) as pool:
+        # imap hands back results in block order, so the matches come out
+        # the same as they would from serial matching
+        for blocks_done, result in enumerate(
+                pool.imap(_score_source_block_in_worker, blocks), start=1):
+            if result is not None:
+                matches += len(result[0])
+            progress(blocks_done, len(blocks), matches)
+            if result is not None:
+                yield result
+
+
+def _get_scored_blocks(
+        target_units, source_units, features_size, stoplist, distance_metric,
+        max_distance, source_frequencies, target_frequencies,
+        parallel=False, memory_budget=None, min_score=None, top_k=None,
+        progress=None):
+    """Start scoring two texts block by block
+
+    Returns
+    -------
+    generator of tuple
+        see ``_gen_scored_blocks()``
     """
-    for hits2positions in gen_hits2positions(
-            target_units, source_units, stoplist_set, features_size):
-        overhits2positions = {
-            k: np.array(v) for k, v in hits2positions.items()
-            if len(v) >= 2}
-        for (t_ind, s_ind), positions in overhits2positions.items():
-            yield (t_ind, s_ind, positions)
+    target = _MatchingData(
+        target_units.feature_matrix(stoplist, features_size),
+        target_units.break_inds, target_units.forms,
+        _get_position_frequencies(target_frequencies, target_units))
+    source = _MatchingData(
+        source_units.feature_matrix(stoplist, features_size),
+        source_units.break_inds, source_units.forms,
+        _get_position_frequencies(source_frequencies, source_units))
+    return _gen_scored_blocks(
+        target, source, distance_metric, max_distance, parallel,
+        memory_budget=memory_budget, min_score=min_score, top_k=top_k,
+        progress=progress)
 
 
 def _score(
-        search_id, target_units, source_units, features, stoplist_set,
+        search_id, target_units, source_units, features, stoplist,
         distance_metric,
-        max_distance, source_frequencies_getter, target_frequencies_getter,
-        tag_helper):
-    match_ents = []
-    features_size = len(features)
-    for target_ind, source_ind, positions in _gen_matches(
-            target_units, source_units, stoplist_set, features_size):
-        target_unit = target_units[target_ind]
-        source_unit = source_units[source_ind]
-        target_forms = np.array(target_unit['forms'])
-        source_forms = np.array(source_unit['forms'])
-        t_positions = positions[:, 0]
-        s_positions = positions[:, 1]
-        if distance_metric == 'span':
-            # adjacent matched words have a distance of 2, etc.
-            target_distance = _get_distance_by_span(t_positions, target_forms)
-            source_distance = _get_distance_by_span(s_positions, source_forms)
+        max_distance, source_frequencies, target_frequencies,
+        tag_helper, parallel=False, memory_budget=None, min_score=None,
+        top_k=None, progress=None):
+    found = _gen_found_matches(_get_scored_blocks(
+        target_units, source_units, len(features), stoplist, distance_metric,
+        max_distance, source_frequencies, target_frequencies,
+        parallel=parallel, memory_budget=memory_budget, min_score=min_score,
+        top_k=top_k, progress=progress))
+    if top_k is not None:
+        found = _get_top_matches(found, top_k)
+    return (
+        Match(
+            search_id=search_id,
+            source_unit=source_units.unit_ids[source_ind],
+            target_unit=target_units.unit_ids[target_ind],
+            source_tag=tag_helper.get_display_tag(
+                source_units.text_id,
+                source_units.get_display_tags(source_ind)),
+            target_tag=tag_helper.get_display_tag(
+                target_units.text_id,
+                target_units.get_display_tags(target_ind)),
+            matched_features=[
+                features[int(mf)].token
+                for mf in match_features],
+            score=score,
+            source_snippet=source_units.snippets[source_ind],
+            target_snippet=target_units.snippets[target_ind],
+            highlight=[
+                (int(s_pos), int(t_pos))
+                for t_pos, s_pos in group_positions]
+        )
+        for target_ind, source_ind, score, match_features, group_positions
+        in found
+    )
+
+
+def _concatenate(arrays, empty):
+    """Join arrays, giving ``empty`` if there are none"""
+    return np.concatenate(arrays) if arrays else empty
+
+
+def _concatenate_indptrs(indptrs):
+    """Join CSR index pointers whose data will be concatenated"""
+    counts = [np.diff(indptr) for indptr in indptrs]
+    joined = np.zeros(sum(len(c) for c in counts) + 1, dtype=np.int64)
+    if counts:
+        joined[1:] = np.cumsum(np.concatenate(counts))
+    return joined
+
+
+def _get_match_columns(source, target, feature, scored_blocks, top_k=None):
+    """Gather scored blocks into columnar form
+
+    Parameters
+    ----------
+    source, target : tesserae.matchers.text_options.TextOptions
+        the texts that were matched
+    feature : str
+        the feature that was matched on
+    scored_blocks : iterable of tuple
+        see ``_score_source_block()``
+    top_k : int, optional
+        If given, only the ``top_k`` best scoring matches are kept; ties are
+        broken as in ``_rank_groups()``.
+
+    Returns
+    -------
+    tesserae.utils.compact_results.MatchColumns
+    """
+    (target_inds, source_inds, offsets, positions, scores, features_indptr,
+        features_indices) = list(zip(*scored_blocks)) or [()] * 7
+    target_inds = _concatenate(target_inds, np.zeros(0, dtype=np.int64))
+    source_inds = _concatenate(source_inds, np.zeros(0, dtype=np.int64))
+    offsets = _concatenate_indptrs(offsets)
+    positions = _concatenate(positions, np.zeros((0, 2), dtype=np.int64))
+    scores = _concatenate(scores, np.zeros(0))
+    features_indptr = _concatenate_indptrs(features_indptr)
+    features_indices = _concatenate(
+        features_indices, np.zeros(0, dtype=np.int64))
+    # as in _gen_found_matches, hit groups which share no features are not
+    # matches
+    keep = np.diff(features_indptr) > 0
+    if top_k is not None and np.count_nonzero(keep) > top_k:
+        kept_groups = np.flatnonzero(keep)
+        best = _rank_groups(
+            scores[kept_groups], source_inds[kept_groups],
+            target_inds[kept_groups])[:max(top_k, 0)]
+        keep = np.zeros_like(keep)
+        keep[kept_groups[best]] = True
+    kept_offsets, kept_hits = _select_hit_groups(offsets, keep)
+    kept_features_indptr, kept_features = _select_hit_groups(
+        features_indptr, keep)
+    return MatchColumns(
+        source_text=source.text.id,
+        target_text=target.text.id,
+        source_unit_type=source.unit_type,
+        target_unit_type=target.unit_type,
+        feature=feature,
+        language=source.text.language,
+        source_inds=source_inds[keep],
+        target_inds=target_inds[keep],
+        scores=scores[keep],
+        features_indptr=kept_features_indptr,
+        features_indices=features_indices[kept_features],
+        highlights_indptr=kept_offsets,
+        # positions are (target, source) pairs, highlights (source, target)
+        highlights=positions[kept_hits][:, ::-1].copy())
+
+
+def _gen_found_matches(scored_blocks):
+    """Generate the information needed for each match of the scored blocks
+
+    Parameters
+    ----------
+    scored_blocks : iterable of tuple
+        see ``_score_source_block()``
+
+    Yields
+    ------
+    target_ind, source_ind, score, match_features, group_positions
+        the unit indices and score of a match, the feature indices the units
+        share and the (target, source) positions of the matched words
+    """
+    for (target_inds, source_inds, offsets, positions, scores,
+            features_indptr, features_indices) in scored_blocks:
+        for g, (target_ind, source_ind) in enumerate(
+                zip(target_inds, source_inds)):
+            match_features = features_indices[
+                features_indptr[g]:features_indptr[g+1]]
+            if len(match_features) == 0:
+                continue
+            yield (
+                target_ind, source_ind, scores[g], match_features,
+                positions[offsets[g]:offsets[g+1]])
+
+
+def _get_top_matches(found, top_k):
+    """Keep the best scoring matches
+
+    A heap of at most ``top_k`` matches is kept while ``found`` is consumed,
+    so only the matches that survive are ever held at once.
+
+    Parameters
+    ----------
+    found : iterable of tuple
+        see ``_gen_found_matches()``
+    top_k : int
+        the number of matches to keep; ties are broken as in
+        ``_rank_groups()``
+
+    Returns
+    -------
+    list of tuple
+        the best matches from ``found``, in the order they were found
+    """
+    if top_k <= 0:
+        return []
+    heap = []
+    for i, match in enumerate(found):
+        # the heap root is the worst kept match: the lowest score, and among
+        # equal scores the one of the latest source unit, then target unit;
+        # unit pairs are unique, so i only orders the results
+        target_ind, source_ind, score = match[:3]
+        entry = (score, -source_ind, -target_ind, i, match)
+        if len(heap) < top_k:
+            heapq.heappush(heap, entry)
         else:
-            target_distance = _get_distance_by_least_frequency(
-                    target_frequencies_getter, t_positions,
-                    target_forms)
-            source_distance = _get_distance_by_least_frequency(
-                    source_frequencies_getter, s_positions,
-                    source_forms)
-        if source_distance <= 0 or target_distance <= 0:
-            # less than two matching tokens in one of the units
-            continue
-        distance = source_distance + target_distance
-        if distance <= max_distance:
-            target_features = target_unit['features']
-            source_features = source_unit['features']
-            match_features = set(itertools.chain.from_iterable([
-                    set(target_features[t_pos]).intersection(
-                        set(source_features[s_pos]))
-                    for t_pos, s_pos in zip(t_positions, s_positions)]))
-            match_features -= stoplist_set
-            if match_features:
-                match_frequencies = [
-                    target_frequencies_getter(target_forms[pos])
-                    for pos in set(t_positions)]
-                match_frequencies.extend(
-                    [source_frequencies_getter(source_forms[pos])
-                        for pos in set(s_positions)])
-                score = np.log(
-                    (np.sum(np.power(match_frequencies, -1))) / distance)
-                match_ents.append(Match(
-                    search_id=search_id,
-                    source_unit=source_unit['_id'],
-                    target_unit=target_unit['_id'],
-                    source_tag=tag_helper.get_display_tag(
-                        source_unit['text'],
-                        source_unit['tags']),
-                    target_tag=tag_helper.get_display_tag(
-                        target_unit['text'],
-                        target_unit['tags']),
-                    matched_features=[
-                        features[int(mf)].token
-                        for mf in match_features],
-                    score=score,
-                    source_snippet=source_unit['snippet'],
-                    target_snippet=target_unit['snippet'],
-                    highlight=[
-                        (int(s_pos), int(t_pos))
-                        for s_pos, t_pos in zip(s_positions, t_positions)]
-                ))
-    return match_ents
+            heapq.heappushpop(heap, entry)
+    return [entry[4] for entry in sorted(heap, key=lambda e: e[3])]
@@ -0,0 +1,180 @@
+"""Persistent cache of per-text counts for estimating search costs.
+
+How much work a search does depends mostly on how many positions of each text
+have each feature.  These counts are small next to the unit information in
+``tesserae.matchers.unit_cache``, so they are stored separately in GridFS and
+can be loaded cheaply before deciding whether, and when, to run a search.
+
+Classes
+-------
+TextStatistics
+    Unit, position and per-feature position counts for one text.
+
+Functions
+---------
+get_text_statistics
+    Load statistics for a text from the cache, computing them if needed.
+clear_text_statistics
+    Remove all cached statistics for a text.
+"""
+import io
+
+import gridfs
+import numpy as np
+
+from tesserae.db.entities import Entity
+from tesserae.matchers.unit_cache import get_text_units
+
+
+STATISTICS_BUCKET = 'text_statistics'
+# bump this whenever the stored arrays change so that stale blobs are ignored
+STATISTICS_VERSION = 1
+
+
+class TextStatistics:
+    """Unit, position and per-feature position counts for one text
+
+    Attributes
+    ----------
+    text_id : bson.objectid.ObjectId
+        The text these counts belong to
+    unit_type : {'line', 'phrase'}
+        The divisions of the text
+    feature : str
+        The feature that was counted
+    units_size : int
+        The number of units
+    positions_size : int
+        The total number of token positions across all units
+    feature_indices : 1d np.array of ints
+        The feature indices found in the text, in increasing order
+    feature_counts : 1d np.array of ints
+        ``feature_counts[i]`` is the number of positions that have the
+        feature ``feature_indices[i]``
+    """
+
+    def __init__(self, text_id, unit_type, feature, units_size,
+                 positions_size, feature_indices, feature_counts):
+        self.text_id = text_id
+        self.unit_type = unit_type
+        self.feature = feature
+        self.units_size = units_size
+        self.positions_size = positions_size
+        self.feature_indices = feature_indices
+        self.feature_counts = feature_counts
+
+    @classmethod
+    def from_text_units(cls, text_units):
+        """Count the features of flattened unit information
+
+        Parameters
+        ----------
+        text_units : tesserae.matchers.unit_cache.TextUnits
+
+        Returns
+        -------
+        TextStatistics
+        """
+        feature_indices, feature_counts = np.unique(
+            text_units.indices, return_counts=True)
+        return cls(
+            text_units.text_id, text_units.unit_type, text_units.feature,
+            len(text_units), text_units.positions_size,
+            feature_indices.astype(np.int64),
+            feature_counts.astype(np.int64))
+
+    def dense_counts(self, features_size, stoplist=None):
+        """The number of positions with each feature, by feature index
+
+        Parameters
+        ----------
+        features_size : int
+            The length of the returned array; it must be greater than every
+            feature index in the text
+        stoplist : 1d np.array of ints, optional
+            Feature indices to count as absent, as in
+            ``TextUnits.feature_matrix``
+
+        Returns
+        -------
+        1d np.array of ints
+        """
+        counts = np.zeros(features_size, dtype=np.int64)
+        counts[self.feature_indices] = self.feature_counts
+        if stoplist is not None and len(stoplist) > 0:
+            stoplist = np.asarray(stoplist, dtype=np.int64)
+            counts[stoplist[stoplist < features_size]] = 0
+        return counts
+
+    def to_bytes(self):
+        """Serialize the arrays of this object into .npz format"""
+        buf = io.BytesIO()
+        np.savez(
+            buf,
+            sizes=np.array(
+                [self.units_size, self.positions_size], dtype=np.int64),
+            feature_indices=self.feature_indices,
+            feature_counts=self.feature_counts)
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data, text_id, unit_type, feature):
+        """Deserialize an object created by ``to_bytes``"""
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            units_size, positions_size = arrays['sizes'].tolist()
+            return cls(
+                text_id, unit_type, feature, units_size, positions_size,
+                feature_indices=arrays['feature_indices'],
+                feature_counts=arrays['feature_counts'])
+
+
+def get_text_statistics(connection, text, unit_type, feature):
+    """Retrieve per-text counts for estimating search costs
+
+    The cached copy is used if there is one; otherwise the counts are taken
+    from the text's unit information and cached for later estimates.
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    text : tesserae.db.entities.Text or bson.objectid.ObjectId
+        The text whose statistics are wanted
+    unit_type : {'line', 'phrase'}
+        The divisions of the text to use
+    feature : str
+        The feature to count
+
+    Returns
+    -------
+    TextStatistics
+    """
+    text_id = text.id if isinstance(text, Entity) else text
+    fs = gridfs.GridFS(connection.connection, collection=STATISTICS_BUCKET)
+    query = {
+        'text': text_id,
+        'unit_type': unit_type,
+        'feature': feature,
+        'version': STATISTICS_VERSION
+    }
+    cached = fs.find_one(query)
+    if cached is not None:
+        return TextStatistics.from_bytes(
+            cached.read(), text_id, unit_type, feature)
+    statistics = TextStatistics.from_text_units(
+        get_text_units(connection, text_id, unit_type, feature))
+    fs.put(statistics.to_bytes(), **query)
+    return statistics
+
+
+def clear_text_statistics(connection, text_id):
+    """Remove all cached statistics for a text
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    text_id : bson.objectid.ObjectId
+        The text whose cached statistics should be removed
+    """
+    fs = gridfs.GridFS(connection.connection, collection=STATISTICS_BUCKET)
+    for cached in fs.find({'text': text_id}):
+        fs.delete(cached._id)
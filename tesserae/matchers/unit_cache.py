@@ -0,0 +1,287 @@
+"""Persistent cache of flattened unit information for matching.
+
+A text's units never change after ingestion, so the feature/position
+information that ``SparseMatrixSearch`` needs from them is computed once per
+(text, unit type, feature) and stored in GridFS. Later searches load the
+arrays directly instead of re-running the unit aggregation.
+
+Classes
+-------
+TextUnits
+    Flattened unit information for one text.
+
+Functions
+---------
+get_text_units
+    Load unit information for a text from the cache, building it if needed.
+clear_text_units
+    Remove all cached unit information for a text.
+"""
+import io
+import itertools
+
+from bson.objectid import ObjectId
+import gridfs
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from tesserae.db.entities import Entity, Unit
+
+
+CACHE_BUCKET = 'unit_cache'
+# bump this whenever the stored arrays change so that stale blobs are ignored
+CACHE_VERSION = 1
+
+
+class TextUnits:
+    """Flattened unit information for one text
+
+    Every token position of every unit is numbered consecutively across the
+    whole text; ``break_inds`` records where each unit begins.
+
+    Attributes
+    ----------
+    text_id : bson.objectid.ObjectId
+        The text these units belong to
+    unit_type : {'line', 'phrase'}
+        The divisions of the text
+    feature : str
+        The feature recorded in ``indptr``/``indices``
+    unit_ids : list of bson.objectid.ObjectId
+        Database ids of the units, in unit order
+    tags : list of str
+        The first tag of each unit ('' if the unit has none)
+    snippets : list of str
+        The snippet of each unit
+    break_inds : 1d np.array of ints
+        the positions ``break_inds[i]:break_inds[i+1]`` belong to unit i
+    forms : 1d np.array of ints
+        ``forms[p]`` is the form index of the token at position p
+    indptr, indices : 1d np.array of ints
+        CSR encoding of the positions x features matrix; the feature indices
+        found at position p are ``indices[indptr[p]:indptr[p+1]]``
+    """
+
+    def __init__(self, text_id, unit_type, feature, unit_ids, tags, snippets,
+                 break_inds, forms, indptr, indices):
+        self.text_id = text_id
+        self.unit_type = unit_type
+        self.feature = feature
+        self.unit_ids = unit_ids
+        self.tags = tags
+        self.snippets = snippets
+        self.break_inds = break_inds
+        self.forms = forms
+        self.indptr = indptr
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.unit_ids)
+
+    @property
+    def positions_size(self):
+        """The total number of token positions across all units"""
+        return len(self.forms)
+
+    def get_display_tags(self, unit_ind):
+        """The tags of a unit in the form expected by TagHelper"""
+        tag = self.tags[unit_ind]
+        return [tag] if tag else []
+
+    def feature_matrix(self, stoplist, features_size):
+        """Build the positions x features matrix without stopwords
+
+        Parameters
+        ----------
+        stoplist : 1d np.array of ints
+            feature indices which should not be recorded
+        features_size : int
+            the total number of feature types for ``feature``
+
+        Returns
+        -------
+        M : csr_matrix
+            if ``M[i, j] == True``, the position i has feature j
+        """
+        keep = ~np.isin(self.indices, np.asarray(stoplist, dtype=np.int64))
+        positions = np.repeat(
+            np.arange(self.positions_size), np.diff(self.indptr))
+        indptr = np.zeros(self.positions_size + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(
+            np.bincount(positions[keep], minlength=self.positions_size))
+        indices = self.indices[keep]
+        return csr_matrix(
+            (np.ones(len(indices), dtype=bool), indices, indptr),
+            shape=(self.positions_size, features_size))
+
+    def to_bytes(self):
+        """Serialize the arrays of this object into .npz format"""
+        buf = io.BytesIO()
+        np.savez(
+            buf,
+            unit_ids=np.frombuffer(
+                b''.join(u.binary for u in self.unit_ids),
+                dtype=np.uint8).reshape(-1, 12),
+            break_inds=self.break_inds,
+            forms=self.forms,
+            indptr=self.indptr,
+            indices=self.indices,
+            **_pack_strings('tags', self.tags),
+            **_pack_strings('snippets', self.snippets))
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data, text_id, unit_type, feature):
+        """Deserialize an object created by ``to_bytes``"""
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            return cls(
+                text_id, unit_type, feature,
+                unit_ids=[
+                    ObjectId(row.tobytes()) for row in arrays['unit_ids']],
+                tags=_unpack_strings('tags', arrays),
+                snippets=_unpack_strings('snippets', arrays),
+                break_inds=arrays['break_inds'],
+                forms=arrays['forms'],
+                indptr=arrays['indptr'],
+                indices=arrays['indices'])
+
+
+def _pack_strings(name, strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    return {
+        name: np.frombuffer(b''.join(encoded), dtype=np.uint8),
+        name + '_offsets': offsets
+    }
+
+
+def _unpack_strings(name, arrays):
+    data = arrays[name].tobytes()
+    offsets = arrays[name + '_offsets']
+    return [
+        data[start:end].decode('utf-8')
+        for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def _get_units(connection, text_id, unit_type, feature):
+    return [
+        u for u in connection.aggregate(
+            Unit.collection,
+            [
+                {'$match': {'text': text_id, 'unit_type': unit_type}},
+                {'$sort': {'index': 1}},
+                {'$project': {
+                    '_id': True,
+                    'tags': True,
+                    'snippet': True,
+                    'forms': {
+                        # flatten list of lists of ints into list of ints
+                        # https://docs.mongodb.com/manual/reference/operator/aggregation/reduce/
+                        '$reduce': {
+                            'input': '$tokens.features.form',
+                            'initialValue': [],
+                            'in': {
+                                '$concatArrays': ['$$value', '$$this']
+                            }
+                        }
+                    },
+                    'features': '$tokens.features.'+feature,
+                }}
+            ],
+            encode=False
+        )
+    ]
+
+
+def build_text_units(units, text_id, unit_type, feature):
+    """Flatten unit information retrieved from the database
+
+    Parameters
+    ----------
+    units : list of dict
+        each dictionary must have the keys '_id', 'tags', 'snippet', 'forms'
+        and 'features'; 'features' is a list with one list of feature indices
+        for each position in 'forms'
+    text_id : bson.objectid.ObjectId
+    unit_type : str
+    feature : str
+
+    Returns
+    -------
+    TextUnits
+    """
+    break_inds = np.zeros(len(units) + 1, dtype=np.int64)
+    break_inds[1:] = np.cumsum([len(u['features']) for u in units])
+    position_features = [
+        [f for f in features if f >= 0]
+        for features in itertools.chain.from_iterable(
+            u['features'] for u in units)]
+    indptr = np.zeros(len(position_features) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(f) for f in position_features])
+    return TextUnits(
+        text_id, unit_type, feature,
+        unit_ids=[u['_id'] for u in units],
+        tags=[u['tags'][0] if u['tags'] else '' for u in units],
+        snippets=[u['snippet'] for u in units],
+        break_inds=break_inds,
+        forms=np.fromiter(
+            itertools.chain.from_iterable(u['forms'] for u in units),
+            dtype=np.int64, count=int(break_inds[-1])),
+        indptr=indptr,
+        indices=np.fromiter(
+            itertools.chain.from_iterable(position_features),
+            dtype=np.int64, count=int(indptr[-1])))
+
+
+def get_text_units(connection, text, unit_type, feature):
+    """Retrieve flattened unit information for a text
+
+    The cached copy is used if there is one; otherwise the units are read
+    from the database and the result is cached for later searches.
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    text : tesserae.db.entities.Text or bson.objectid.ObjectId
+        The text whose units are wanted
+    unit_type : {'line', 'phrase'}
+        The divisions of the text to use
+    feature : str
+        The feature to record for each position
+
+    Returns
+    -------
+    TextUnits
+    """
+    text_id = text.id if isinstance(text, Entity) else text
+    fs = gridfs.GridFS(connection.connection, collection=CACHE_BUCKET)
+    query = {
+        'text': text_id,
+        'unit_type': unit_type,
+        'feature': feature,
+        'version': CACHE_VERSION
+    }
+    cached = fs.find_one(query)
+    if cached is not None:
+        return TextUnits.from_bytes(
+            cached.read(), text_id, unit_type, feature)
+    text_units = build_text_units(
+        _get_units(connection, text_id, unit_type, feature),
+        text_id, unit_type, feature)
+    fs.put(text_units.to_bytes(), **query)
+    return text_units
+
+
+def clear_text_units(connection, text_id):
+    """Remove all cached unit information for a text
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    text_id : bson.objectid.ObjectId
+        The text whose cached information should be removed
+    """
+    fs = gridfs.GridFS(connection.connection, collection=CACHE_BUCKET)
+    for cached in fs.find({'text': text_id}):
+        fs.delete(cached._id)
@@ -134,6 +134,29 @@ class BaseTokenizer(object):
             Features associated with the tokens to be inserted into the
             database.
         """
+        return self.tokenize_prepared(self.prepare(raw), text=text)
+
+    def prepare(self, raw):
+        """Normalize and featurize the words in a string.
+
+        This is the expensive part of ``tokenize``, and it does not use the
+        database, so it may run in a different process from
+        ``tokenize_prepared``.
+
+        Parameters
+        ----------
+        raw : str or list of str
+            The string(s) to process; see ``tokenize``.
+
+        Returns
+        -------
+        display : list of str
+            The display form of every token.
+        tags : list of str
+            Metadata about the source text for unit bookeeping.
+        featurized : dict[str, list]
+            The features of each normalized token, by feature type.
+        """
         # eliminate any lines that don't begin with a tag
         raw = '\n'.join([line for line in raw.split('\n')
             if line.strip().startswith('<') and '>' in line]) + '\n'
@@ -157,6 +180,29 @@ class BaseTokenizer(object):
         # normalized forms as additional results.
         featurized = self.featurize(normalized)
         featurized['form'] = normalized
+        return display, tags, featurized
+
+    def tokenize_prepared(self, prepared, text=None, db_features=None):
+        """Create token and feature entities for a prepared string.
+
+        Parameters
+        ----------
+        prepared : tuple
+            The output of ``prepare``.
+        text : tesserae.Text, optional
+            Text metadata for associating tokens and frequencies with a
+            particular text.
+        db_features : dict[str, list of tesserae.db.Feature], optional
+            The features of the text's language already in the database, by
+            feature type.  If not given, they are read from the database.
+
+        Returns
+        -------
+        tokens, tags, features
+            See ``tokenize``.
+        """
+        display, tags, featurized = prepared
+        featurized = dict(featurized)
 
         # Get the text id from the metadata if it was passed in
         try:
@@ -173,8 +219,9 @@ class BaseTokenizer(object):
         tokens = []
 
         # Convert all computed features into entities, discarding duplicates.
-        db_features = _get_db_features_by_type(self.connection, language,
-                featurized.keys())
+        if db_features is None:
+            db_features = _get_db_features_by_type(self.connection, language,
+                    featurized.keys())
         results = [create_features(db_features[ft], text_id, language, ft,
             featurized[ft]) for ft in featurized.keys()]
 
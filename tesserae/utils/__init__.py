@@ -1,3 +1,3 @@
 from .tessfile import TessFile
-from .ingest import ingest_text, reingest_text
+from .ingest import ingest_text, ingest_texts, reingest_text
 from .delete import remove_text
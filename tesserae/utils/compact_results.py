@@ -0,0 +1,178 @@
+"""Compact columnar storage of search results.
+
+Instead of one ``Match`` document per match, the results of a search can be
+stored as a single GridFS blob of arrays: unit indices, scores, matched
+feature indices and highlight positions.  Snippets, tags and feature tokens
+are not repeated for every match; ``tesserae.utils.retrieve.get_results``
+joins them back in from the units and features when the results are read.
+
+Classes
+-------
+MatchColumns
+    The matches of one search as parallel arrays.
+
+Functions
+---------
+store_match_columns
+    Save the matches of a search.
+get_match_columns
+    Load the matches of a search, if they were stored in compact form.
+clear_match_columns
+    Remove the compact matches of a search.
+"""
+import io
+
+import gridfs
+import numpy as np
+
+
+RESULTS_BUCKET = 'compact_results'
+# bump this whenever the stored arrays change so that stale blobs are ignored
+RESULTS_VERSION = 1
+
+
+class MatchColumns:
+    """The matches of one search as parallel arrays
+
+    Match i is between source unit ``source_inds[i]`` and target unit
+    ``target_inds[i]``, where unit indices follow the unit order of their
+    text (see ``tesserae.matchers.unit_cache.TextUnits``).
+
+    Attributes
+    ----------
+    source_text, target_text : bson.objectid.ObjectId
+        The texts that were matched
+    source_unit_type, target_unit_type : {'line', 'phrase'}
+        The divisions of the texts that were matched
+    feature : str
+        The feature that was matched on
+    language : str
+        The language of the features in ``features_indices``
+    source_inds, target_inds : 1d np.array of ints
+        unit indices of each match
+    scores : 1d np.array of floats
+        the score of each match
+    features_indptr, features_indices : 1d np.array of ints
+        the feature indices matched by match i are
+        ``features_indices[features_indptr[i]:features_indptr[i+1]]``
+    highlights_indptr : 1d np.array of ints
+        the matched word positions of match i are
+        ``highlights[highlights_indptr[i]:highlights_indptr[i+1]]``
+    highlights : 2d np.array of ints
+        each row is a (source position, target position) pair of words that
+        matched, as in ``Match.highlight``
+    """
+
+    def __init__(self, source_text, target_text, source_unit_type,
+                 target_unit_type, feature, language, source_inds,
+                 target_inds, scores, features_indptr, features_indices,
+                 highlights_indptr, highlights):
+        self.source_text = source_text
+        self.target_text = target_text
+        self.source_unit_type = source_unit_type
+        self.target_unit_type = target_unit_type
+        self.feature = feature
+        self.language = language
+        self.source_inds = source_inds
+        self.target_inds = target_inds
+        self.scores = scores
+        self.features_indptr = features_indptr
+        self.features_indices = features_indices
+        self.highlights_indptr = highlights_indptr
+        self.highlights = highlights
+
+    def __len__(self):
+        return len(self.scores)
+
+    def to_bytes(self):
+        """Serialize the arrays of this object into .npz format"""
+        buf = io.BytesIO()
+        # unit indices, feature indices and word positions all fit in 32 bits
+        np.savez_compressed(
+            buf,
+            source_inds=self.source_inds.astype(np.int32),
+            target_inds=self.target_inds.astype(np.int32),
+            scores=self.scores,
+            features_indptr=self.features_indptr,
+            features_indices=self.features_indices.astype(np.int32),
+            highlights_indptr=self.highlights_indptr,
+            highlights=self.highlights.astype(np.int32))
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data, source_text, target_text, source_unit_type,
+                   target_unit_type, feature, language):
+        """Deserialize an object created by ``to_bytes``"""
+        with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            return cls(
+                source_text, target_text, source_unit_type,
+                target_unit_type, feature, language,
+                source_inds=arrays['source_inds'],
+                target_inds=arrays['target_inds'],
+                scores=arrays['scores'],
+                features_indptr=arrays['features_indptr'],
+                features_indices=arrays['features_indices'],
+                highlights_indptr=arrays['highlights_indptr'],
+                highlights=arrays['highlights'])
+
+
+def store_match_columns(connection, search_id, columns):
+    """Save the matches of a search in compact form
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    search_id : bson.objectid.ObjectId
+        The search the matches belong to
+    columns : MatchColumns
+        The matches to save
+    """
+    fs = gridfs.GridFS(connection.connection, collection=RESULTS_BUCKET)
+    fs.put(
+        columns.to_bytes(),
+        search_id=search_id,
+        version=RESULTS_VERSION,
+        source_text=columns.source_text,
+        target_text=columns.target_text,
+        source_unit_type=columns.source_unit_type,
+        target_unit_type=columns.target_unit_type,
+        feature=columns.feature,
+        language=columns.language)
+
+
+def get_match_columns(connection, search_id):
+    """Load the matches of a search saved in compact form
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    search_id : bson.objectid.ObjectId
+        The search whose matches are wanted
+
+    Returns
+    -------
+    MatchColumns or None
+        None if the search's matches were not saved in compact form
+    """
+    fs = gridfs.GridFS(connection.connection, collection=RESULTS_BUCKET)
+    stored = fs.find_one({'search_id': search_id, 'version': RESULTS_VERSION})
+    if stored is None:
+        return None
+    return MatchColumns.from_bytes(
+        stored.read(), stored.source_text, stored.target_text,
+        stored.source_unit_type, stored.target_unit_type, stored.feature,
+        stored.language)
+
+
+def clear_match_columns(connection, search_id):
+    """Remove the compact matches of a search
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    search_id : bson.objectid.ObjectId
+        The search whose matches should be removed
+    """
+    fs = gridfs.GridFS(connection.connection, collection=RESULTS_BUCKET)
+    for stored in fs.find({'search_id': search_id}):
+        fs.delete(stored._id)
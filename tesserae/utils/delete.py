@@ -1,5 +1,10 @@
 """Functions for removing information from the database"""
 from tesserae.db.entities import Feature, Match, Search, Token, Unit
+from tesserae.matchers.text_statistics import clear_text_statistics
+from tesserae.matchers.unit_cache import clear_text_units
+from tesserae.utils.compact_results import clear_match_columns
+from tesserae.utils.frequencies import clear_text_frequency_tables, \
+        remove_text_frequencies
 
 
 def remove_text(connection, text):
@@ -20,6 +25,9 @@ def remove_text(connection, text):
 
     connection.connection[Token.collection].delete_many({'text': text_id})
     connection.connection[Unit.collection].delete_many({'text': text_id})
+    clear_text_units(connection, text_id)
+    clear_text_statistics(connection, text_id)
+    clear_text_frequency_tables(connection, text_id)
 
     searches = connection.aggregate(
         Search.collection,
@@ -36,8 +44,11 @@ def remove_text(connection, text):
         )
         # remember to re-index after removing Match entities
         matchdb.reindex()
+        for s in searches:
+            clear_match_columns(connection, s.id)
         connection.delete(searches)
 
+    remove_text_frequencies(connection, text_id)
     connection.connection[Feature.collection].update_many(
         {'frequencies.'+str(text_id): {'$exists': True}},
         {'$unset': {'frequencies.'+str(text_id): ""}}
@@ -0,0 +1,106 @@
+"""Streaming export of search results
+
+Results are read from the database in batches and written out one at a time,
+so exporting takes the same memory however many results a search has.
+"""
+import csv
+import json
+
+from tesserae.utils.retrieve import iter_results
+
+
+EXPORT_FORMATS = ('csv', 'tsv', 'jsonl')
+# column order for csv and tsv exports
+EXPORT_FIELDS = (
+    'source_tag', 'target_tag', 'score', 'matched_features',
+    'source_snippet', 'target_snippet', 'highlight'
+)
+
+
+def _to_row(result):
+    """Flatten a result into strings for a csv or tsv row"""
+    return [
+        result['source_tag'],
+        result['target_tag'],
+        repr(result['score']),
+        '; '.join(result['matched_features']),
+        result['source_snippet'],
+        result['target_snippet'],
+        json.dumps(result['highlight'])
+    ]
+
+
+def write_results(results, out, file_format='csv'):
+    """Write search results to a file-like object as they are produced
+
+    Parameters
+    ----------
+    results : iterable of MatchResult
+        The results to write, e.g. from ``tesserae.utils.retrieve
+        .iter_results``
+    out : file-like object
+        Text stream to write to; for csv and tsv, it should be opened with
+        ``newline=''``
+    file_format : {'csv', 'tsv', 'jsonl'}
+        csv and tsv get a header row followed by one row per result, with
+        matched features joined by '; ' and the highlight as JSON; jsonl gets
+        one JSON object per line
+
+    Returns
+    -------
+    int
+        The number of results written
+
+    Raises
+    ------
+    ValueError
+        Raised when ``file_format`` is not supported
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(
+            f'Unknown export format "{file_format}"; '
+            f'choose one of {", ".join(EXPORT_FORMATS)}')
+    count = 0
+    if file_format == 'jsonl':
+        for result in results:
+            out.write(json.dumps(result, ensure_ascii=False))
+            out.write('\n')
+            count += 1
+        return count
+    writer = csv.writer(
+        out, delimiter=',' if file_format == 'csv' else '\t')
+    writer.writerow(EXPORT_FIELDS)
+    for result in results:
+        writer.writerow(_to_row(result))
+        count += 1
+    return count
+
+
+def export_results(connection, results_id, out, file_format='csv',
+                   sort_by=None, sort_order='descending', batch_size=1000):
+    """Write all results of a search to a file-like object
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    results_id : str
+        UUID for Search whose results should be exported
+    out : file-like object
+        Text stream to write to
+    file_format : {'csv', 'tsv', 'jsonl'}
+        See ``write_results``
+    sort_by, sort_order
+        See ``tesserae.utils.retrieve.get_results``
+    batch_size : int
+        The number of matches to read from the database at a time
+
+    Returns
+    -------
+    int
+        The number of results written
+    """
+    return write_results(
+        iter_results(
+            connection, results_id, sort_by=sort_by, sort_order=sort_order,
+            batch_size=batch_size),
+        out, file_format=file_format)
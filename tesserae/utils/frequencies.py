@@ -0,0 +1,532 @@
+"""Normalized storage of feature frequencies.
+
+Each Feature carries a map of its count in every text, but corpus statistics
+computed from those maps have to visit every Feature and add up its map on
+every search.  The counts are also kept here, normalized:
+
+* ``TEXT_FREQUENCIES`` has one document per (feature, text) pair, with the
+  feature's count in that text;
+* ``CORPUS_FREQUENCIES`` has one document per feature, with its count across
+  the whole corpus, maintained as texts are ingested and removed.
+
+Both are indexed, so stoplists and frequency vectors become index lookups.
+
+The word frequencies of each text, which depend on nothing but the text, are
+computed at ingest and saved in GridFS.
+
+Dense corpus count vectors are cached in memory and in GridFS, keyed by a
+per-language corpus version that changes whenever a text of the language is
+ingested or removed, so repeat searches (from any process) skip the database
+work entirely.
+
+Functions
+---------
+add_text_frequencies
+    Record the feature counts of a newly ingested text.
+remove_text_frequencies
+    Forget the feature counts of a text.
+rebuild_frequencies
+    Rebuild both collections from the frequencies stored on Features.
+compute_text_frequencies
+    The frequency of each word type in a text.
+store_text_frequency_table
+    Compute and save the word frequencies of a text.
+get_text_frequency_tables
+    Load the saved word frequencies of several texts.
+get_text_frequency_table
+    Load the saved word frequencies of a text.
+clear_text_frequency_tables
+    Remove the saved word frequencies of a text.
+get_corpus_version
+    The current version of a language's corpus.
+get_corpus_frequency_counts
+    Corpus counts of every feature of a kind, by feature index.
+get_top_features
+    Indices of the most frequent features in the corpus or in some texts.
+"""
+import io
+
+from bson.objectid import ObjectId
+import gridfs
+import numpy as np
+import pymongo
+from scipy.sparse import csr_matrix
+
+from tesserae.db.entities import Entity, Feature, Text
+
+
+TEXT_FREQUENCIES = 'text_frequencies'
+CORPUS_FREQUENCIES = 'corpus_frequencies'
+CORPUS_VERSIONS = 'corpus_versions'
+COUNTS_BUCKET = 'frequency_cache'
+TABLES_BUCKET = 'text_frequency_tables'
+# bump this whenever the stored tables change so that stale blobs are ignored
+TABLES_VERSION = 1
+
+# (database name, language, feature) -> (corpus version, counts, stoplists)
+_corpus_counts = {}
+
+
+def create_frequency_indices(connection):
+    """Create the indices that frequency lookups rely on
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    """
+    connection.connection[TEXT_FREQUENCIES].create_index([
+        ('text', pymongo.ASCENDING),
+        ('language', pymongo.ASCENDING),
+        ('feature', pymongo.ASCENDING),
+        ('index', pymongo.ASCENDING)
+    ])
+    connection.connection[CORPUS_FREQUENCIES].create_index([
+        ('language', pymongo.ASCENDING),
+        ('feature', pymongo.ASCENDING),
+        ('index', pymongo.ASCENDING)
+    ], unique=True)
+
+
+def _add_to_totals(connection, counts):
+    """Add to the corpus counts of features
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    counts : list of ((str, str, int), int)
+        ((language, feature, index), amount to add) pairs
+    """
+    bulk = [
+        pymongo.UpdateOne(
+            {'language': language, 'feature': feature, 'index': index},
+            {'$inc': {'count': count}},
+            upsert=True)
+        for (language, feature, index), count in counts
+    ]
+    if bulk:
+        connection.connection[CORPUS_FREQUENCIES].bulk_write(
+            bulk, ordered=False)
+
+
+def add_text_frequencies(connection, text, features):
+    """Record the feature counts of a newly ingested text
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    text : tesserae.db.entities.Text
+        The text that was ingested
+    features : list of tesserae.db.entities.Feature
+        The features that occur in ``text``; their ``frequencies`` hold
+        their counts in it
+    """
+    text_key = str(text.id)
+    rows = [
+        {
+            'language': f.language,
+            'feature': f.feature,
+            'index': f.index,
+            'text': text.id,
+            'count': f.frequencies[text_key]
+        }
+        for f in features
+    ]
+    if not rows:
+        return
+    connection.connection[TEXT_FREQUENCIES].insert_many(rows, ordered=False)
+    _add_to_totals(connection, [
+        ((row['language'], row['feature'], row['index']), row['count'])
+        for row in rows
+    ])
+    # a database ingested before these collections existed has texts without
+    # rows, and stays incomplete until rebuild_frequencies is run
+    first_text = connection.connection[Text.collection].count_documents(
+        {'language': text.language, '_id': {'$ne': text.id}}, limit=1) == 0
+    _bump_corpus_version(connection, text.language, complete=first_text)
+
+
+def remove_text_frequencies(connection, text_id):
+    """Forget the feature counts of a text
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    text_id : bson.objectid.ObjectId
+        The text being removed
+    """
+    rows = list(connection.connection[TEXT_FREQUENCIES].find(
+        {'text': text_id},
+        {'_id': False, 'language': True, 'feature': True, 'index': True,
+         'count': True}))
+    _add_to_totals(connection, [
+        ((row['language'], row['feature'], row['index']), -row['count'])
+        for row in rows
+    ])
+    connection.connection[TEXT_FREQUENCIES].delete_many({'text': text_id})
+    for language in {row['language'] for row in rows}:
+        _bump_corpus_version(connection, language, complete=False)
+
+
+def rebuild_frequencies(connection):
+    """Rebuild both frequency collections from the Feature documents
+
+    Needed once for databases populated before the collections existed;
+    until then, corpus counts and stoplists of their languages raise
+    ValueError.  The ``tesserae.cli.rebuild_frequencies`` script runs this.
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    """
+    connection.connection.drop_collection(TEXT_FREQUENCIES)
+    connection.connection.drop_collection(CORPUS_FREQUENCIES)
+    create_frequency_indices(connection)
+    features = connection.connection[Feature.collection].find(
+        {},
+        {'_id': False, 'language': True, 'feature': True, 'index': True,
+         'frequencies': True})
+    rows = []
+    totals = []
+    for f in features:
+        key = {
+            'language': f['language'],
+            'feature': f['feature'],
+            'index': f['index']
+        }
+        frequencies = f.get('frequencies', {})
+        totals.append(dict(key, count=sum(frequencies.values())))
+        rows.extend(
+            dict(key, text=ObjectId(text), count=count)
+            for text, count in frequencies.items())
+    if rows:
+        connection.connection[TEXT_FREQUENCIES].insert_many(
+            rows, ordered=False)
+    if totals:
+        connection.connection[CORPUS_FREQUENCIES].insert_many(
+            totals, ordered=False)
+    for language in {t['language'] for t in totals}:
+        # every text of the language is counted now
+        connection.connection[CORPUS_VERSIONS].update_one(
+            {'language': language},
+            {'$set': {'version': ObjectId(), 'complete': True}},
+            upsert=True)
+
+
+def compute_text_frequencies(forms, indptr, indices):
+    """Compute the frequency of each word type in a text
+
+    The frequency of a word type is the proportion of the text's tokens that
+    share at least one feature type with it (see
+    ``tesserae.matchers.sparse_encoding.get_text_frequencies``).
+
+    Parameters
+    ----------
+    forms : 1d np.array of ints
+        the form index of each token of the text
+    indptr, indices : 1d np.array of ints
+        CSR encoding of the features of each token, as in
+        ``tesserae.matchers.unit_cache.TextUnits``
+
+    Returns
+    -------
+    dict [int, float]
+        frequency by form index; word types without features are left out
+    """
+    text_token_count = len(forms)
+    # number word types and feature types consecutively
+    word_types, token_words = np.unique(forms, return_inverse=True)
+    word_counts = np.bincount(token_words, minlength=len(word_types))
+    feature_types, pair_features = np.unique(indices, return_inverse=True)
+    pair_words = np.repeat(token_words, np.diff(indptr))
+    # if word_feature_matrix[i, j] == True, word type i has feature type j
+    word_feature_matrix = csr_matrix(
+        (np.ones(len(pair_words), dtype=bool), (pair_words, pair_features)),
+        shape=(len(word_types), len(feature_types)))
+    # if matching_words_matrix[i, j] == True, then the word represented by
+    # position i shared at least one feature type with the word represented
+    # by position j
+    matching_words_matrix = word_feature_matrix.dot(
+        word_feature_matrix.transpose())
+    matching_words_matrix.data[:] = True
+    matching_counts = matching_words_matrix.astype(np.int64).dot(word_counts)
+    # word types without features match nothing and get no frequency
+    has_match = np.diff(matching_words_matrix.indptr) > 0
+    return dict(zip(
+        word_types[has_match].tolist(),
+        (matching_counts[has_match] / text_token_count).tolist()))
+
+
+def store_text_frequency_table(connection, text_units):
+    """Compute and save the word frequencies of a text
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    text_units : tesserae.matchers.unit_cache.TextUnits
+        The line units of the text; word types are matched by their
+        ``feature``
+
+    Returns
+    -------
+    dict [int, float]
+        See ``compute_text_frequencies``
+    """
+    freqs = compute_text_frequencies(
+        text_units.forms, text_units.indptr, text_units.indices)
+    buf = io.BytesIO()
+    np.savez(
+        buf,
+        forms=np.fromiter(freqs.keys(), dtype=np.int64, count=len(freqs)),
+        frequencies=np.fromiter(
+            freqs.values(), dtype=np.float64, count=len(freqs)))
+    fs = gridfs.GridFS(connection.connection, collection=TABLES_BUCKET)
+    fs.put(
+        buf.getvalue(), text=text_units.text_id, feature=text_units.feature,
+        version=TABLES_VERSION)
+    return freqs
+
+
+def get_text_frequency_tables(connection, text_ids, feature):
+    """Load the saved word frequencies of several texts in one query
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    text_ids : list of bson.objectid.ObjectId
+    feature : str
+
+    Returns
+    -------
+    dict [bson.objectid.ObjectId, dict [int, float]]
+        See ``compute_text_frequencies``; texts without a saved table are
+        left out
+    """
+    fs = gridfs.GridFS(connection.connection, collection=TABLES_BUCKET)
+    tables = {}
+    for stored in fs.find({
+            'text': {'$in': list(text_ids)}, 'feature': feature,
+            'version': TABLES_VERSION}):
+        with np.load(io.BytesIO(stored.read()), allow_pickle=False) \
+                as arrays:
+            tables[stored.text] = dict(zip(
+                arrays['forms'].tolist(), arrays['frequencies'].tolist()))
+    return tables
+
+
+def get_text_frequency_table(connection, text_id, feature):
+    """Load the saved word frequencies of a text
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    text_id : bson.objectid.ObjectId
+    feature : str
+
+    Returns
+    -------
+    dict [int, float] or None
+        See ``compute_text_frequencies``; None if no table was saved
+    """
+    return get_text_frequency_tables(
+        connection, [text_id], feature).get(text_id)
+
+
+def clear_text_frequency_tables(connection, text_id):
+    """Remove the saved word frequencies of a text
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    text_id : bson.objectid.ObjectId
+    """
+    fs = gridfs.GridFS(connection.connection, collection=TABLES_BUCKET)
+    for stored in fs.find({'text': text_id}):
+        fs.delete(stored._id)
+
+
+def _bump_corpus_version(connection, language, complete):
+    """Mark the corpus of a language as changed
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    language : str
+    complete : bool
+        If the language has no version yet, whether the frequency
+        collections hold every one of its texts
+    """
+    # a fresh ObjectId rather than a counter, so that versions are not
+    # reused if the database is dropped and rebuilt
+    connection.connection[CORPUS_VERSIONS].update_one(
+        {'language': language},
+        {
+            '$set': {'version': ObjectId()},
+            '$setOnInsert': {'complete': complete}
+        },
+        upsert=True)
+
+
+def _get_complete_version(connection, language):
+    """The corpus version of a language whose frequencies are all recorded
+
+    Returns
+    -------
+    bson.objectid.ObjectId or None
+        See ``get_corpus_version``
+
+    Raises
+    ------
+    ValueError
+        Raised when texts of ``language`` were ingested before the frequency
+        collections existed and ``rebuild_frequencies`` has not been run
+    """
+    found = connection.connection[CORPUS_VERSIONS].find_one(
+        {'language': language})
+    if found is None:
+        # either nothing of the language was ingested or all of it was
+        # ingested before versions were kept
+        complete = connection.connection[Feature.collection].count_documents(
+            {'language': language}, limit=1) == 0
+    else:
+        complete = found.get('complete', False)
+    if not complete:
+        raise ValueError(
+            f'Feature frequencies of the {language} corpus are incomplete, '
+            f'since texts were ingested before they were recorded; run '
+            f'tesserae.utils.frequencies.rebuild_frequencies (e.g., with '
+            f'the tesserae.cli.rebuild_frequencies script) once to fix this')
+    return None if found is None else found['version']
+
+
+def get_corpus_version(connection, language):
+    """The current version of a language's corpus
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    language : str
+
+    Returns
+    -------
+    bson.objectid.ObjectId or None
+        An id that changes whenever a text of ``language`` is ingested or
+        removed; None if no text of ``language`` has been
+    """
+    found = connection.connection[CORPUS_VERSIONS].find_one(
+        {'language': language})
+    return None if found is None else found['version']
+
+
+def _count_corpus_frequencies(connection, feature, language):
+    """Read the corpus counts of every feature of a kind from the database"""
+    size = connection.connection[Feature.collection].count_documents(
+        {'feature': feature, 'language': language})
+    counts = np.zeros(size, dtype=np.int64)
+    totals = connection.connection[CORPUS_FREQUENCIES].find(
+        {'feature': feature, 'language': language},
+        {'_id': False, 'index': True, 'count': True})
+    for total in totals:
+        counts[total['index']] = total['count']
+    return counts
+
+
+def _get_cached_counts(connection, feature, language):
+    """Get the cache entry for a kind of feature, filling it if needed
+
+    Returns
+    -------
+    counts : 1d np.array of ints
+        See ``get_corpus_frequency_counts``; read-only
+    stoplists : dict[int, 1d np.array of np.uint32]
+        The top features already computed from ``counts``, by length
+    """
+    key = (connection.connection.name, language, feature)
+    version = _get_complete_version(connection, language)
+    cached = _corpus_counts.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+
+    fs = gridfs.GridFS(connection.connection, collection=COUNTS_BUCKET)
+    query = {'language': language, 'feature': feature, 'version': version}
+    stored = fs.find_one(query)
+    if stored is not None:
+        counts = np.load(io.BytesIO(stored.read()), allow_pickle=False)
+    else:
+        counts = _count_corpus_frequencies(connection, feature, language)
+        buf = io.BytesIO()
+        np.save(buf, counts)
+        fs.put(buf.getvalue(), **query)
+        for old in fs.find({
+                'language': language, 'feature': feature,
+                'version': {'$ne': version}}):
+            fs.delete(old._id)
+    counts.setflags(write=False)
+    _corpus_counts[key] = (version, counts, {})
+    return counts, _corpus_counts[key][2]
+
+
+def get_corpus_frequency_counts(connection, feature, language):
+    """Corpus counts of every feature of a kind
+
+    Results are cached until the language's corpus version changes.
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    feature : str
+        Feature category of interest
+    language : str
+        Language to which the features of interest belong
+
+    Returns
+    -------
+    1d np.array of ints
+        position i holds the count of the feature with index i; the array
+        is shared with the cache, so it is read-only
+    """
+    return _get_cached_counts(connection, feature, language)[0]
+
+
+def get_top_features(connection, n, feature, language, texts=None):
+    """Indices of the most frequent features
+
+    Ties are broken by feature index.
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    n : int
+        How many feature indices to return
+    feature : str
+        Feature category of interest
+    language : str
+        Language to which the features of interest belong
+    texts : list of tesserae.db.entities.Text or ObjectId, optional
+        Count occurrences in these texts only; if None, count occurrences in
+        the whole corpus
+
+    Returns
+    -------
+    1d np.array of np.uint32
+        The indices of the ``n`` most frequent features, most frequent first
+    """
+    if texts is None:
+        counts, stoplists = _get_cached_counts(connection, feature, language)
+        if n not in stoplists:
+            top = np.argsort(-counts, kind='stable')[:n].astype(np.uint32)
+            top.setflags(write=False)
+            stoplists[n] = top
+        return stoplists[n]
+    _get_complete_version(connection, language)
+    text_ids = [t.id if isinstance(t, Entity) else t for t in texts]
+    top = connection.connection[TEXT_FREQUENCIES].aggregate([
+        {'$match': {
+            'text': {'$in': text_ids},
+            'language': language,
+            'feature': feature
+        }},
+        {'$group': {'_id': '$index', 'count': {'$sum': '$count'}}},
+        {'$sort': {'count': -1, '_id': 1}},
+        {'$limit': n}
+    ])
+    return np.array([t['_id'] for t in top], dtype=np.uint32)
@@ -1,6 +1,15 @@
-from tesserae.db.entities import Feature
+import collections
+import multiprocessing
+import traceback
+
+import pymongo
+
+from tesserae.db.entities import Feature, Text
+from tesserae.matchers.unit_cache import get_text_units
 from tesserae.tokenizers import GreekTokenizer, LatinTokenizer
 from tesserae.unitizer import Unitizer
+from tesserae.utils.frequencies import add_text_frequencies, \
+        store_text_frequency_table
 from tesserae.utils.tessfile import TessFile
 from tesserae.utils.delete import remove_text
 
@@ -10,6 +19,9 @@ _tokenizers = {
     'latin': LatinTokenizer,
 }
 
+# features whose text frequency tables are saved at ingest time
+_frequency_table_features = ('form', 'lemmata')
+
 
 def ingest_text(connection, text):
     """Update database with a new text
@@ -40,32 +52,185 @@ def ingest_text(connection, text):
     result = connection.insert(text)
     text_id = result.inserted_ids[0]
 
-    tokens, tags, features = \
-        _tokenizers[tessfile.metadata.language](connection).tokenize(
-            tessfile.read(), text=tessfile.metadata)
-
-    feature_cache = {(f.feature, f.token): f for f in connection.find(
-        Feature.collection, language=text.language)}
-    features_for_insert = []
-    features_for_update = []
-
-    for f in features:
-        if (f.feature, f.token) not in feature_cache:
-            features_for_insert.append(f)
-            feature_cache[(f.feature, f.token)] = f
-        else:
-            f.id = feature_cache[(f.feature, f.token)].id
-            features_for_update.append(f)
+    tokenizer = _tokenizers[tessfile.metadata.language](connection)
+    _store_text(
+        connection, tessfile.metadata, tokenizer,
+        tokenizer.prepare(tessfile.read()))
+
+    return text_id
+
+
+def _store_text(connection, text, tokenizer, prepared, db_features=None):
+    """Write the tokens, features and units of a prepared text
+
+    Parameters
+    ----------
+    connection : tesserae.db.TessMongoConnection
+        A connection to the database
+    text : tesserae.db.entities.Text
+        The text being ingested; it must already be in the database
+    tokenizer : tesserae.tokenizers.base.BaseTokenizer
+        The tokenizer for the text's language
+    prepared : tuple
+        The output of ``tokenizer.prepare`` for the text
+    db_features : dict[str, list of Feature], optional
+        The features of the text's language already in the database, by
+        feature type, as from ``_get_features_by_type``.  Features new to the
+        database are added to it, so that it can be reused for the next text
+        of the language.
+    """
+    if db_features is None:
+        db_features = _get_features_by_type(connection, text.language)
+    tokens, tags, features = tokenizer.tokenize_prepared(
+        prepared, text=text, db_features=db_features)
+
+    # features that came from the database already have an id
+    features_for_insert = [f for f in features if f.id is None]
+    features_for_update = [f for f in features if f.id is not None]
     insert_features_result = connection.insert(features_for_insert)
-    update_features_result = connection.update(features_for_update)
+    _update_frequencies(connection, text, features_for_update)
+    add_text_frequencies(connection, text, features)
+    for f in features_for_insert:
+        db_features[f.feature].append(f)
 
     unitizer = Unitizer()
-    lines, phrases = unitizer.unitize(tokens, tags, tessfile.metadata)
+    lines, phrases = unitizer.unitize(tokens, tags, text)
 
     result = connection.insert_nocheck(tokens)
     result = connection.insert_nocheck(lines + phrases)
 
-    return text_id
+    feature_types = {f.feature for f in features}
+    for feature in _frequency_table_features:
+        if feature in feature_types:
+            store_text_frequency_table(
+                connection, get_text_units(connection, text, 'line', feature))
+
+
+def _get_features_by_type(connection, language):
+    """Get the Features of a language in the database, by feature type"""
+    result = collections.defaultdict(list)
+    for f in connection.find(Feature.collection, language=language):
+        result[f.feature].append(f)
+    return result
+
+
+def _update_frequencies(connection, text, features):
+    """Record the frequencies of existing features in a new text
+
+    Only the entry for ``text`` in each feature's frequencies is written, so
+    the cost does not grow with the number of texts already in the database.
+
+    Parameters
+    ----------
+    connection : tesserae.db.TessMongoConnection
+        A connection to the database
+    text : tesserae.db.entities.Text
+        The text being ingested
+    features : list of Feature
+        Features already in the database that occur in ``text``
+    """
+    text_key = str(text.id)
+    bulk = [
+        pymongo.UpdateOne(
+            {'_id': f.id},
+            {'$set': {'frequencies.' + text_key: f.frequencies[text_key]}})
+        for f in features
+    ]
+    if bulk:
+        connection.connection[Feature.collection].bulk_write(
+            bulk, ordered=False)
+
+
+# tokenizers that pool workers have built so far, by language
+_worker_tokenizers = {}
+
+
+def _prepare_text(language_and_path):
+    """Read and featurize a text in a pool worker
+
+    Returns
+    -------
+    prepared : tuple or None
+        The output of the tokenizer's ``prepare``, or None if it failed
+    error : str or None
+        The traceback of the failure, if there was one
+    """
+    language, path = language_and_path
+    try:
+        if language not in _worker_tokenizers:
+            # featurizing does not use the database
+            _worker_tokenizers[language] = _tokenizers[language](None)
+        return _worker_tokenizers[language].prepare(
+            TessFile(path).read()), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def ingest_texts(connection, texts, processes=None):
+    """Ingest several new texts, featurizing them in parallel
+
+    Reading and featurizing (e.g., lemmatizing) the texts happens in a pool of
+    worker processes.  This process is the only writer: it assigns
+    ``Feature.index`` values and writes to the database one text at a time,
+    in the order of ``texts``, so indices come out as if the texts had been
+    ingested one after another with ``ingest_text``.
+
+    Parameters
+    ----------
+    connection : tesserae.db.TessMongoConnection
+        A connection to the database
+    texts : list of tesserae.db.entities.Text
+        The texts to be ingested; none of them may already be in the database
+    processes : int, optional
+        The number of worker processes; defaults to the number of cores
+
+    Yields
+    ------
+    text : tesserae.db.entities.Text
+        A text from ``texts``, in order
+    error : Exception or None
+        Why the text could not be ingested, or None if it was; a text that is
+        already in the database gets a ValueError and is left as it is
+    """
+    tokenizers = {}
+    db_features = {}
+    jobs = [(text.language, text.path) for text in texts]
+    with multiprocessing.Pool(processes) as pool:
+        for text, (prepared, error) in zip(
+                texts, pool.imap(_prepare_text, jobs)):
+            if text.language not in _tokenizers:
+                yield text, ValueError(
+                    'Unknown language: {}'.format(text.language))
+                continue
+            if error is not None:
+                yield text, RuntimeError(error)
+                continue
+            if connection.connection[Text.collection].count_documents(
+                    text.unique_values(), limit=1) > 0:
+                yield text, ValueError(
+                    'Text already in the database: {}'.format(text))
+                continue
+            try:
+                if text.language not in tokenizers:
+                    tokenizers[text.language] = \
+                        _tokenizers[text.language](connection)
+                    db_features[text.language] = _get_features_by_type(
+                        connection, text.language)
+                connection.insert(text)
+                if text.id is None:
+                    # insert skips texts it finds in the database
+                    raise ValueError(
+                        'Text already in the database: {}'.format(text))
+                _store_text(
+                    connection, text, tokenizers[text.language], prepared,
+                    db_features=db_features[text.language])
+            except Exception as e:
+                # the cached features may no longer match the database; the
+                # tokenizer itself may be what failed to build
+                tokenizers.pop(text.language, None)
+                yield text, e
+                continue
+            yield text, None
 
 
 def reingest_text(connection, text):
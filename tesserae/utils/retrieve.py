@@ -1,5 +1,9 @@
 """For retrieving search results"""
-from tesserae.db.entities import Match, Search
+import numpy as np
+
+from tesserae.db.entities import Feature, Match, Search, Text
+from tesserae.matchers.unit_cache import get_text_units
+from tesserae.utils.compact_results import get_match_columns
 
 
 class TagHelper:
@@ -50,37 +54,289 @@ class TagHelper:
         return ' '.join(tag_parts)
 
 
-def get_results(connection, results_id):
+# match fields which results may be sorted by
+SORT_KEYS = ('score', 'source_tag', 'target_tag')
+_SORT_DIRECTIONS = {'ascending': 1, 'descending': -1}
+# the fields of a match that are handed back as results
+_RESULT_PROJECTION = {
+    '_id': False,
+    'source_tag': True,
+    'target_tag': True,
+    'matched_features': True,
+    'score': True,
+    'source_snippet': True,
+    'target_snippet': True,
+    'highlight': True
+}
+
+
+def get_results(connection, results_id, sort_by=None,
+                sort_order='descending', offset=0, limit=None):
     """Retrive search results with associated id
 
     Parameters
     ----------
     results_id : str
         UUID for Search whose results you are trying to retrieve
+    sort_by : {None, 'score', 'source_tag', 'target_tag'}
+        The field to order results by; if None, results come in the order the
+        search found them
+    sort_order : {'descending', 'ascending'}
+        The direction of the sort; ties are in the order the search found
+        them, reversed for a descending sort
+    offset : int
+        The number of (sorted) results to skip
+    limit : int, optional
+        The maximum number of results to return; if None, all results after
+        ``offset`` are returned
 
     Returns
     -------
     list of MatchResult
+
+    Raises
+    ------
+    ValueError
+        Raised when a sort or paging parameter was poorly specified
     """
-    found = connection.find(
-            Search.collection, results_id=results_id, status=Search.DONE)[0]
+    _check_paging(sort_by, sort_order, offset, limit)
+    found = _get_finished_search(connection, results_id)
+    columns = get_match_columns(connection, found.id)
+    if columns is not None:
+        return list(_gen_column_results(
+            connection, columns, sort_by, sort_order, offset, limit))
     db_matches = connection.aggregate(
         Match.collection,
-        [
-            {'$match': {'search_id': found.id}},
-            {
-                '$project': {
-                    '_id': False,
-                    'source_tag': True,
-                    'target_tag': True,
-                    'matched_features': True,
-                    'score': True,
-                    'source_snippet': True,
-                    'target_snippet': True,
-                    'highlight': True
-                }
-            }
-        ],
-        encode=False
-    )
+        _results_pipeline(found.id, sort_by, sort_order, offset, limit),
+        encode=False)
     return [match for match in db_matches]
+
+
+def iter_results(connection, results_id, sort_by=None,
+                 sort_order='descending', batch_size=1000):
+    """Iterate over all search results without loading them all at once
+
+    Results are read from a database cursor ``batch_size`` matches at a
+    time.
+
+    Parameters
+    ----------
+    results_id : str
+        UUID for Search whose results you are trying to retrieve
+    sort_by, sort_order
+        See ``get_results``
+    batch_size : int
+        The number of matches to read from the database at a time
+
+    Yields
+    ------
+    MatchResult
+    """
+    _check_paging(sort_by, sort_order, 0, None)
+    found = _get_finished_search(connection, results_id)
+    columns = get_match_columns(connection, found.id)
+    if columns is not None:
+        yield from _gen_column_results(
+            connection, columns, sort_by, sort_order, 0, None)
+        return
+    # sorts too large for memory spill to disk, as in get_results
+    cursor = connection.connection[Match.collection].aggregate(
+        _results_pipeline(found.id, sort_by, sort_order, 0, None),
+        allowDiskUse=True, batchSize=batch_size)
+    try:
+        yield from cursor
+    finally:
+        cursor.close()
+
+
+def get_results_page(connection, results_id, page_size, offset=0,
+                     sort_by='score', sort_order='descending'):
+    """Retrieve one page of sorted search results
+
+    Parameters
+    ----------
+    results_id : str
+        UUID for Search whose results you are trying to retrieve
+    page_size : int
+        The maximum number of results on the page
+    offset : int
+        The number of results before this page
+    sort_by, sort_order
+        See ``get_results``
+
+    Returns
+    -------
+    page : list of MatchResult
+        The results on the page
+    total : int
+        The number of results the search has
+    """
+    page = get_results(
+        connection, results_id, sort_by=sort_by, sort_order=sort_order,
+        offset=offset, limit=page_size)
+    return page, count_results(connection, results_id)
+
+
+def count_results(connection, results_id):
+    """Count the results of a search
+
+    Parameters
+    ----------
+    results_id : str
+        UUID for Search whose results you are trying to count
+
+    Returns
+    -------
+    int
+    """
+    found = _get_finished_search(connection, results_id)
+    columns = get_match_columns(connection, found.id)
+    if columns is not None:
+        return len(columns)
+    return connection.connection[Match.collection].count_documents(
+        {'search_id': found.id})
+
+
+def _results_pipeline(search_id, sort_by, sort_order, offset, limit):
+    """Build the aggregation pipeline reading the matches of a search
+
+    Parameters
+    ----------
+    search_id : bson.objectid.ObjectId
+        The id of the Search entity whose matches are wanted
+    sort_by, sort_order, offset, limit
+        See ``get_results``
+
+    Returns
+    -------
+    list of dict
+    """
+    pipeline = [{'$match': {'search_id': search_id}}]
+    if sort_by is not None:
+        # sorting on _id as well keeps pages consistent when scores tie; it
+        # follows the sort direction so that either direction can be read
+        # from the (search_id, score, _id) index
+        direction = _SORT_DIRECTIONS[sort_order]
+        pipeline.append({'$sort': {sort_by: direction, '_id': direction}})
+    if offset:
+        pipeline.append({'$skip': offset})
+    if limit is not None:
+        pipeline.append({'$limit': limit})
+    pipeline.append({'$project': _RESULT_PROJECTION})
+    return pipeline
+
+
+def _check_paging(sort_by, sort_order, offset, limit):
+    if sort_by is not None and sort_by not in SORT_KEYS:
+        raise ValueError(
+            f'Cannot sort results by "{sort_by}"; '
+            f'choose one of {", ".join(SORT_KEYS)}')
+    if sort_order not in _SORT_DIRECTIONS:
+        raise ValueError(
+            f'Unknown sort order "{sort_order}"; '
+            f'choose "ascending" or "descending"')
+    if offset < 0:
+        raise ValueError(f'Offset must not be negative (got {offset})')
+    if limit is not None and limit <= 0:
+        raise ValueError(f'Limit must be positive (got {limit})')
+
+
+def _get_finished_search(connection, results_id):
+    return connection.find(
+            Search.collection, results_id=results_id, status=Search.DONE)[0]
+
+
+def _get_feature_tokens(connection, language, feature, indices):
+    """Map feature indices to their tokens"""
+    found = connection.connection[Feature.collection].find(
+        {
+            'language': language,
+            'feature': feature,
+            'index': {'$in': [int(i) for i in indices]}
+        },
+        {'_id': False, 'index': True, 'token': True}
+    )
+    return {f['index']: f['token'] for f in found}
+
+
+def _gen_column_results(connection, columns, sort_by, sort_order, offset,
+                        limit):
+    """Generate results like those of ``get_results`` from compact matches
+
+    Snippets and tags come from the texts' units, and matched features are
+    looked up by index; only the requested page is built.
+
+    Parameters
+    ----------
+    connection : tesserae.db.mongodb.TessMongoConnection
+    columns : tesserae.utils.compact_results.MatchColumns
+    sort_by, sort_order, offset, limit
+        See ``get_results``
+
+    Yields
+    ------
+    dict
+        a match with the same keys as the documents ``get_results`` reads
+        from the matches collection
+    """
+    texts = connection.find(
+        Text.collection, _id=[columns.source_text, columns.target_text])
+    tag_helper = TagHelper(connection, texts)
+    source_units = get_text_units(
+        connection, columns.source_text, columns.source_unit_type,
+        columns.feature)
+    target_units = get_text_units(
+        connection, columns.target_text, columns.target_unit_type,
+        columns.feature)
+    source_tags = [
+        tag_helper.get_display_tag(
+            columns.source_text, source_units.get_display_tags(i))
+        for i in range(len(source_units))]
+    target_tags = [
+        tag_helper.get_display_tag(
+            columns.target_text, target_units.get_display_tags(i))
+        for i in range(len(target_units))]
+
+    if sort_by is None:
+        order = np.arange(len(columns))
+    else:
+        if sort_by == 'score':
+            keys = columns.scores
+        elif sort_by == 'source_tag':
+            keys = _rank_strings(source_tags)[columns.source_inds]
+        else:
+            keys = _rank_strings(target_tags)[columns.target_inds]
+        # ties are broken as by _id in get_results
+        direction = _SORT_DIRECTIONS[sort_order]
+        order = np.lexsort(
+            (np.arange(len(columns)) * direction, keys * direction))
+    page = order[offset:None if limit is None else offset + limit]
+
+    tokens = _get_feature_tokens(
+        connection, columns.language, columns.feature,
+        np.unique(np.concatenate([
+            columns.features_indices[
+                columns.features_indptr[i]:columns.features_indptr[i+1]]
+            for i in page] or [[]])))
+    for i in page:
+        source_ind = columns.source_inds[i]
+        target_ind = columns.target_inds[i]
+        features = columns.features_indices[
+            columns.features_indptr[i]:columns.features_indptr[i+1]]
+        highlights = columns.highlights[
+            columns.highlights_indptr[i]:columns.highlights_indptr[i+1]]
+        yield {
+            'source_tag': source_tags[source_ind],
+            'target_tag': target_tags[target_ind],
+            'matched_features': [tokens[int(f)] for f in features],
+            'score': float(columns.scores[i]),
+            'source_snippet': source_units.snippets[source_ind],
+            'target_snippet': target_units.snippets[target_ind],
+            'highlight': highlights.tolist()
+        }
+
+
+def _rank_strings(strings):
+    """Give each string its rank in sorted order; equal strings tie"""
+    ranks = {s: i for i, s in enumerate(sorted(set(strings)))}
+    return np.array([ranks[s] for s in strings], dtype=np.int64)
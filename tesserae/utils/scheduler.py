@@ -0,0 +1,201 @@
+"""Scheduling of queued searches
+
+A single first-in, first-out queue lets one expensive search hold up many
+cheap ones behind it.  ``SearchScheduler`` instead decides which queued search
+a free worker runs next:
+
+* searches whose estimated cost is at most ``short_cost`` go in a short lane,
+  which is served first and cheapest first; when there is more than one
+  worker, one of them only takes short searches, so they never wait behind
+  expensive ones
+* expensive searches go in a long lane and are served in the order they were
+  submitted; one that has waited longer than ``max_wait`` seconds jumps ahead
+  of the short lane, so heavy searches still make progress
+* within a lane, the next search comes from the client that has used the
+  least of the pool (total estimated cost of the searches started for it),
+  so one client submitting many searches cannot crowd out the others
+"""
+import collections
+import heapq
+import itertools
+import math
+import time
+
+
+SHORT_LANE = 'short'
+LONG_LANE = 'long'
+
+
+class SearchScheduler:
+    """Priority and fair share ordering of searches for a worker pool
+
+    The scheduler only tracks jobs; running them is up to the caller, which
+    should call ``next_job`` whenever a worker may be free and ``finish``
+    whenever a worker is done.  It is not thread-safe.
+
+    Attributes
+    ----------
+    num_workers : int
+        The number of workers in the pool
+    short_cost : float
+        Searches with an estimated cost up to this go in the short lane
+    max_wait : float
+        Seconds after which a long lane search is run ahead of short ones
+    """
+
+    def __init__(self, num_workers, short_cost, max_wait=600.0,
+                 clock=time.monotonic):
+        """
+        Parameters
+        ----------
+        num_workers : int
+            The number of workers in the pool
+        short_cost : float
+            Searches with an estimated cost up to this go in the short lane
+        max_wait : float, optional
+            Seconds after which a long lane search is run ahead of short ones
+        clock : callable, optional
+            Returns the current time in seconds
+        """
+        self.num_workers = num_workers
+        self.short_cost = short_cost
+        self.max_wait = max_wait
+        self._clock = clock
+        # keep a worker free for short searches when there is more than one
+        self._long_slots = max(num_workers - 1, 1)
+        self._seq = itertools.count()
+        # lane => client => heap of (priority, seq, job id)
+        self._queued = {SHORT_LANE: {}, LONG_LANE: {}}
+        # job id => (lane, client, cost, submit time, job)
+        self._jobs = {}
+        # job id => (lane, client) for jobs handed out by next_job
+        self._running = {}
+        # client => total estimated cost of its searches started so far
+        self._usage = {}
+        # what a job of unknown (infinite) cost counts for in usage
+        self._largest_cost = short_cost
+        self._client_jobs = collections.Counter()
+
+    def __len__(self):
+        """The number of jobs waiting to run"""
+        return len(self._jobs)
+
+    def submit(self, job_id, job, cost, client=None):
+        """Add a job to the queue
+
+        Parameters
+        ----------
+        job_id : hashable
+            Identifier of the job, such as the search's results_id
+        job
+            What ``next_job`` should return for this job
+        cost : float
+            Estimated cost of the job; jobs whose cost could not be estimated
+            should be given infinity, which puts them in the long lane and
+            charges their client the largest finite cost seen
+        client : hashable, optional
+            Who submitted the job, for fair share between clients
+        """
+        lane = SHORT_LANE if cost <= self.short_cost else LONG_LANE
+        if math.isfinite(cost):
+            self._largest_cost = max(self._largest_cost, cost)
+        if self._client_jobs[client] == 0:
+            # a client returning after a break starts level with the least
+            # served active client rather than far behind everyone
+            active = [
+                self._usage[c] for c in self._client_jobs
+                if self._client_jobs[c] > 0]
+            self._usage[client] = min(active) if active else 0.0
+        self._client_jobs[client] += 1
+        seq = next(self._seq)
+        # the short lane runs cheapest first, the long lane oldest first
+        priority = cost if lane == SHORT_LANE else seq
+        heapq.heappush(
+            self._queued[lane].setdefault(client, []),
+            (priority, seq, job_id))
+        self._jobs[job_id] = (lane, client, cost, self._clock(), job)
+
+    def next_job(self):
+        """Pick the job a free worker should run next
+
+        Returns
+        -------
+        job or None
+            The ``job`` given to ``submit``, or None if no worker is free or
+            no queued job may run now
+        """
+        if len(self._running) >= self.num_workers:
+            return None
+        long_running = sum(
+            1 for lane, _ in self._running.values() if lane == LONG_LANE)
+        oldest = self._oldest(LONG_LANE)
+        if oldest is not None and \
+                self._clock() - self._jobs[oldest][3] >= self.max_wait:
+            return self._start(oldest)
+        if self._queued[SHORT_LANE]:
+            return self._start(self._fair_head(SHORT_LANE))
+        if self._queued[LONG_LANE] and long_running < self._long_slots:
+            return self._start(self._fair_head(LONG_LANE))
+        return None
+
+    def finish(self, job_id):
+        """Record that a job handed out by ``next_job`` is done
+
+        Ids of jobs that are not running, such as one already finished, are
+        ignored.
+        """
+        running = self._running.pop(job_id, None)
+        if running is None:
+            return
+        self._release(running[1])
+
+    def drain(self):
+        """Remove all jobs waiting to run
+
+        Returns
+        -------
+        list
+            The ids of the removed jobs
+        """
+        drained = list(self._jobs)
+        for job_id in drained:
+            self._release(self._dequeue(job_id)[1])
+        return drained
+
+    def _oldest(self, lane):
+        """The id of the longest waiting job in a lane, if any"""
+        heads = [heap[0][1:] for heap in self._queued[lane].values()]
+        return min(heads)[1] if heads else None
+
+    def _fair_head(self, lane):
+        """The id of the next job of the least served client in a lane"""
+        client = min(
+            self._queued[lane],
+            key=lambda c: (self._usage[c], self._queued[lane][c][0]))
+        return self._queued[lane][client][0][2]
+
+    def _start(self, job_id):
+        lane, client, cost, _, job = self._dequeue(job_id)
+        # an infinite usage would lose every fair share comparison for good
+        self._usage[client] += \
+            cost if math.isfinite(cost) else self._largest_cost
+        self._running[job_id] = (lane, client)
+        return job
+
+    def _dequeue(self, job_id):
+        """Take a queued job out of its lane"""
+        entry = self._jobs.pop(job_id)
+        lane, client = entry[0], entry[1]
+        heap = self._queued[lane][client]
+        heap.remove(next(item for item in heap if item[2] == job_id))
+        heapq.heapify(heap)
+        if not heap:
+            del self._queued[lane][client]
+        return entry
+
+    def _release(self, client):
+        """Forget a client's usage once it has no jobs left"""
+        self._client_jobs[client] -= 1
+        if self._client_jobs[client] == 0:
+            del self._client_jobs[client]
+            del self._usage[client]
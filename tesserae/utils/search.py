@@ -4,29 +4,52 @@ AsynchronousSearcher provides normal Tesserae search capabilities.
 
 bigram_search enables lookup of bigrams for specified units of specified texts
 """
+import hashlib
+import json
+import logging
 import multiprocessing
 import queue
+import threading
 import time
 import traceback
 
 from tesserae.db import TessMongoConnection
-from tesserae.db.entities import Search, Unit
+from tesserae.db.entities import Entity, Match, Search, Unit
 import tesserae.matchers
+from tesserae.matchers.sparse_encoding import DEFAULT_MIN_SCORE
+from tesserae.utils.compact_results import store_match_columns
+from tesserae.utils.scheduler import SearchScheduler
+
+
+logger = logging.getLogger(__name__)
 
 
 class AsynchronousSearcher:
     """Asynchronous Tesserae search resource holder
 
+    Queued searches are handed to the workers by a ``SearchScheduler`` (see
+    ``tesserae.utils.scheduler``), one search per free worker, so that cheap
+    searches are not stuck behind expensive ones and no single client can
+    take over the pool.  A search's cost is estimated on a background thread
+    after ``queue_search`` returns, and the search is scheduled once its
+    estimate is ready.
+
     Attributes
     ----------
     workers : list of SearchProcess
         the workers this object has created
     queue : multiprocessing.Queue
-        work queue which workers listen on
+        work queue which workers listen on; it only ever holds searches that
+        a free worker is about to take
+    finished : multiprocessing.Queue
+        queue on which workers report the results_id of each search they
+        finish, whether or not it succeeded
+    scheduler : tesserae.utils.scheduler.SearchScheduler
+        decides which queued search runs next
 
     """
 
-    def __init__(self, num_workers, db_cred):
+    def __init__(self, num_workers, db_cred, short_cost=5.0, max_wait=600.0):
         """Store parameters to be used in intializing resources
 
         Parameters
@@ -36,17 +59,41 @@ class AsynchronousSearcher:
         db_cred : dict
             credentials to access the database; arguments should be given for
             TessMongoConnection.__init__ in kwarg unpacking format
+        short_cost : float, optional
+            searches estimated to take at most this many seconds (see
+            ``estimate_search``) are run ahead of more expensive ones
+        max_wait : float, optional
+            seconds after which an expensive search is run ahead of cheap
+            ones
 
         """
         self.num_workers = num_workers
         self.db_cred = db_cred
 
         self.queue = multiprocessing.Queue()
+        self.finished = multiprocessing.Queue()
+        self.scheduler = SearchScheduler(
+            num_workers, short_cost, max_wait=max_wait)
+        # parameters hash => results_id of searches queued by this object
+        # that have not finished yet
+        self._in_flight = {}
+        self._closed = False
+        self._lock = threading.Lock()
         self.workers = []
         for _ in range(self.num_workers):
-            cur_proc = SearchProcess(self.db_cred, self.queue)
+            cur_proc = SearchProcess(self.db_cred, self.queue, self.finished)
             cur_proc.start()
             self.workers.append(cur_proc)
+        # connect after the workers have forked, so they do not share it
+        self.connection = TessMongoConnection(**self.db_cred)
+        self._collector = threading.Thread(
+            target=self._collect_finished, daemon=True)
+        self._collector.start()
+        # searches waiting for their cost to be estimated
+        self._to_estimate = queue.Queue()
+        self._estimator = threading.Thread(
+            target=self._estimate_queued, daemon=True)
+        self._estimator.start()
 
     def cleanup(self, *args):
         """Clean up system resources being used by this object
@@ -54,17 +101,36 @@ class AsynchronousSearcher:
         This method should be called by exit handlers in the main script
 
         """
+        with self._lock:
+            self._closed = True
+        # searches still waiting for an estimate are scheduled unestimated,
+        # so that they are drained below
+        self._to_estimate.put(None)
+        self._estimator.join()
+        with self._lock:
+            abandoned = self.scheduler.drain()
         try:
             while True:
-                self.queue.get_nowait()
+                abandoned.append(self.queue.get_nowait()[0])
         except queue.Empty:
             pass
+        if abandoned:
+            # otherwise check_cache would keep handing out these results_ids
+            self.connection.connection[Search.collection].update_many(
+                {'results_id': {'$in': abandoned}},
+                {'$set': {
+                    'status': Search.FAILED,
+                    'msg': 'Search was dropped from the queue at shutdown'
+                }})
         for _ in range(len(self.workers)):
             self.queue.put((None, None, None))
         for worker in self.workers:
             worker.join()
+        self.finished.put(None)
+        self._collector.join()
 
-    def queue_search(self, results_id, search_type, search_params):
+    def queue_search(self, results_id, search_type, search_params,
+                     client=None):
         """Queues search for processing
 
         Parameters
@@ -77,9 +143,124 @@ class AsynchronousSearcher:
             __init__.py file).
         search_params : dict
             search parameters
+        client : hashable, optional
+            who is asking for the search (e.g., a session or IP address);
+            the pool is shared fairly between clients
+
+        Returns
+        -------
+        str
+            The results_id under which the results will be found.  If a
+            search with the same parameters is already running or done, its
+            results_id is returned and nothing is queued; otherwise, the
+            Search is recorded as initialized under ``results_id`` and
+            queued.
+
+        """
+        parameters = _search_parameters(search_type, search_params)
+        parameters_hash = hash_parameters(parameters)
+        # the lock keeps identical requests arriving together on different
+        # threads from both missing the lookups below
+        with self._lock:
+            if parameters_hash in self._in_flight:
+                return self._in_flight[parameters_hash]
+            # searches queued by other processes, or already done
+            found = _find_by_hash(self.connection, parameters_hash)
+            if found is not None:
+                return found['results_id']
+            self.connection.insert(Search(
+                results_id=results_id, status=Search.INIT, msg='',
+                parameters=parameters, parameters_hash=parameters_hash))
+            self._in_flight[parameters_hash] = results_id
+        # estimating may have to read the texts' units, so it is left to the
+        # estimator thread rather than holding up the request
+        self._to_estimate.put(
+            (results_id, search_type, search_params, client))
+        return results_id
+
+    def cancel(self, results_id):
+        """Ask a queued or running search to stop
+
+        See ``cancel_search``.  Requests for the same search made after this
+        start a new one rather than attach to the cancelled one.
+
+        Parameters
+        ----------
+        results_id : str
+            UUID of the search to cancel
 
+        Returns
+        -------
+        bool
+            Whether there was an unfinished search with ``results_id``
         """
-        self.queue.put_nowait((results_id, search_type, search_params))
+        with self._lock:
+            self._forget(results_id)
+            return cancel_search(self.connection, results_id)
+
+    def _forget(self, results_id):
+        """Stop attaching new requests to a search; call with the lock held"""
+        self._in_flight = {
+            parameters_hash: cur_id
+            for parameters_hash, cur_id in self._in_flight.items()
+            if cur_id != results_id
+        }
+
+    def _dispatch(self):
+        """Hand queued searches to free workers; call with the lock held"""
+        while not self._closed:
+            job = self.scheduler.next_job()
+            if job is None:
+                break
+            self.queue.put_nowait(job)
+
+    def _estimate_queued(self):
+        """Schedule queued searches as their costs are estimated
+
+        Runs in a thread until ``cleanup`` puts None on ``_to_estimate``
+        """
+        while True:
+            request = self._to_estimate.get()
+            if request is None:
+                break
+            results_id, search_type, search_params, client = request
+            cost = float('inf')
+            if not self._closed:
+                try:
+                    cost = estimate_search(
+                        self.connection, search_type, search_params).seconds
+                except Exception:
+                    # run it last; the worker will record what is wrong
+                    pass
+            try:
+                with self._lock:
+                    self.scheduler.submit(
+                        results_id,
+                        (results_id, search_type, search_params), cost,
+                        client=client)
+                    self._dispatch()
+            except Exception:
+                logger.exception('Could not schedule search %s', results_id)
+
+    def _collect_finished(self):
+        """Free up workers as they report searches finished
+
+        Runs in a thread until ``cleanup`` puts None on ``finished``
+        """
+        while True:
+            results_id = self.finished.get()
+            if results_id is None:
+                break
+            # an error here must not stop the thread, or no search would
+            # ever be handed to a worker again
+            try:
+                with self._lock:
+                    self.scheduler.finish(results_id)
+                    self._forget(results_id)
+                    self._dispatch()
+            except Exception:
+                logger.exception(
+                    'Could not record search %s as finished', results_id)
 
 
 class SearchProcess(multiprocessing.Process):
@@ -88,7 +269,7 @@ class SearchProcess(multiprocessing.Process):
     Listens on queue for work to do
     """
 
-    def __init__(self, db_cred, queue):
+    def __init__(self, db_cred, queue, finished):
         """Constructs a search worker
 
         Parameters
@@ -98,11 +279,14 @@ class SearchProcess(multiprocessing.Process):
             TessMongoConnection.__init__ in keyword format
         queue : multiprocessing.Queue
             mechanism for receiving search requests
+        finished : multiprocessing.Queue
+            mechanism for reporting the results_id of finished searches
 
         """
-        super().__init__(target=self.await_job, args=(db_cred, queue))
+        super().__init__(
+            target=self.await_job, args=(db_cred, queue, finished))
 
-    def await_job(self, db_cred, queue):
+    def await_job(self, db_cred, queue, finished):
         """Waits for search job"""
         connection = TessMongoConnection(**db_cred)
         while True:
@@ -110,51 +294,317 @@ class SearchProcess(multiprocessing.Process):
             if results_id is None:
                 break
             self.run_search(connection, results_id, search_type, search_params)
+            finished.put(results_id)
 
     def run_search(self, connection, results_id, search_type, search_params):
-        """Executes search"""
+        """Executes search
+
+        If ``search_params`` has a true 'compact_results' entry, the matches
+        are stored in compact columnar form (see
+        ``tesserae.utils.compact_results``) instead of as Match entities.
+
+        While matching, the progress of the search is written to the Search
+        entity, and the search stops if ``cancel_search`` has been called for
+        it; the worker then goes on to its next search.
+        """
         start_time = time.time()
-        parameters = {
-            'source': {
-                'object_id': str(search_params['source'].text.id),
-                'units': search_params['source'].unit_type
-            },
-            'target': {
-                'object_id': str(search_params['target'].text.id),
-                'units': search_params['target'].unit_type
-            },
-            'method': {
-                'name': search_type,
-                'feature': search_params['feature'],
-                'stopwords': search_params['stopwords'],
-                'freq_basis': search_params['frequency_basis'],
-                'max_distance': search_params['max_distance'],
-                'distance_basis': search_params['distance_metric']
-            }
-        }
-        results_status = Search(
-            results_id=results_id,
-            status=Search.INIT, msg='',
-            parameters=parameters
-        )
-        connection.insert(results_status)
+        search_params = dict(search_params)
+        compact_results = search_params.pop('compact_results', False)
+        found = connection.find(Search.collection, results_id=results_id)
+        if found:
+            # queue_search has already recorded the search
+            results_status = found[0]
+        else:
+            parameters = _search_parameters(search_type, search_params)
+            results_status = Search(
+                results_id=results_id,
+                status=Search.INIT, msg='',
+                parameters=parameters,
+                parameters_hash=hash_parameters(parameters)
+            )
+            connection.insert(results_status)
+        search_id = results_status.id
         try:
-            search_id = results_status.id
+            if results_status.cancel:
+                raise SearchCancelled()
             matcher = tesserae.matchers.matcher_map[search_type](connection)
-            results_status.status = Search.RUN
-            connection.update(results_status)
-            matches = matcher.match(search_id, **search_params)
-            connection.insert_nocheck(matches)
-
-            results_status.status = Search.DONE
-            results_status.msg = 'Done in {} seconds'.format(
-                time.time() - start_time)
-            connection.update(results_status)
+            _set_status(connection, results_status, Search.RUN)
+            progress = _ProgressReporter(connection, search_id)
+            if compact_results:
+                store_match_columns(
+                    connection, search_id,
+                    matcher.match_columns(
+                        progress=progress, **search_params))
+            else:
+                connection.insert_stream(
+                    matcher.gen_matches(
+                        search_id, progress=progress, **search_params))
+
+            _set_status(
+                connection, results_status, Search.DONE,
+                'Done in {} seconds'.format(time.time() - start_time))
+        except SearchCancelled:
+            # matches streamed out before the cancellation are incomplete
+            connection.connection[Match.collection].delete_many(
+                {'search_id': search_id})
+            _set_status(
+                connection, results_status, Search.CANCELLED,
+                'Cancelled after {} seconds'.format(time.time() - start_time))
         # we want to catch all errors and log them into the Search entity
         except:  # noqa: E722
-            results_status.status = Search.FAILED
-            results_status.msg = traceback.format_exc()
-            connection.update(results_status)
+            # as with a cancellation, streamed matches are incomplete
+            connection.connection[Match.collection].delete_many(
+                {'search_id': search_id})
+            _set_status(
+                connection, results_status, Search.FAILED,
+                traceback.format_exc())
+
+
+class SearchCancelled(Exception):
+    """Raised in a running search whose cancellation was requested"""
+
+
+# minimum number of seconds between progress writes of a running search
+_PROGRESS_INTERVAL = 1.0
+
+
+class _ProgressReporter:
+    """Progress callback for a matcher running a search
+
+    Records the progress in the Search entity and checks whether the search
+    should be cancelled, at most once every ``interval`` seconds except for
+    the first and last calls.  Only the progress field is written, so that a
+    cancellation requested meanwhile is not overwritten.
+    """
+
+    def __init__(self, connection, search_id, interval=_PROGRESS_INTERVAL):
+        self.collection = connection.connection[Search.collection]
+        self.search_id = search_id
+        self.interval = interval
+        self.last_report = None
+
+    def __call__(self, blocks_done, blocks_total, matches):
+        now = time.monotonic()
+        if self.last_report is not None and blocks_done < blocks_total \
+                and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        found = self.collection.find_one_and_update(
+            {'_id': self.search_id},
+            {'$set': {'progress': {
+                'blocks_done': blocks_done,
+                'blocks_total': blocks_total,
+                'matches': matches
+            }}},
+            projection={'_id': False, 'cancel': True})
+        if found is not None and found.get('cancel'):
+            raise SearchCancelled()
+
+
+def _set_status(connection, search, status, msg=''):
+    """Record the status of a search
+
+    Only the status and message are written, so that a cancellation
+    requested meanwhile is not overwritten.
+    """
+    search.status = status
+    search.msg = msg
+    connection.connection[Search.collection].update_one(
+        {'_id': search.id}, {'$set': {'status': status, 'msg': msg}})
+
+
+def cancel_search(connection, results_id):
+    """Ask a queued or running search to stop
+
+    A running search stops after the block of source units it is working on;
+    a queued one stops as soon as a worker takes it.  Either way its status
+    becomes ``Search.CANCELLED`` and any matches it stored are removed.
+
+    Parameters
+    ----------
+    connection : TessMongoConnection
+    results_id : str
+        UUID of the search to cancel
+
+    Returns
+    -------
+    bool
+        Whether there was an unfinished search with ``results_id``
+    """
+    result = connection.connection[Search.collection].update_one(
+        {
+            'results_id': results_id,
+            'status': {'$in': [Search.INIT, Search.RUN]}
+        },
+        {'$set': {'cancel': True}})
+    return result.matched_count > 0
+
+
+def estimate_search(connection, search_type, search_params):
+    """Predict how much work a search will be, without running it
+
+    Parameters
+    ----------
+    connection : TessMongoConnection
+    search_type : str
+        identifier for type of search to perform
+    search_params : dict
+        search parameters, as passed to ``AsynchronousSearcher.queue_search``
+
+    Returns
+    -------
+    tesserae.matchers.sparse_encoding.SearchEstimate
+        The predicted position hits, running time and memory of the search
+    """
+    matcher = tesserae.matchers.matcher_map[search_type](connection)
+    return matcher.estimate(**search_params)
+
+
+def _search_parameters(search_type, search_params):
+    """Build the parameters recorded in a Search entity
+
+    Parameters
+    ----------
+    search_type : str
+        identifier for type of search to perform
+    search_params : dict
+        search parameters, as passed to ``AsynchronousSearcher.queue_search``
+
+    Returns
+    -------
+    dict
+        The parameters in the form of the API documentation
+    """
+    source_id = str(search_params['source'].text.id)
+    target_id = str(search_params['target'].text.id)
+    return {
+        'source': {
+            'object_id': source_id,
+            'units': search_params['source'].unit_type
+        },
+        'target': {
+            'object_id': target_id,
+            'units': search_params['target'].unit_type
+        },
+        'method': {
+            'name': search_type,
+            'feature': search_params['feature'],
+            'stopwords': search_params['stopwords'],
+            'stopword_basis': _normalize_stopword_basis(
+                search_params.get('stopword_basis'), source_id, target_id),
+            'freq_basis': search_params['frequency_basis'],
+            'max_distance': search_params['max_distance'],
+            'distance_basis': search_params['distance_metric'],
+            'min_score': search_params.get('min_score', DEFAULT_MIN_SCORE),
+            'top_k': search_params.get('top_k')
+        }
+    }
+
+
+def _normalize_stopword_basis(basis, source_id, target_id):
+    """Put the basis of a stoplist in one storable form
+
+    Parameters
+    ----------
+    basis
+        The 'stopword_basis' of a search: None or 'corpus', 'texts', or one
+        or more Text entities or text ids
+    source_id, target_id : str
+        The ids of the texts searched, which the 'texts' basis stands for
+
+    Returns
+    -------
+    str or list of str
+        'corpus', or the sorted ids of the basis texts as strings
+    """
+    # compare only strings, since Entity.__eq__ fails on other types
+    if basis is None or (isinstance(basis, str) and basis == 'corpus'):
+        return 'corpus'
+    if isinstance(basis, str) and basis == 'texts':
+        basis = [source_id, target_id]
+    elif not isinstance(basis, (list, tuple, set)):
+        basis = [basis]
+    return sorted({
+        str(t.id if isinstance(t, Entity) else t) for t in basis})
+
+
+# the method parameters that determine a search's results
+_HASHED_METHOD_KEYS = (
+    'name', 'feature', 'stopwords', 'stopword_basis', 'freq_basis',
+    'max_distance', 'distance_basis', 'min_score', 'top_k'
+)
+
+
+def hash_parameters(parameters):
+    """Compute a canonical hash of search parameters
+
+    Searches get the same hash exactly when ``check_cache`` should consider
+    them the same search: the order of the stopwords and of the keys does not
+    matter, and keys of ``parameters['method']`` other than those that
+    determine the results are ignored.  When 'stopwords' is a number, the
+    'stopword_basis' the stoplist is computed from is part of the hash, so
+    that 'texts' and a list of the source and target ids hash the same.
+
+    Parameters
+    ----------
+    parameters : dict
+        Search parameters, with 'source', 'target' and 'method' entries as in
+        the API documentation
+
+    Returns
+    -------
+    str
+        Hexadecimal SHA-256 digest
+    """
+    method = parameters['method']
+    canonical = {
+        key: method.get(key) for key in _HASHED_METHOD_KEYS
+    }
+    # like the matcher, tell an explicit None (keep every match) apart from
+    # a missing min_score (use the default)
+    canonical['min_score'] = method.get('min_score', DEFAULT_MIN_SCORE)
+    if isinstance(canonical['stopwords'], (list, tuple)):
+        canonical['stopwords'] = sorted(canonical['stopwords'])
+        # an explicit stoplist does not depend on the basis
+        canonical['stopword_basis'] = None
+    else:
+        # the basis of a stoplist of the n most frequent features
+        canonical['stopword_basis'] = _normalize_stopword_basis(
+            canonical['stopword_basis'],
+            str(parameters['source']['object_id']),
+            str(parameters['target']['object_id']))
+    for key in ('max_distance', 'min_score'):
+        # the database treats 10 and 10.0 as equal, so the hash must too
+        if isinstance(canonical[key], (int, float)):
+            canonical[key] = float(canonical[key])
+    canonical['source'] = [
+        str(parameters['source']['object_id']),
+        parameters['source']['units']
+    ]
+    canonical['target'] = [
+        str(parameters['target']['object_id']),
+        parameters['target']['units']
+    ]
+    encoded = json.dumps(
+        canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def _find_by_hash(connection, parameters_hash):
+    """Find a Search that has not failed nor been cancelled by its hash
+
+    Returns
+    -------
+    dict or None
+        The raw Search document, with only its results_id, if there is one
+    """
+    return connection.connection[Search.collection].find_one(
+        {
+            'parameters_hash': parameters_hash,
+            'status': {'$nin': [Search.FAILED, Search.CANCELLED]},
+            'cancel': {'$ne': True}
+        },
+        projection={'_id': False, 'results_id': True})
 
 
 def check_cache(connection, source, target, method):
@@ -178,36 +628,16 @@ def check_cache(connection, source, target, method):
 
     Notes
     -----
-    Helpful links
-        https://docs.mongodb.com/manual/tutorial/query-embedded-documents/
-        https://docs.mongodb.com/manual/tutorial/query-arrays/
-        https://docs.mongodb.com/manual/reference/operator/query/and/
+    Searches are looked up by the index on their parameters hash (see
+    ``hash_parameters``).  A search that has not finished yet counts as
+    cached, since its results will be found under its results_id once it is
+    done.
     """
-    found = [
-        Search.json_decode(f)
-        for f in connection.connection[Search.collection].find({
-            'parameters.source.object_id': str(source['object_id']),
-            'parameters.source.units': source['units'],
-            'parameters.target.object_id': str(target['object_id']),
-            'parameters.target.units': target['units'],
-            'parameters.method.name': method['name'],
-            'parameters.method.feature': method['feature'],
-            '$and': [
-                {'parameters.method.stopwords': {'$all': method['stopwords']}},
-                {'parameters.method.stopwords': {
-                    '$size': len(method['stopwords'])}}
-            ],
-            'parameters.method.freq_basis': method['freq_basis'],
-            'parameters.method.max_distance': method['max_distance'],
-            'parameters.method.distance_basis': method['distance_basis']
-        })
-    ]
-    if found:
-        status_found = connection.find(
-            Search.collection,
-            _id=found[0].id)
-        if status_found and status_found[0].status != Search.FAILED:
-            return status_found[0].results_id
+    parameters_hash = hash_parameters(
+        {'source': source, 'target': target, 'method': method})
+    found = _find_by_hash(connection, parameters_hash)
+    if found is not None:
+        return found['results_id']
     return None
 
 
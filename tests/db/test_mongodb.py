@@ -13,6 +13,7 @@ Functions
 test_init
     Test schemes for initializing TessMongoConnection.
 test_insert
+test_insert_stream
 test_find
 test_update
 test_delete
@@ -252,6 +253,33 @@ def test_insert(request, test_data, depopulate):
         # Clean up
         conn.connection[key].delete_many({'_id': {'$in': [e.id for e in ents]}})
 
+def test_insert_stream(request, test_data, depopulate):
+    conf = request.config
+    conn = TessMongoConnection(conf.getoption('db_host'),
+                               conf.getoption('db_port'),
+                               conf.getoption('db_user'),
+                               password=conf.getoption('db_passwd',
+                                                       default=None),
+                               db=conf.getoption('db_name',
+                                                 default=None))
+
+    for key, val in test_data.items():
+        entity = entity_map[key]
+        before = conn.connection[key].distinct('_id')
+
+        # Insert from a generator with batches smaller than the data so that
+        # several batches are written.
+        inserted = conn.insert_stream(
+            (entity(**entry) for entry in val), batch_size=2)
+        assert inserted == len(val)
+        new_docs = {'_id': {'$nin': before}}
+        assert conn.connection[key].count_documents(new_docs) == len(val)
+
+        # Clean up
+        conn.connection[key].delete_many(new_docs)
+
+    assert conn.insert_stream(iter([])) == 0
+
 def test_find(request, populate):
     conf = request.config
     conn = TessMongoConnection(conf.getoption('db_host'),
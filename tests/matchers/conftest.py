@@ -0,0 +1,18 @@
+"""Fixtures shared by the matcher tests."""
+import pytest
+
+from bson.objectid import ObjectId
+
+
+@pytest.fixture
+def units():
+    return [
+        {
+            '_id': ObjectId(), 'tags': ['1.1'], 'snippet': 'arma virumque',
+            'forms': [1, 2], 'features': [[10, 20], [21]]
+        },
+        {
+            '_id': ObjectId(), 'tags': [], 'snippet': 'μῆνιν',
+            'forms': [5, -1, 7], 'features': [[7], [-1], [21, 30]]
+        },
+    ]
@@ -8,13 +8,18 @@ import time
 import uuid
 
 import math
+import numpy as np
 import pytest
+from scipy.sparse import csr_matrix
 
 from tesserae.db import Feature, Search, Text, Unit, \
                         TessMongoConnection
+from tesserae.matchers import sparse_encoding
 from tesserae.matchers.sparse_encoding import \
         SparseMatrixSearch, get_text_frequencies, get_corpus_frequencies
 from tesserae.matchers.text_options import TextOptions
+from tesserae.matchers.text_statistics import TextStatistics
+from tesserae.matchers.unit_cache import build_text_units
 from tesserae.tokenizers import LatinTokenizer
 from tesserae.unitizer import Unitizer
 from tesserae.utils import TessFile, ingest_text
@@ -541,3 +546,326 @@ def test_mini_punctuation(punctpop, mini_punctuation_metadata):
         frequency_basis='corpus', max_distance=10,
         distance_metric='span', min_score=0)
     # the point of this test is to make sure no Exception is thrown
+
+
+def test_parallel_matches_serial(minipop, mini_latin_metadata, monkeypatch):
+    texts = minipop.find(
+        Text.collection,
+        title=[m['title'] for m in mini_latin_metadata])
+    # use small source blocks so that the mini texts span several of them
+    get_source_blocks = sparse_encoding._get_source_blocks
+    monkeypatch.setattr(
+        sparse_encoding, '_get_source_blocks',
+        lambda source_size: get_source_blocks(source_size, stepsize=2))
+    matcher = SparseMatrixSearch(minipop)
+    results = []
+    for parallel in [False, 2]:
+        matches = matcher.match(
+            None,
+            TextOptions(texts[0], 'line'),
+            TextOptions(texts[1], 'line'),
+            'lemmata',
+            stopwords=4,
+            stopword_basis='corpus', score_basis='stem',
+            frequency_basis='corpus', max_distance=10,
+            distance_metric='frequency', min_score=0, parallel=parallel)
+        results.append([
+            (m.source_unit, m.target_unit, m.score, m.matched_features)
+            for m in matches])
+    assert results[0] == results[1]
+
+
+def test_serial_by_default(minipop, mini_latin_metadata, monkeypatch):
+    texts = minipop.find(
+        Text.collection,
+        title=[m['title'] for m in mini_latin_metadata])
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError('matching started a process pool')
+
+    monkeypatch.setattr(sparse_encoding.multiprocessing, 'Pool', no_pool)
+    matcher = SparseMatrixSearch(minipop)
+    matches = matcher.match(
+        None,
+        TextOptions(texts[0], 'line'),
+        TextOptions(texts[1], 'line'),
+        'lemmata',
+        stopwords=4,
+        stopword_basis='corpus', score_basis='stem',
+        frequency_basis='corpus', max_distance=10,
+        distance_metric='frequency', min_score=0)
+    assert len(matches) > 0
+
+
+def test_budgeted_source_blocks():
+    # target positions: feature 0 twice, feature 1 once
+    target = csr_matrix(
+        (np.ones(3, dtype=bool), [0, 0, 1], [0, 1, 2, 3]), shape=(3, 3))
+    # source units: [feature 0], [feature 1], [features 0 and 2], [feature 2]
+    source = csr_matrix(
+        (np.ones(5, dtype=bool), [0, 1, 0, 2, 2], [0, 1, 2, 4, 5]),
+        shape=(4, 3))
+    source_breaks = np.array([0, 1, 2, 3, 4])
+    assert list(sparse_encoding._estimate_unit_hits(
+        target, source, source_breaks)) == [2, 1, 2, 0]
+    per_hit = sparse_encoding._BYTES_PER_HIT
+    assert sparse_encoding._get_budgeted_source_blocks(
+        target, source, source_breaks, 3 * per_hit) == [(0, 2), (2, 4)]
+    assert sparse_encoding._get_budgeted_source_blocks(
+        target, source, source_breaks, 100 * per_hit) == [(0, 4)]
+    # units which exceed the budget on their own still get a block
+    blocks = sparse_encoding._get_budgeted_source_blocks(
+        target, source, source_breaks, 1)
+    assert blocks == [(0, 1), (1, 2), (2, 3), (3, 4)]
+
+
+def test_estimate_hits2positions():
+    rng = np.random.default_rng(0)
+    unit_lists = []
+    for size in [30, 1200]:
+        unit_lists.append([
+            {
+                '_id': None, 'tags': [], 'snippet': '',
+                'forms': [0] * n,
+                'features': [
+                    list(set(rng.integers(0, 50, size=2).tolist()))
+                    for _ in range(n)]
+            }
+            for n in rng.integers(1, 8, size=size)])
+    target_units, source_units = [
+        build_text_units(units, None, 'line', 'lemmata')
+        for units in unit_lists]
+    stoplist = np.array([0, 3, 7])
+    estimate = sparse_encoding.estimate_hits2positions(
+        TextStatistics.from_text_units(target_units),
+        TextStatistics.from_text_units(source_units), stoplist)
+    target = target_units.feature_matrix(stoplist, 50)
+    source = source_units.feature_matrix(stoplist, 50)
+    assert estimate.position_hits == sum(sparse_encoding._estimate_unit_hits(
+        target, source, source_units.break_inds))
+    assert estimate.position_hits >= sum(
+        len(positions) for _, _, _, positions in
+        sparse_encoding.gen_hits2positions(
+            target, target_units.break_inds, source,
+            source_units.break_inds))
+    assert estimate.target_units == 30
+    assert estimate.source_units == 1200
+    assert estimate.blocks == 3
+    assert estimate.seconds > 0
+    budgeted = sparse_encoding.estimate_hits2positions(
+        TextStatistics.from_text_units(target_units),
+        TextStatistics.from_text_units(source_units), stoplist,
+        memory_budget=estimate.position_hits * 10)
+    assert budgeted.blocks == 10
+    assert budgeted.memory == estimate.position_hits * 10
+
+
+def test_estimate(minipop, mini_latin_metadata):
+    texts = minipop.find(
+        Text.collection,
+        title=[m['title'] for m in mini_latin_metadata])
+    source = TextOptions(texts[0], 'line')
+    target = TextOptions(texts[1], 'line')
+    estimate = SparseMatrixSearch(minipop).estimate(
+        source, target, 'lemmata', stopwords=4, min_score=0)
+    assert estimate.source_units == len(minipop.find(
+        Unit.collection, text=texts[0].id, unit_type='line'))
+    assert estimate.position_hits > 0
+    assert estimate.json_encode()['position_hits'] == estimate.position_hits
+
+
+def test_progress(minipop, mini_latin_metadata):
+    texts = minipop.find(
+        Text.collection,
+        title=[m['title'] for m in mini_latin_metadata])
+    params = {
+        'source': TextOptions(texts[0], 'line'),
+        'target': TextOptions(texts[1], 'line'),
+        'feature': 'lemmata',
+        'stopwords': 4,
+        'min_score': 0,
+        'parallel': False,
+        # a tiny budget gives several blocks
+        'memory_budget': 1
+    }
+    matcher = SparseMatrixSearch(minipop)
+    calls = []
+    columns = matcher.match_columns(
+        progress=lambda *args: calls.append(args), **params)
+    blocks_total = calls[0][1]
+    assert blocks_total > 1
+    assert [c[0] for c in calls] == list(range(blocks_total + 1))
+    assert all(c[1] == blocks_total for c in calls)
+    assert calls[0][2] == 0
+    assert calls[-1][2] == len(columns)
+
+    class Stop(Exception):
+        pass
+
+    def stop_after_first(blocks_done, blocks_total, matches):
+        if blocks_done == 1:
+            raise Stop()
+
+    with pytest.raises(Stop):
+        matcher.match_columns(progress=stop_after_first, **params)
+
+
+def test_get_top_matches():
+    found = [
+        (0, 0, 2.0, None, None),
+        (1, 0, 5.0, None, None),
+        (2, 0, 3.0, None, None),
+        (3, 0, 5.0, None, None),
+        (4, 0, 5.0, None, None),
+    ]
+    top = sparse_encoding._get_top_matches(iter(found), 3)
+    assert [m[0] for m in top] == [1, 3, 4]
+    top = sparse_encoding._get_top_matches(iter(found), 2)
+    assert [m[0] for m in top] == [1, 3]
+    assert sparse_encoding._get_top_matches(iter(found), 0) == []
+    assert sparse_encoding._get_top_matches(iter(found), 10) == found
+
+
+def _v3_distance(positions, forms, freqs, metric):
+    """Distance for one hit group, computed the way v3 does"""
+    if len(set(forms[positions])) < 2:
+        return 0
+    sorted_positions = np.array(sorted(positions))
+    if metric == 'span':
+        return sorted_positions[-1] - sorted_positions[0] + 1
+    order = np.argsort(freqs[forms[sorted_positions]], kind='stable')
+    idx = sorted_positions[order]
+    return np.abs(idx[idx != idx[0]][0] - idx[0]) + 1
+
+
+def test_batched_distances():
+    rng = np.random.default_rng(20)
+    forms = rng.integers(0, 8, size=30)
+    # few distinct values, so that frequency ties are common
+    form_freqs = rng.integers(1, 4, size=8) / 4
+    groups = [
+        rng.integers(0, 30, size=rng.integers(1, 7)) for _ in range(500)]
+    groups.extend([np.array([3, 3]), np.array([5, 2]), np.array([7])])
+    offsets = np.cumsum([0] + [len(g) for g in groups])
+    positions = np.concatenate(groups)
+    by_span = sparse_encoding._get_distances_by_span(
+        offsets, positions, forms[positions])
+    by_frequency = sparse_encoding._get_distances_by_least_frequency(
+        offsets, positions, forms[positions], form_freqs[forms[positions]])
+    for i, group in enumerate(groups):
+        assert by_span[i] == _v3_distance(group, forms, form_freqs, 'span')
+        assert by_span[i] == sparse_encoding._get_distance_by_span(
+            group, forms)
+        assert by_frequency[i] == _v3_distance(
+            group, forms, form_freqs, 'frequency')
+        assert by_frequency[i] == \
+            sparse_encoding._get_distance_by_least_frequency(
+                lambda f: form_freqs[f], group, forms)
+
+
+def test_form_frequency_arrays():
+    units = [
+        {'_id': None, 'tags': [], 'snippet': '', 'forms': [3, 0, 5],
+         'features': [[1, 2], [], [0, 1, 2]]},
+        {'_id': None, 'tags': [], 'snippet': '', 'forms': [3, 1],
+         'features': [[1, 2], [0]]},
+    ]
+    text_units = build_text_units(units, None, 'line', 'lemmata')
+    d = np.array([0.5, 0.25, 0.125])
+    freqs = sparse_encoding._averaged_form_frequencies(d, [text_units])
+    assert len(freqs) == 6
+    assert freqs[3] == np.mean(d[[1, 2]])
+    assert freqs[5] == np.mean(d)
+    assert freqs[1] == d[0]
+    assert np.isnan(freqs[0]) and np.isnan(freqs[2]) and np.isnan(freqs[4])
+
+    freqs = sparse_encoding._dense_form_frequencies(
+        {3: 0.5, 5: 0.25, 1: 0.125, 9: 1.0}, [text_units])
+    assert len(freqs) == 6
+    assert freqs[3] == 0.5 and freqs[5] == 0.25 and freqs[1] == 0.125
+    position_freqs = sparse_encoding._get_position_frequencies(
+        freqs, text_units)
+    assert np.array_equal(
+        position_freqs, [0.5, np.nan, 0.25, 0.5, 0.125], equal_nan=True)
+
+
+def test_text_frequencies_memoized(minipop, mini_latin_metadata):
+    text = minipop.find(
+        Text.collection, title=mini_latin_metadata[0]['title'])[0]
+    freqs = get_text_frequencies(minipop, 'lemmata', text.id)
+    assert get_text_frequencies(minipop, 'lemmata', text.id) is freqs
+
+
+def test_get_text_frequencies_together(minipop, mini_latin_metadata):
+    texts = minipop.find(
+        Text.collection, title=[m['title'] for m in mini_latin_metadata])
+    sparse_encoding._text_frequencies.clear()
+    together = sparse_encoding._get_text_frequencies(
+        minipop, 'form', [t.id for t in texts])
+    for text in texts:
+        sparse_encoding._text_frequencies.clear()
+        assert together[text.id] == get_text_frequencies(
+            minipop, 'form', text.id)
+
+
+def test_min_score_and_top_k(minipop, mini_latin_metadata, monkeypatch):
+    texts = minipop.find(
+        Text.collection,
+        title=[m['title'] for m in mini_latin_metadata])
+    matcher = SparseMatrixSearch(minipop)
+
+    def search(**kwargs):
+        matches = matcher.match(
+            None,
+            TextOptions(texts[0], 'line'),
+            TextOptions(texts[1], 'line'),
+            'lemmata',
+            stopwords=4,
+            stopword_basis='corpus', score_basis='stem',
+            frequency_basis='corpus', max_distance=10,
+            distance_metric='frequency', parallel=False, **kwargs)
+        return [(m.source_unit, m.target_unit, m.score) for m in matches]
+
+    everything = search(min_score=None)
+    assert everything
+    cutoff = sorted(m[2] for m in everything)[len(everything) // 2]
+    assert search(min_score=cutoff) == [
+        m for m in everything if m[2] >= cutoff]
+    top = search(min_score=None, top_k=3)
+    assert len(top) == min(3, len(everything))
+    best = sorted(everything, key=lambda m: -m[2])[:len(top)]
+    assert sorted(m[2] for m in top) == sorted(m[2] for m in best)
+
+    # which tied matches survive does not depend on the source blocks
+    scores = sorted((m[2] for m in everything), reverse=True)
+    top_k = next(
+        (k for k in range(1, len(scores)) if scores[k] == scores[k - 1]),
+        len(scores) // 2)
+    top = search(min_score=None, top_k=top_k)
+    get_source_blocks = sparse_encoding._get_source_blocks
+    monkeypatch.setattr(
+        sparse_encoding, '_get_source_blocks',
+        lambda source_size: get_source_blocks(source_size, stepsize=1))
+    assert sorted(search(min_score=None, top_k=top_k)) == sorted(top)
+
+
+def test_score_block_min_score():
+    # group 0: rare words far apart; group 1: common words close together;
+    # group 2: a single matched position in each unit
+    offsets = np.array([0, 2, 4, 5])
+    t_positions = np.array([0, 8, 0, 1, 3])
+    s_positions = np.array([0, 1, 2, 3, 4])
+    forms = np.array([0, 1, 2, 3, 4])
+    freqs = np.array([0.01, 0.01, 0.5, 0.5, 0.01])
+    keep, scores = sparse_encoding._score_block(
+        offsets, t_positions, s_positions, forms, forms, freqs, freqs,
+        'span', 20)
+    assert list(keep) == [True, True, False]
+    assert np.isclose(scores[0], np.log(400 / 11))
+    assert np.isclose(scores[1], np.log(8 / 4))
+    # group 1 cannot reach the cutoff even at the smallest distance
+    pruned_keep, pruned_scores = sparse_encoding._score_block(
+        offsets, t_positions, s_positions, forms, forms, freqs, freqs,
+        'span', 20, min_score=1.5)
+    assert list(pruned_keep) == [True, False, False]
+    assert pruned_scores[0] == scores[0]
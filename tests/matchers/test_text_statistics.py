@@ -0,0 +1,82 @@
+import gridfs
+import numpy as np
+
+from bson.objectid import ObjectId
+
+from tesserae.db.entities import Text, Unit
+from tesserae.matchers import text_statistics
+from tesserae.matchers.text_statistics import STATISTICS_BUCKET, \
+        STATISTICS_VERSION, TextStatistics, clear_text_statistics, \
+        get_text_statistics
+from tesserae.matchers.unit_cache import build_text_units
+from tesserae.utils.delete import remove_text
+
+
+def test_from_text_units(units):
+    text_id = ObjectId()
+    statistics = TextStatistics.from_text_units(
+        build_text_units(units, text_id, 'line', 'lemmata'))
+    assert statistics.units_size == 2
+    assert statistics.positions_size == 5
+    assert list(statistics.feature_indices) == [7, 10, 20, 21, 30]
+    assert list(statistics.feature_counts) == [1, 1, 1, 2, 1]
+    counts = statistics.dense_counts(32, stoplist=np.array([10, 99]))
+    assert counts[21] == 2
+    assert counts[10] == 0
+    assert counts.sum() == 5
+
+    loaded = TextStatistics.from_bytes(
+        statistics.to_bytes(), text_id, 'line', 'lemmata')
+    assert loaded.units_size == 2
+    assert loaded.positions_size == 5
+    assert np.all(loaded.feature_indices == statistics.feature_indices)
+    assert np.all(loaded.feature_counts == statistics.feature_counts)
+
+
+def test_get_text_statistics(minipop, mini_latin_metadata, monkeypatch):
+    text = minipop.find(
+        Text.collection, title=mini_latin_metadata[0]['title'])[0]
+    fs = gridfs.GridFS(minipop.connection, collection=STATISTICS_BUCKET)
+    counted = []
+    get_text_units = text_statistics.get_text_units
+
+    def counted_get_text_units(*args):
+        counted.append(args)
+        return get_text_units(*args)
+
+    monkeypatch.setattr(
+        text_statistics, 'get_text_units', counted_get_text_units)
+    clear_text_statistics(minipop, text.id)
+    built = get_text_statistics(minipop, text, 'line', 'lemmata')
+    assert fs.find_one({'text': text.id}) is not None
+    units = minipop.find(Unit.collection, text=text.id, unit_type='line')
+    assert built.units_size == len(units)
+    loaded = get_text_statistics(minipop, text, 'line', 'lemmata')
+    assert len(counted) == 1
+    assert np.all(loaded.feature_counts == built.feature_counts)
+
+    # clearing the cache makes the next call count the features again
+    clear_text_statistics(minipop, text.id)
+    assert fs.find_one({'text': text.id}) is None
+    get_text_statistics(minipop, text, 'line', 'lemmata')
+    assert len(counted) == 2
+
+    # so does a new statistics version, since older blobs are ignored
+    monkeypatch.setattr(
+        text_statistics, 'STATISTICS_VERSION', STATISTICS_VERSION + 1)
+    recounted = get_text_statistics(minipop, text, 'line', 'lemmata')
+    assert len(counted) == 3
+    assert fs.find_one(
+        {'text': text.id, 'version': STATISTICS_VERSION + 1}) is not None
+    assert np.all(recounted.feature_counts == built.feature_counts)
+    clear_text_statistics(minipop, text.id)
+    assert fs.find_one({'text': text.id}) is None
+
+
+def test_remove_text_clears_statistics(minipop):
+    text = Text(id=ObjectId(), language='latin', title='not ingested')
+    fs = gridfs.GridFS(minipop.connection, collection=STATISTICS_BUCKET)
+    fs.put(b'', text=text.id, unit_type='line', feature='lemmata',
+           version=STATISTICS_VERSION)
+    remove_text(minipop, text)
+    assert fs.find_one({'text': text.id}) is None
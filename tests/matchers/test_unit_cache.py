@@ -0,0 +1,93 @@
+import gridfs
+import numpy as np
+
+from bson.objectid import ObjectId
+
+from tesserae.db.entities import Text, Unit
+from tesserae.matchers import unit_cache
+from tesserae.matchers.unit_cache import CACHE_BUCKET, CACHE_VERSION, \
+        TextUnits, build_text_units, clear_text_units, get_text_units
+from tesserae.utils.delete import remove_text
+
+
+def test_build_text_units(units):
+    text_id = ObjectId()
+    text_units = build_text_units(units, text_id, 'line', 'lemmata')
+    assert len(text_units) == 2
+    assert np.all(text_units.break_inds == np.array([0, 2, 5]))
+    assert np.all(text_units.forms == np.array([1, 2, 5, -1, 7]))
+    assert np.all(text_units.indptr == np.array([0, 2, 3, 4, 4, 6]))
+    assert np.all(text_units.indices == np.array([10, 20, 21, 7, 21, 30]))
+    assert text_units.get_display_tags(0) == ['1.1']
+    assert text_units.get_display_tags(1) == []
+
+
+def test_roundtrip(units):
+    text_id = ObjectId()
+    text_units = build_text_units(units, text_id, 'line', 'lemmata')
+    loaded = TextUnits.from_bytes(
+        text_units.to_bytes(), text_id, 'line', 'lemmata')
+    assert loaded.unit_ids == text_units.unit_ids
+    assert loaded.tags == text_units.tags
+    assert loaded.snippets == text_units.snippets
+    for attr in ['break_inds', 'forms', 'indptr', 'indices']:
+        assert np.all(getattr(loaded, attr) == getattr(text_units, attr))
+
+
+def test_feature_matrix(units):
+    text_units = build_text_units(units, ObjectId(), 'line', 'lemmata')
+    matrix = text_units.feature_matrix(np.array([21]), 31)
+    assert matrix.shape == (5, 31)
+    assert matrix[0, 10] and matrix[0, 20]
+    assert matrix.getrow(1).nnz == 0
+    assert matrix[2, 7]
+    assert matrix.getrow(3).nnz == 0
+    assert list(matrix.getrow(4).indices) == [30]
+
+
+def test_get_text_units(minipop, mini_latin_metadata, monkeypatch):
+    text = minipop.find(
+        Text.collection, title=mini_latin_metadata[0]['title'])[0]
+    fs = gridfs.GridFS(minipop.connection, collection=CACHE_BUCKET)
+    reads = []
+    get_units = unit_cache._get_units
+
+    def counted_get_units(*args):
+        reads.append(args)
+        return get_units(*args)
+
+    monkeypatch.setattr(unit_cache, '_get_units', counted_get_units)
+    clear_text_units(minipop, text.id)
+    built = get_text_units(minipop, text, 'line', 'lemmata')
+    assert fs.find_one({'text': text.id}) is not None
+    units = minipop.find(Unit.collection, text=text.id, unit_type='line')
+    assert len(built) == len(units)
+    loaded = get_text_units(minipop, text, 'line', 'lemmata')
+    assert len(reads) == 1
+    assert loaded.unit_ids == built.unit_ids
+    assert np.all(loaded.indices == built.indices)
+
+    # clearing the cache makes the next call read the units again
+    clear_text_units(minipop, text.id)
+    assert fs.find_one({'text': text.id}) is None
+    get_text_units(minipop, text, 'line', 'lemmata')
+    assert len(reads) == 2
+
+    # so does a new cache version, since older blobs are ignored
+    monkeypatch.setattr(unit_cache, 'CACHE_VERSION', CACHE_VERSION + 1)
+    rebuilt = get_text_units(minipop, text, 'line', 'lemmata')
+    assert len(reads) == 3
+    assert fs.find_one(
+        {'text': text.id, 'version': CACHE_VERSION + 1}) is not None
+    assert rebuilt.unit_ids == built.unit_ids
+    clear_text_units(minipop, text.id)
+    assert fs.find_one({'text': text.id}) is None
+
+
+def test_remove_text_clears_units(minipop):
+    text = Text(id=ObjectId(), language='latin', title='not ingested')
+    fs = gridfs.GridFS(minipop.connection, collection=CACHE_BUCKET)
+    fs.put(b'', text=text.id, unit_type='line', feature='lemmata',
+           version=CACHE_VERSION)
+    remove_text(minipop, text)
+    assert fs.find_one({'text': text.id}) is None
@@ -0,0 +1,54 @@
+"""Fixtures shared by the utility tests."""
+import uuid
+
+import pytest
+
+from tesserae.db.entities import Search, Text
+from tesserae.matchers.sparse_encoding import SparseMatrixSearch
+from tesserae.matchers.text_options import TextOptions
+from tesserae.utils.compact_results import store_match_columns
+
+
+def _store_search(connection, texts, compact):
+    """Run a search between two texts and store it as finished"""
+    search = Search(results_id=uuid.uuid4().hex, status=Search.DONE)
+    connection.insert(search)
+    matcher = SparseMatrixSearch(connection)
+    params = {
+        'source': TextOptions(texts[0], 'line'),
+        'target': TextOptions(texts[1], 'line'),
+        'feature': 'lemmata',
+        'stopwords': 4,
+        'stopword_basis': 'corpus',
+        'score_basis': 'stem',
+        'frequency_basis': 'corpus',
+        'max_distance': 10,
+        'distance_metric': 'frequency',
+        'min_score': 0,
+        'parallel': False
+    }
+    if compact:
+        store_match_columns(
+            connection, search.id, matcher.match_columns(**params))
+    else:
+        connection.insert_nocheck(matcher.match(search.id, **params))
+    return search
+
+
+def _latin_texts(connection, metadata):
+    return connection.find(
+        Text.collection, title=[m['title'] for m in metadata])
+
+
+@pytest.fixture(scope='module')
+def finished_search(minipop, mini_latin_metadata):
+    """A finished search whose matches are stored as Match entities"""
+    return _store_search(
+        minipop, _latin_texts(minipop, mini_latin_metadata), compact=False)
+
+
+@pytest.fixture(scope='module')
+def compact_search(minipop, mini_latin_metadata):
+    """The search of ``finished_search`` with its matches in compact form"""
+    return _store_search(
+        minipop, _latin_texts(minipop, mini_latin_metadata), compact=True)
@@ -0,0 +1,46 @@
+import numpy as np
+
+from bson.objectid import ObjectId
+
+from tesserae.utils.compact_results import MatchColumns, \
+        clear_match_columns, get_match_columns
+from tesserae.utils.retrieve import get_results
+
+
+def test_roundtrip():
+    columns = MatchColumns(
+        ObjectId(), ObjectId(), 'line', 'phrase', 'lemmata', 'latin',
+        source_inds=np.array([3, 0]),
+        target_inds=np.array([1, 1]),
+        scores=np.array([7.5, 6.25]),
+        features_indptr=np.array([0, 2, 3]),
+        features_indices=np.array([10, 12, 4]),
+        highlights_indptr=np.array([0, 2, 5]),
+        highlights=np.array([[0, 1], [2, 3], [0, 0], [1, 4], [5, 5]]))
+    loaded = MatchColumns.from_bytes(
+        columns.to_bytes(), columns.source_text, columns.target_text,
+        'line', 'phrase', 'lemmata', 'latin')
+    assert len(loaded) == 2
+    for attr in ['source_inds', 'target_inds', 'scores', 'features_indptr',
+                 'features_indices', 'highlights_indptr', 'highlights']:
+        assert np.all(getattr(loaded, attr) == getattr(columns, attr))
+
+
+def test_get_results_from_columns(minipop, finished_search,
+                                  compact_search):
+    full, compact = finished_search, compact_search
+    assert get_match_columns(minipop, full.id) is None
+    full_results = get_results(minipop, full.results_id)
+    compact_results = get_results(minipop, compact.results_id)
+    assert len(full_results) > 0
+    assert compact_results == full_results
+    for sort_by in ['score', 'source_tag', 'target_tag']:
+        for sort_order in ['ascending', 'descending']:
+            assert get_results(
+                minipop, compact.results_id, sort_by=sort_by,
+                sort_order=sort_order, offset=2, limit=5) == get_results(
+                minipop, full.results_id, sort_by=sort_by,
+                sort_order=sort_order, offset=2, limit=5)
+
+    clear_match_columns(minipop, compact.id)
+    assert get_match_columns(minipop, compact.id) is None
@@ -1,8 +1,12 @@
+import gridfs
 import pytest
 
 from tesserae.db import TessMongoConnection
 from tesserae.db.entities import Feature, Text, Token, Unit
+from tesserae.matchers.unit_cache import CACHE_BUCKET, get_text_units
 from tesserae.utils import ingest_text, remove_text
+from tesserae.utils.frequencies import TEXT_FREQUENCIES, \
+        get_corpus_frequency_counts, get_text_frequency_table
 
 
 @pytest.fixture
@@ -23,6 +27,7 @@ def test_remove(removedb, mini_latin_metadata):
     )
 
     text_id = texts[0].id
+    get_text_units(removedb, texts[0], 'line', 'lemmata')
     remove_text(removedb, texts[0])
 
     tokens = removedb.find(Token.collection)
@@ -33,3 +38,14 @@ def test_remove(removedb, mini_latin_metadata):
 
     features = removedb.find(Feature.collection)
     assert all([str(text_id) not in f.frequencies for f in features])
+
+    assert removedb.connection[TEXT_FREQUENCIES].find_one(
+        {'text': text_id}) is None
+    assert get_text_frequency_table(removedb, text_id, 'lemmata') is None
+    counts = get_corpus_frequency_counts(removedb, 'lemmata', 'latin')
+    for f in features:
+        if f.feature == 'lemmata':
+            assert counts[f.index] == sum(f.frequencies.values())
+
+    fs = gridfs.GridFS(removedb.connection, collection=CACHE_BUCKET)
+    assert fs.find_one({'text': text_id}) is None
@@ -0,0 +1,72 @@
+import csv
+import io
+import json
+
+import pytest
+
+from tesserae.utils.export import EXPORT_FIELDS, export_results, \
+        write_results
+from tesserae.utils.retrieve import get_results
+
+
+@pytest.fixture
+def results():
+    return [
+        {
+            'source_tag': 'Vergil Aeneid 1.1', 'target_tag': 'Lucan 1.2',
+            'matched_features': ['arma', 'vir'], 'score': 7.25,
+            'source_snippet': 'arma virumque cano',
+            'target_snippet': 'bella, "per" campos',
+            'highlight': [[0, 0], [1, 2]]
+        },
+        {
+            'source_tag': 'Vergil Aeneid 1.2', 'target_tag': 'Lucan 1.3',
+            'matched_features': ['μῆνις'], 'score': 6.0,
+            'source_snippet': 'tab\tseparated', 'target_snippet': 'line',
+            'highlight': []
+        },
+    ]
+
+
+@pytest.mark.parametrize('file_format,delimiter', [('csv', ','),
+                                                   ('tsv', '\t')])
+def test_write_delimited(results, file_format, delimiter):
+    out = io.StringIO(newline='')
+    assert write_results(iter(results), out, file_format=file_format) == 2
+    rows = list(csv.reader(io.StringIO(out.getvalue(), newline=''),
+                           delimiter=delimiter))
+    assert rows[0] == list(EXPORT_FIELDS)
+    assert len(rows) == 3
+    for row, result in zip(rows[1:], results):
+        row = dict(zip(EXPORT_FIELDS, row))
+        assert row['source_tag'] == result['source_tag']
+        assert row['target_snippet'] == result['target_snippet']
+        assert row['source_snippet'] == result['source_snippet']
+        assert float(row['score']) == result['score']
+        assert row['matched_features'].split('; ') == \
+            result['matched_features']
+        assert json.loads(row['highlight']) == result['highlight']
+
+
+def test_write_jsonl(results):
+    out = io.StringIO()
+    assert write_results(iter(results), out, file_format='jsonl') == 2
+    lines = out.getvalue().splitlines()
+    assert [json.loads(line) for line in lines] == results
+
+
+def test_write_bad_format(results):
+    with pytest.raises(ValueError):
+        write_results(iter(results), io.StringIO(), file_format='xlsx')
+
+
+def test_export_results(minipop, finished_search):
+    out = io.StringIO()
+    count = export_results(
+        minipop, finished_search.results_id, out, file_format='jsonl',
+        sort_by='score', batch_size=2)
+    expected = get_results(
+        minipop, finished_search.results_id, sort_by='score')
+    assert count == len(expected)
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == \
+        expected
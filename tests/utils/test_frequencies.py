@@ -0,0 +1,113 @@
+import collections
+import itertools
+
+import numpy as np
+import pytest
+
+from tesserae.db.entities import Feature, Text
+from tesserae.matchers.unit_cache import get_text_units
+from tesserae.utils.frequencies import CORPUS_FREQUENCIES, \
+        CORPUS_VERSIONS, TEXT_FREQUENCIES, add_text_frequencies, \
+        compute_text_frequencies, get_corpus_frequency_counts, \
+        get_corpus_version, get_text_frequency_table, get_top_features, \
+        rebuild_frequencies
+
+
+def _counts_from_features(connection, feature, language, texts=None):
+    features = connection.find(
+        Feature.collection, feature=feature, language=language)
+    counts = np.zeros(len(features), dtype=np.int64)
+    for f in features:
+        counts[f.index] = sum(
+            v for k, v in f.frequencies.items()
+            if texts is None or k in texts)
+    return counts
+
+
+def _top(counts, n):
+    return list(np.argsort(-counts, kind='stable')[:n])
+
+
+def test_corpus_counts(minipop):
+    for language in ['greek', 'latin']:
+        for feature in ['form', 'lemmata']:
+            expected = _counts_from_features(minipop, feature, language)
+            counts = get_corpus_frequency_counts(minipop, feature, language)
+            assert np.all(counts == expected)
+            assert list(get_top_features(
+                minipop, 10, feature, language)) == _top(expected, 10)
+
+
+def test_text_counts(minipop, mini_latin_metadata):
+    texts = minipop.find(
+        Text.collection, title=[m['title'] for m in mini_latin_metadata])
+    for basis in [texts[:1], texts]:
+        expected = _counts_from_features(
+            minipop, 'lemmata', 'latin', texts=[str(t.id) for t in basis])
+        assert list(get_top_features(
+            minipop, 10, 'lemmata', 'latin', texts=basis)) == \
+            _top(expected, 10)
+
+
+def test_rebuild_frequencies(minipop):
+    before = collections.Counter(
+        (r['text'], r['feature'], r['index'], r['count'])
+        for r in minipop.connection[TEXT_FREQUENCIES].find())
+    totals = get_corpus_frequency_counts(minipop, 'lemmata', 'latin')
+    # served from the cache until the corpus changes
+    assert get_corpus_frequency_counts(minipop, 'lemmata', 'latin') is totals
+    version = get_corpus_version(minipop, 'latin')
+    rebuild_frequencies(minipop)
+    assert get_corpus_version(minipop, 'latin') != version
+    assert get_corpus_frequency_counts(
+        minipop, 'lemmata', 'latin') is not totals
+    after = collections.Counter(
+        (r['text'], r['feature'], r['index'], r['count'])
+        for r in minipop.connection[TEXT_FREQUENCIES].find())
+    assert after == before
+    assert np.all(
+        get_corpus_frequency_counts(minipop, 'lemmata', 'latin') == totals)
+
+
+def test_missing_totals(minipop):
+    expected = _counts_from_features(minipop, 'lemmata', 'latin')
+    latin = minipop.find(Text.collection, language='latin')
+    # a database ingested before the frequency collections existed
+    for collection in [TEXT_FREQUENCIES, CORPUS_FREQUENCIES, CORPUS_VERSIONS]:
+        minipop.connection[collection].drop()
+    try:
+        with pytest.raises(ValueError):
+            get_corpus_frequency_counts(minipop, 'lemmata', 'latin')
+        with pytest.raises(ValueError):
+            get_top_features(minipop, 5, 'lemmata', 'latin', texts=latin)
+        # ingesting another text does not make the older ones counted
+        features = [
+            f for f in minipop.find(
+                Feature.collection, feature='lemmata', language='latin')
+            if str(latin[0].id) in f.frequencies]
+        add_text_frequencies(minipop, latin[0], features)
+        with pytest.raises(ValueError):
+            get_corpus_frequency_counts(minipop, 'lemmata', 'latin')
+    finally:
+        rebuild_frequencies(minipop)
+    assert np.all(
+        get_corpus_frequency_counts(minipop, 'lemmata', 'latin') == expected)
+
+
+def test_compute_text_frequencies():
+    # forms 7 and 9 share feature 1; form 8 has no features
+    forms = np.array([7, 9, 7, 8, 5])
+    position_features = [[1, 2], [1], [1, 2], [], [3]]
+    indptr = np.cumsum([0] + [len(f) for f in position_features])
+    indices = np.array(list(itertools.chain.from_iterable(position_features)))
+    freqs = compute_text_frequencies(forms, indptr, indices)
+    assert freqs == {7: 3 / 5, 9: 3 / 5, 5: 1 / 5}
+
+
+def test_text_frequency_tables(minipop):
+    for text in minipop.find(Text.collection):
+        for feature in ['form', 'lemmata']:
+            text_units = get_text_units(minipop, text, 'line', feature)
+            assert get_text_frequency_table(minipop, text.id, feature) == \
+                compute_text_frequencies(
+                    text_units.forms, text_units.indptr, text_units.indices)
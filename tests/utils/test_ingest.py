@@ -0,0 +1,81 @@
+import pytest
+
+from bson.objectid import ObjectId
+
+from tesserae.db import TessMongoConnection
+from tesserae.db.entities import Feature, Text, Token, Unit
+from tesserae.tokenizers import LatinTokenizer
+from tesserae.utils import ingest, ingest_texts
+
+
+@pytest.fixture(scope='module')
+def parallel_minipop(mini_greek_metadata, mini_latin_metadata):
+    conn = TessMongoConnection('localhost', 27017, None, None,
+                               'minitess_parallel')
+    conn.create_indices()
+    texts = [Text.json_decode(metadata)
+             for metadata in mini_greek_metadata + mini_latin_metadata]
+    errors = [error for _, error in ingest_texts(conn, texts, processes=2)]
+    assert errors == [None] * len(texts)
+    yield conn
+    for coll_name in conn.connection.list_collection_names():
+        conn.connection.drop_collection(coll_name)
+
+
+def _feature_table(connection):
+    texts = {t.id: t.title for t in connection.find(Text.collection)}
+    return {
+        (f.language, f.feature, f.token): (
+            f.index,
+            {texts[ObjectId(k)]: v for k, v in f.frequencies.items()})
+        for f in connection.find(Feature.collection)
+    }
+
+
+def test_ingest_texts_matches_serial(minipop, parallel_minipop):
+    assert _feature_table(parallel_minipop) == _feature_table(minipop)
+    for text in minipop.find(Text.collection):
+        other = parallel_minipop.find(Text.collection, title=text.title)[0]
+        assert len(parallel_minipop.find(Token.collection, text=other.id)) \
+            == len(minipop.find(Token.collection, text=text.id))
+        assert len(parallel_minipop.find(Unit.collection, text=other.id)) \
+            == len(minipop.find(Unit.collection, text=text.id))
+
+
+def test_ingest_texts_duplicate(minipop, mini_latin_metadata):
+    texts = [Text.json_decode(metadata) for metadata in mini_latin_metadata]
+    tokens_before = minipop.connection[Token.collection].count_documents({})
+    results = list(ingest_texts(minipop, texts, processes=2))
+    assert [text for text, _ in results] == texts
+    for text, error in results:
+        assert isinstance(error, ValueError)
+        assert text.id is None
+    assert minipop.connection[Token.collection].count_documents({}) == \
+        tokens_before
+    for metadata in mini_latin_metadata:
+        assert len(minipop.find(Text.collection, title=metadata['title'])) \
+            == 1
+
+
+class _UnbuildableTokenizer(LatinTokenizer):
+    def __init__(self, connection):
+        # pool workers featurize without a connection
+        if connection is not None:
+            raise RuntimeError('cannot build tokenizer')
+        super().__init__(connection)
+
+
+def test_ingest_texts_failed_tokenizer(mini_latin_metadata, monkeypatch):
+    conn = TessMongoConnection('localhost', 27017, None, None,
+                               'minitess_failed_tokenizer')
+    monkeypatch.setitem(ingest._tokenizers, 'latin', _UnbuildableTokenizer)
+    texts = [Text.json_decode(metadata) for metadata in mini_latin_metadata]
+    try:
+        results = list(ingest_texts(conn, texts, processes=2))
+        assert [text for text, _ in results] == texts
+        for _, error in results:
+            assert isinstance(error, RuntimeError)
+        assert conn.connection[Token.collection].count_documents({}) == 0
+    finally:
+        for coll_name in conn.connection.list_collection_names():
+            conn.connection.drop_collection(coll_name)
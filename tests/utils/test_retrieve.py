@@ -0,0 +1,47 @@
+import pytest
+
+from tesserae.utils.retrieve import count_results, get_results, \
+        get_results_page
+
+
+def test_get_results_sorted(minipop, finished_search):
+    results_id = finished_search.results_id
+    results = get_results(minipop, results_id)
+    assert len(results) > 1
+    by_score = get_results(minipop, results_id, sort_by='score')
+    assert [r['score'] for r in by_score] == \
+        sorted([r['score'] for r in results], reverse=True)
+    by_tag = get_results(
+        minipop, results_id, sort_by='source_tag', sort_order='ascending')
+    assert [r['source_tag'] for r in by_tag] == \
+        sorted([r['source_tag'] for r in results])
+
+
+def test_get_results_page(minipop, finished_search):
+    results_id = finished_search.results_id
+    everything = get_results(minipop, results_id, sort_by='score')
+    total = count_results(minipop, results_id)
+    assert total == len(everything)
+    page_size = 3
+    pages = []
+    for offset in range(0, total, page_size):
+        page, page_total = get_results_page(
+            minipop, results_id, page_size, offset=offset)
+        assert page_total == total
+        assert len(page) <= page_size
+        pages.extend(page)
+    assert pages == everything
+    page, _ = get_results_page(minipop, results_id, page_size, offset=total)
+    assert page == []
+
+
+def test_get_results_bad_paging(minipop, finished_search):
+    results_id = finished_search.results_id
+    with pytest.raises(ValueError):
+        get_results(minipop, results_id, sort_by='snippet')
+    with pytest.raises(ValueError):
+        get_results(minipop, results_id, sort_order='sideways')
+    with pytest.raises(ValueError):
+        get_results(minipop, results_id, offset=-1)
+    with pytest.raises(ValueError):
+        get_results_page(minipop, results_id, 0)
@@ -0,0 +1,111 @@
+from tesserae.utils.scheduler import SearchScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _run_all(scheduler):
+    order = []
+    while True:
+        job = scheduler.next_job()
+        if job is None:
+            break
+        order.append(job)
+    return order
+
+
+def test_short_lane_first():
+    scheduler = SearchScheduler(1, short_cost=10)
+    scheduler.submit('big', 'big', 100)
+    scheduler.submit('small', 'small', 5)
+    scheduler.submit('tiny', 'tiny', 1)
+    assert len(scheduler) == 3
+    assert _run_all(scheduler) == ['tiny']
+    scheduler.finish('tiny')
+    assert _run_all(scheduler) == ['small']
+    scheduler.finish('small')
+    assert _run_all(scheduler) == ['big']
+    scheduler.finish('big')
+    assert len(scheduler) == 0
+    assert scheduler.next_job() is None
+
+
+def test_worker_kept_for_short_searches():
+    scheduler = SearchScheduler(3, short_cost=10)
+    for i in range(4):
+        scheduler.submit(f'big{i}', f'big{i}', 100)
+    assert _run_all(scheduler) == ['big0', 'big1']
+    scheduler.submit('small', 'small', 5)
+    assert _run_all(scheduler) == ['small']
+    scheduler.finish('big0')
+    assert _run_all(scheduler) == ['big2']
+
+
+def test_long_wait_runs_first():
+    clock = FakeClock()
+    scheduler = SearchScheduler(1, short_cost=10, max_wait=60, clock=clock)
+    scheduler.submit('big', 'big', 100)
+    scheduler.submit('small0', 'small0', 5)
+    scheduler.submit('small1', 'small1', 5)
+    assert _run_all(scheduler) == ['small0']
+    clock.now = 61
+    scheduler.finish('small0')
+    assert _run_all(scheduler) == ['big']
+
+
+def test_fair_share():
+    scheduler = SearchScheduler(1, short_cost=10)
+    for i in range(3):
+        scheduler.submit(f'a{i}', f'a{i}', 5, client='a')
+    scheduler.submit('b0', 'b0', 5, client='b')
+    scheduler.submit('b1', 'b1', 5, client='b')
+    order = []
+    for _ in range(5):
+        job = scheduler.next_job()
+        order.append(job)
+        scheduler.finish(job)
+    assert order == ['a0', 'b0', 'a1', 'b1', 'a2']
+
+
+def test_drain():
+    scheduler = SearchScheduler(1, short_cost=10)
+    scheduler.submit('a', 'a', 5)
+    scheduler.submit('b', 'b', 50)
+    assert scheduler.next_job() == 'a'
+    assert scheduler.drain() == ['b']
+    assert len(scheduler) == 0
+    scheduler.finish('a')
+    assert scheduler.next_job() is None
+
+
+def test_finish_unknown():
+    scheduler = SearchScheduler(1, short_cost=10)
+    scheduler.submit('a', 'a', 5)
+    scheduler.submit('b', 'b', 5)
+    assert scheduler.next_job() == 'a'
+    scheduler.finish('a')
+    # repeated and unknown ids do not disturb the jobs that are left
+    scheduler.finish('a')
+    scheduler.finish('never submitted')
+    assert scheduler.next_job() == 'b'
+    assert scheduler.next_job() is None
+
+
+def test_unknown_cost():
+    scheduler = SearchScheduler(1, short_cost=10)
+    scheduler.submit('a0', 'a0', float('inf'), client='a')
+    scheduler.submit('b0', 'b0', 50, client='b')
+    scheduler.submit('a1', 'a1', 50, client='a')
+    scheduler.submit('b1', 'b1', 50, client='b')
+    order = []
+    for _ in range(4):
+        job = scheduler.next_job()
+        order.append(job)
+        scheduler.finish(job)
+    # a0 counts as the largest known cost, so client a is not starved
+    assert order == ['a0', 'b0', 'a1', 'b1']
@@ -1,5 +1,15 @@
-from tesserae.db.entities import Feature, Text
-from tesserae.utils.search import bigram_search
+import time
+import uuid
+
+from bson.objectid import ObjectId
+
+import tesserae.matchers
+from tesserae.db.entities import Feature, Match, Search, Text
+from tesserae.matchers.sparse_encoding import DEFAULT_MIN_SCORE
+from tesserae.matchers.text_options import TextOptions
+from tesserae.utils.search import AsynchronousSearcher, SearchProcess, \
+        _search_parameters, bigram_search, cancel_search, check_cache, \
+        hash_parameters
 
 
 def test_bigram_search(minipop, mini_latin_metadata):
@@ -31,3 +41,225 @@ def test_bigram_search(minipop, mini_latin_metadata):
                 pando_found = True
         assert bellum_found
         assert pando_found
+
+
+def _parameters(stopwords, max_distance=10):
+    return {
+        'source': {'object_id': 'a', 'units': 'line'},
+        'target': {'object_id': 'b', 'units': 'phrase'},
+        'method': {
+            'name': 'original',
+            'feature': 'lemmata',
+            'stopwords': stopwords,
+            'freq_basis': 'corpus',
+            'max_distance': max_distance,
+            'distance_basis': 'frequency'
+        }
+    }
+
+
+def test_hash_parameters():
+    params = _parameters(['et', 'qui', 'sum'])
+    assert hash_parameters(params) == hash_parameters(
+        _parameters(['sum', 'et', 'qui']))
+    assert hash_parameters(params) == hash_parameters(
+        _parameters(['et', 'qui', 'sum'], max_distance=10.0))
+    # a missing min_score means the default, not keeping every match
+    params['method']['min_score'] = DEFAULT_MIN_SCORE
+    params['method']['top_k'] = None
+    assert hash_parameters(params) == hash_parameters(
+        _parameters(['et', 'qui', 'sum']))
+    keep_all = _parameters(['et', 'qui', 'sum'])
+    keep_all['method']['min_score'] = None
+    assert hash_parameters(keep_all) != hash_parameters(params)
+    assert hash_parameters(params) != hash_parameters(
+        _parameters(['et', 'qui']))
+    # the basis only matters for stoplists of the most frequent features
+    texts_basis = _parameters(['et', 'qui', 'sum'])
+    texts_basis['method']['stopword_basis'] = 'texts'
+    assert hash_parameters(texts_basis) == hash_parameters(
+        _parameters(['et', 'qui', 'sum']))
+    counted = _parameters(10)
+    counted['method']['stopword_basis'] = 'texts'
+    assert hash_parameters(counted) != hash_parameters(_parameters(10))
+    explicit = _parameters(10)
+    explicit['method']['stopword_basis'] = ['b', 'a']
+    assert hash_parameters(counted) == hash_parameters(explicit)
+    swapped = _parameters(['et', 'qui', 'sum'])
+    swapped['source'], swapped['target'] = \
+        swapped['target'], swapped['source']
+    assert hash_parameters(params) != hash_parameters(swapped)
+
+
+def test_search_parameters_min_score():
+    texts = [Text(id=ObjectId()), Text(id=ObjectId())]
+    search_params = _search_params(texts, ['et'])
+    del search_params['min_score']
+    default = _search_parameters('original', search_params)
+    assert default['method']['min_score'] == DEFAULT_MIN_SCORE
+    search_params['min_score'] = None
+    keep_all = _search_parameters('original', search_params)
+    assert hash_parameters(default) != hash_parameters(keep_all)
+
+
+def test_search_parameters_stopword_basis():
+    texts = [Text(id=ObjectId()), Text(id=ObjectId())]
+    search_params = _search_params(texts, 10)
+    del search_params['stopword_basis']
+    assert _search_parameters('original', search_params)['method'][
+        'stopword_basis'] == 'corpus'
+    search_params['stopword_basis'] = 'texts'
+    by_name = _search_parameters('original', search_params)
+    assert by_name['method']['stopword_basis'] == sorted(
+        str(t.id) for t in texts)
+    search_params['stopword_basis'] = [texts[1], texts[0].id]
+    by_texts = _search_parameters('original', search_params)
+    assert by_texts['method'] == by_name['method']
+    assert hash_parameters(by_texts) == hash_parameters(by_name)
+    search_params['stopword_basis'] = texts[0]
+    assert _search_parameters('original', search_params)['method'][
+        'stopword_basis'] == [str(texts[0].id)]
+
+
+def _search_params(texts, stopwords):
+    return {
+        'source': TextOptions(texts[0], 'line'),
+        'target': TextOptions(texts[1], 'line'),
+        'feature': 'lemmata',
+        'stopwords': stopwords,
+        'stopword_basis': 'corpus',
+        'score_basis': 'stem',
+        'frequency_basis': 'corpus',
+        'max_distance': 10,
+        'distance_metric': 'frequency',
+        'min_score': 0
+    }
+
+
+def test_check_cache(minipop, mini_latin_metadata):
+    texts = minipop.find(
+        Text.collection,
+        title=[m['title'] for m in mini_latin_metadata])
+    search_params = _search_params(texts, ['et', 'qui', 'quis'])
+    source = {'object_id': str(texts[0].id), 'units': 'line'}
+    target = {'object_id': str(texts[1].id), 'units': 'line'}
+    method = {
+        'name': 'original',
+        'feature': 'lemmata',
+        'stopwords': ['quis', 'et', 'qui'],
+        'freq_basis': 'corpus',
+        'max_distance': 10,
+        'distance_basis': 'frequency',
+        'min_score': 0
+    }
+    assert check_cache(minipop, source, target, method) is None
+
+    results_id = uuid.uuid4().hex
+    SearchProcess.run_search(
+        None, minipop, results_id, 'original', search_params)
+    search = minipop.find(Search.collection, results_id=results_id)[0]
+    assert search.status == Search.DONE
+    assert search.parameters_hash == hash_parameters(search.parameters)
+    assert check_cache(minipop, source, target, method) == results_id
+
+    search.status = Search.FAILED
+    minipop.update(search)
+    assert check_cache(minipop, source, target, method) is None
+    minipop.delete(search)
+
+
+def test_queue_search_coalesces(minipop, mini_latin_metadata):
+    texts = minipop.find(
+        Text.collection,
+        title=[m['title'] for m in mini_latin_metadata])
+    searcher = AsynchronousSearcher(1, {
+        'host': 'localhost', 'port': 27017, 'user': None, 'password': None,
+        'db': minipop.connection.name})
+    try:
+        first = searcher.queue_search(
+            uuid.uuid4().hex, 'original', _search_params(texts, ['et']))
+        second = searcher.queue_search(
+            uuid.uuid4().hex, 'original', _search_params(texts, ['et']))
+        other = searcher.queue_search(
+            uuid.uuid4().hex, 'original', _search_params(texts, ['qui']))
+        assert second == first
+        assert other != first
+
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            statuses = {
+                s.status for s in minipop.find(
+                    Search.collection, results_id=[first, other])}
+            if statuses == {Search.DONE}:
+                break
+            time.sleep(0.1)
+        assert statuses == {Search.DONE}
+        # finished searches are found in the database from now on
+        assert searcher.queue_search(
+            uuid.uuid4().hex, 'original',
+            _search_params(texts, ['et'])) == first
+        assert len(minipop.find(Search.collection, results_id=first)) == 1
+    finally:
+        searcher.cleanup()
+        minipop.connection[Search.collection].delete_many({})
+
+
+def test_run_search_progress(minipop, mini_latin_metadata):
+    texts = minipop.find(
+        Text.collection,
+        title=[m['title'] for m in mini_latin_metadata])
+    search_params = _search_params(texts, ['et'])
+    search_params['parallel'] = False
+    results_id = uuid.uuid4().hex
+    SearchProcess.run_search(
+        None, minipop, results_id, 'original', search_params)
+    search = minipop.find(Search.collection, results_id=results_id)[0]
+    assert search.status == Search.DONE
+    assert search.progress['blocks_done'] == search.progress['blocks_total']
+    assert search.progress['matches'] == len(
+        minipop.find(Match.collection, search_id=search.id))
+    assert not cancel_search(minipop, results_id)
+    minipop.connection[Match.collection].delete_many(
+        {'search_id': search.id})
+    minipop.delete(search)
+
+
+def test_run_search_cancelled(minipop, mini_latin_metadata):
+    texts = minipop.find(
+        Text.collection,
+        title=[m['title'] for m in mini_latin_metadata])
+    search_params = _search_params(texts, ['qui'])
+    results_id = uuid.uuid4().hex
+    minipop.insert(Search(results_id=results_id, status=Search.INIT))
+    assert cancel_search(minipop, results_id)
+    SearchProcess.run_search(
+        None, minipop, results_id, 'original', search_params)
+    search = minipop.find(Search.collection, results_id=results_id)[0]
+    assert search.status == Search.CANCELLED
+    assert len(minipop.find(Match.collection, search_id=search.id)) == 0
+    minipop.delete(search)
+
+
+class _FailingMatcher:
+    def __init__(self, connection):
+        pass
+
+    def gen_matches(self, search_id, progress=None, **kwargs):
+        # a full batch is streamed out before the error
+        for i in range(5000):
+            yield Match(search_id=search_id, score=float(i))
+        raise RuntimeError('matching failed')
+
+
+def test_run_search_failed(minipop, monkeypatch):
+    monkeypatch.setitem(tesserae.matchers.matcher_map, 'failing',
+                        _FailingMatcher)
+    results_id = uuid.uuid4().hex
+    minipop.insert(Search(results_id=results_id, status=Search.INIT))
+    SearchProcess.run_search(None, minipop, results_id, 'failing', {})
+    search = minipop.find(Search.collection, results_id=results_id)[0]
+    assert search.status == Search.FAILED
+    assert 'matching failed' in search.msg
+    assert minipop.connection[Match.collection].count_documents(
+        {'search_id': search.id}) == 0
+    minipop.delete(search)